@@ -0,0 +1,27 @@
+# This file houses the routes that Encore calls back to with job progress.
+from flask import Blueprint, request, jsonify
+
+from api.schemas.Response import ResponseMessages, post_response
+from videolib.encore_events import encore_events
+
+
+# Create a Blueprint called "callback_api"
+callback_api_routes = Blueprint("callback_api", __name__)
+
+
+# Encore posts the progress of a job to the progressCallbackUri of the job,
+# ex {"jobId": "...", "externalId": "v-0", "progress": 100, "status": "SUCCESSFUL"}.
+# The event wakes up the pipeline that waits for the job.
+@callback_api_routes.route("/encore_progress", methods=["POST"])
+def encore_progress_route():
+
+    event = request.get_json(silent=True)
+
+    if not isinstance(event, dict) or not encore_events.notify(event):
+        return jsonify(post_response(False, {
+            "message": ResponseMessages["callback_invalid"]
+        })), 400
+
+    return jsonify(post_response(True, {
+        "message": ResponseMessages["callback_received"]
+    }))
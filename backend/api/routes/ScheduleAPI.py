@@ -20,15 +20,30 @@ from api.scheduler.JobDb import (
 
 from api.scheduler.VMAFDb import (
     insert_vmaf_db, get_vmaf_db, update_vmaf_status_db, update_vmaf_score_db,
-    VMAFStatusTypes
+    update_vmaf_frames_db, get_vmaf_cache_db, insert_vmaf_cache_db, VMAFStatusTypes
 )
 
 import videolib.videoprocess as vp
-from videolib.videoinfo import ffprobe_information_json, compute_vmaf_score
-from videolib.encore_wrap import encore_transcode, concat_shots, remux_videos
+from videolib.videoinfo import (
+    ffprobe_information_json, compute_vmaf_score, compute_vmaf_score_shots,
+    video_information
+)
+from videolib.sceneindex import cached_scene_index, scene_index_from_copy
+from videolib.shotcache import shot_cache
+from videolib.vmafcache import VMAFCache, vmaf_cache_key
+from videolib.vmaflog import VMAFFrames, EXTENSION as VMAF_EXTENSION
+from videolib.encore_wrap import (
+    encore_transcode, stream_transcode, start_audio_job, concat_shots, remux_videos,
+    assemble_videos, package_videos, JOB_OVERHEAD
+)
 
 config = yaml.safe_load(open("../config.yml"))["videolib"]
 
+VMAF_MODEL = "videolib/vmaf_models/vmaf_v0.6.1.json"
+
+# VMAF scores stored in the database by the content of the compared videos
+vmaf_cache = VMAFCache(get_vmaf_cache_db, insert_vmaf_cache_db)
+
 
 # Create a Blueprint called "schedule_api"
 schedule_api_routes = Blueprint("schedule_api", __name__)
@@ -53,8 +68,27 @@ def is_valid_video_file(file_path):
     return True
 
 
+# Concatenates the transcoded shots of every rendition and muxes them with the
+# audio. "single-pass" does both in one ffmpeg call per output, "remux" writes
+# the concatenated video first and muxes it in a second pass and "hls"
+# packages all renditions as a fragmented MP4 HLS ladder instead.
+def assemble(shot_names, audio_locations, temp_location, keep_location):
+    # Number of renditions that are concatenated and muxed at the same time
+    workers = config.get("assemblyWorkers", 4)
+
+    if config.get("assembly", "single-pass") == "hls":
+        return package_videos(shot_names, audio_locations, temp_location, keep_location,
+                              config.get("segmentDuration", 2), workers)
+
+    if config.get("assembly", "single-pass") == "remux":
+        video_locations = concat_shots(shot_names, temp_location, workers)
+        return remux_videos(video_locations, audio_locations, keep_location, workers)
+
+    return assemble_videos(shot_names, audio_locations, temp_location, keep_location, workers)
+
+
 # Used in order to process video jobs. Should be executed in a new thread.
-def video_processing(job):
+def video_processing(job, streaming=False):
     print(f"Starting processing of job '{str(job.id)}' in new thread.")
 
     output_location = f"{job.output_location}{job.id}/"
@@ -72,7 +106,6 @@ def video_processing(job):
         return False
 
     only_audio = f"{temp_location}only_audio.wav"
-    vp.copy_audio(job.video_location, only_audio)
 
     container = job.video_location.split("/")
     container = container[len(container)-1]
@@ -80,49 +113,176 @@ def video_processing(job):
     container = container[1]
 
     only_video = f"{temp_location}only_video.{container}"
-    vp.copy_video(job.video_location, only_video)
+
+    if streaming:
+        # Shots are cut and sent to Encore while shot detection is running.
+        vp.demux(job.video_location, only_audio, only_video)
+        job.update_status(JobStatusTypes.Processing)
+
+        shot_names, audio_locations = stream_transcode(
+            job.id, config["encoreUrl"], only_video, only_audio, temp_location,
+            job.shot_parameter, job.shot_length,
+            retries=config.get("shotRetries", 2),
+            shot_timeout=config.get("shotTimeout"))
+        job.update_status(JobStatusTypes.Transcoding)
+
+        outputs_remux = assemble(shot_names, audio_locations, temp_location, keep_location)
+        job.update_status(JobStatusTypes.Completed)
+
+        print(f"Done processing job '{job.id}'.")
+        return
+
+    # The audio does not depend on the shots, it is encoded while the shots
+    # are detected, split and encoded. The source is read once, if it has no
+    # scene index yet the scene scores are computed from the local copy of
+    # the video. The index is reused by later jobs on the same video with
+    # other shot parameters.
+    vp.demux(job.video_location, only_audio, only_video)
+    audio_id = start_audio_job(job.id, config["encoreUrl"], only_audio, temp_location,
+                               config.get("callbackUrl", ""))
+    index = cached_scene_index(job.video_location)
+    if index is None:
+        index = scene_index_from_copy(job.video_location, only_video)
 
     # Detect and split source video into shots.
+    detection = index.format_shot_detection(
+        job.shot_parameter, job.shot_length)
+
+    # Merge neighbouring shots into chunks of about chunkDuration seconds so
+    # short shots do not each pay the overhead of an Encore job.
+    chunks = vp.coalesce_shots(detection, config.get("chunkDuration", 0))
+    if len(chunks) < len(detection):
+        print("Coalesced shots:", vp.coalesce_report(detection, chunks, JOB_OVERHEAD))
+    # The shots are cut on keyframes, the detection is moved to the same
+    # keyframes so the shot durations below belong to the shot files.
+    keyframes = vp.keyframe_times(only_video)
+    detection = vp.snap_to_keyframes(chunks, keyframes)
     shot_names = vp.video_shot_split(
-        only_video, temp_location, job.shot_parameter, job.shot_length)
+        only_video, temp_location, job.shot_parameter, job.shot_length, detection,
+        keyframes=keyframes)
     job.update_status(JobStatusTypes.Processing)
 
-    # Transcode shots using Encore.
+    # Transcode shots using Encore. Shots that an earlier job already encoded
+    # are taken from the shot cache.
+    cache = None
+    if "shotCache" in config:
+        cache = shot_cache(config["shotCache"], config.get("shotCacheBytes", 50 * 1024**3))
     shot_names, audio_locations = encore_transcode(
-        job.id, config["encoreUrl"], shot_names, only_audio, temp_location)
+        job.id, config["encoreUrl"], shot_names, only_audio, temp_location,
+        concurrency=config.get("submitConcurrency", 1),
+        progress_callback_uri=config.get("callbackUrl", ""),
+        max_in_flight=config.get("maxInFlight"),
+        max_queue=config.get("maxQueue", 64),
+        order_policy=config.get("orderPolicy", "timeline"),
+        shot_durations=[float(end) - float(start)
+                        for start, end in zip(detection[:-1], detection[1:])],
+        cache=cache,
+        retries=config.get("shotRetries", 2),
+        shot_timeout=config.get("shotTimeout"),
+        audio_id=audio_id)
     job.update_status(JobStatusTypes.Transcoding)
 
     # Mux transcoded shots together.
-    video_locations = concat_shots(shot_names, temp_location)
-    outputs_remux = remux_videos(
-        video_locations, audio_locations, keep_location)
+    outputs_remux = assemble(shot_names, audio_locations, temp_location, keep_location)
     job.update_status(JobStatusTypes.Completed)
 
     print(f"Done processing job '{job.id}'.")
 
 
+# The filepath of the job's video that VMAF is computed for.
+# TODO: THIS NEEDS TO BE CHANGED IN THE FUTURE. HOWEVER THIS SHOULD WORK NOW.
+def vmaf_processed_video(job):
+    return os.path.join(
+        job.output_location, job.id, "keep", "STEREO_remuxed_encore_x264_crf_23.mp4")
+
+
+# The cache key of the VMAF score of a job and where its per frame scores are
+# kept. The frames are shared by every job with the same key, so a score found
+# in the cache has its frames as well.
+def vmaf_job_key(job, per_shot):
+    key = vmaf_cache_key(job.video_location, vmaf_processed_video(job), VMAF_MODEL,
+                         method="shots" if per_shot else "full")
+    frames_location = os.path.join(config.get("vmafFrames", "vmaf_frames/"),
+                                   f"{key}{VMAF_EXTENSION}")
+
+    return key, os.path.abspath(frames_location)
+
+
 def compute_vmaf(job):
     print(f"Computing VMAF score of job '{str(job.id)}' in a new thread.")
 
-    # Insert job to db.
+    # Insert job to db, a score that was computed before is computed again.
     insert_vmaf_db(job.id)
 
-    # TODO: THIS NEEDS TO BE CHANGED IN THE FUTURE. HOWEVER THIS SHOULD WORK NOW.
-    vmaf_score = compute_vmaf_score(job.video_location, os.path.join(
-        job.output_location, job.id, "keep", "STEREO_remuxed_encore_x264_crf_23.mp4"))
+    processed_video = vmaf_processed_video(job)
+    log_location = os.path.join(job.output_location, job.id, "vmaf", "")
+    per_shot = config.get("vmafPerShot", False)
+
+    def compute():
+        if not vp.make_dir(log_location):
+            return None
+        os.makedirs(os.path.dirname(frames_location), exist_ok=True)
+
+        # The shots of the job come from the scene index
+        index = cached_scene_index(job.video_location)
+        detection = None
+        if index is not None:
+            detection = index.format_shot_detection(job.shot_parameter, job.shot_length)
+
+        if per_shot:
+            # Every shot is scored in its own process. Without an index fixed
+            # chunks are scored.
+            vmaf_score, shots = compute_vmaf_score_shots(
+                job.video_location, processed_video, detection, log_location,
+                model_path=VMAF_MODEL)
+            if shots is None:
+                return None
+
+            frames = VMAFFrames.from_shot_logs(
+                [f"{log_location}vmaf_shot_{count}.json" for count in range(len(shots["shots"]))])
+        else:
+            log_path = f"{log_location}vmaf.json"
+            vmaf_score = compute_vmaf_score(job.video_location, processed_video,
+                                            model_path=VMAF_MODEL, log_path=log_path)
+            if vmaf_score == '':
+                return None
+
+            frame_rate = None
+            if detection is not None:
+                frame_rate = video_information(job.video_location)["frame_rate"]
+            frames = VMAFFrames.from_log(log_path, detection, frame_rate)
+
+        # The per frame scores are kept for /vmaf_stats without the json log
+        frames.save(frames_location)
+
+        return float(vmaf_score)
+
+    # Videos that were scored before, by this or another job, are not scored
+    # again and a request for a score that is being computed waits for it.
+    try:
+        key, frames_location = vmaf_job_key(job, per_shot)
+        vmaf_score = vmaf_cache.score(key, compute)
+    except Exception as e:
+        print(f"Could not compute VMAF score of job '{job.id}'", e)
+        vmaf_score = None
 
-    if vmaf_score == '':
+    if vmaf_score is None:
         # Change status of vmaf compute to failed.
         update_vmaf_status_db(job.id, VMAFStatusTypes.Failed)
 
         print(f"Failed to compute VMAF score of job '{job.id}'.")
     else:
-        # Change status of vmaf compute to completed.
-        update_vmaf_status_db(job.id, VMAFStatusTypes.Completed)
-
         # Update score.
         update_vmaf_score_db(job.id, vmaf_score)
 
+        # The statistics are read from the frames the score was computed with,
+        # whatever the config is when they are asked for.
+        if os.path.isfile(frames_location):
+            update_vmaf_frames_db(job.id, frames_location)
+
+        # Change status of vmaf compute to completed.
+        update_vmaf_status_db(job.id, VMAFStatusTypes.Completed)
+
         print(f"Successfully computed VMAF score of job '{job.id}'.")
 
 
@@ -146,7 +306,8 @@ def schedule_jobs_route():
         job = Job(result["shot_parameter"], result["shot_length"],
                   result["video_location"], result["output_location"])
 
-        handle = threading.Thread(target=video_processing, args=(job,))
+        handle = threading.Thread(target=video_processing, args=(
+            job, result["streaming"]))
         handle.start()
 
         return jsonify(post_response_job(
@@ -225,6 +386,30 @@ def vmaf_get(job_id):
         return jsonify(post_response_vmaf(True, vmaf_data))
 
 
+# Returns the mean, harmonic mean, 1st and 5th percentile and min of the per
+# frame VMAF scores of a job. With ?per_shot=true the statistics of every
+# shot are included.
+@schedule_api_routes.route("/vmaf_stats/<job_id>", methods=["GET"])
+def vmaf_stats(job_id):
+
+    if not is_valid_jobid(job_id):
+        return "Not a valid job id", 400
+
+    vmaf_data = get_vmaf_db(job_id)
+
+    if vmaf_data is None or vmaf_data.get("frames_location") is None:
+        return jsonify(post_response_vmaf(False, ResponseMessages["vmaf_not_computed"]))
+
+    frames = VMAFFrames.load(vmaf_data["frames_location"])
+
+    if frames is None:
+        return jsonify(post_response_vmaf(False, ResponseMessages["vmaf_not_computed"]))
+
+    per_shot = request.args.get("per_shot", "false").lower() == "true"
+
+    return jsonify(post_response_vmaf(True, frames.statistics(per_shot)))
+
+
 @schedule_api_routes.route("/vmaf_compute/<job_id>", methods=["GET"])
 def vmaf_compute(job_id):
 
@@ -237,6 +422,11 @@ def vmaf_compute(job_id):
     if job == None:
         return f"Job with id '{job_id}' does not exist", 400
 
+    # The score of the job is already being computed
+    vmaf_data = get_vmaf_db(job_id)
+    if vmaf_data is not None and vmaf_data["status"] == VMAFStatusTypes.Computing:
+        return jsonify(post_response_vmaf(True, ResponseMessages["vmaf_computing"]))
+
     handle = threading.Thread(target=compute_vmaf, args=(job,))
     handle.start()
 
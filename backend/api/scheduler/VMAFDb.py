@@ -40,25 +40,59 @@ VMAF_TABLE_SQL = f'''CREATE TABLE IF NOT EXISTS {VMAF_TABLE} (
     id                                CHAR(36),
     status                            TEXT,
     score                             FLOAT,
+    frames_location                   TEXT,
     PRIMARY KEY(id)
 )'''
 
-CREATE_VMAF_SQL = f"INSERT INTO {VMAF_TABLE} VALUES (%s, '{VMAFStatusTypes.Computing}', 0.0)"
+# Tables created before the per frame scores were kept get the column added
+ADD_FRAMES_VMAF_SQL = f"ALTER TABLE {VMAF_TABLE} ADD COLUMN frames_location TEXT"
+DUPLICATE_COLUMN_ERRNO = 1060
+
+# A score that was computed before is computed again
+CREATE_VMAF_SQL = f"""INSERT INTO {VMAF_TABLE} (id, status, score)
+    VALUES (%s, '{VMAFStatusTypes.Computing.value}', 0.0)
+    ON DUPLICATE KEY UPDATE status = VALUES(status)"""
+
+# Scores that were being computed when the server stopped are never finished
+FAIL_COMPUTING_VMAF_SQL = f"""UPDATE {VMAF_TABLE} SET status = '{VMAFStatusTypes.Failed.value}'
+    WHERE status = '{VMAFStatusTypes.Computing.value}'"""
 
 GET_VMAF_SQL = f"SELECT * FROM {VMAF_TABLE} WHERE id = %s"
 
 UPDATE_STATUS_VMAF_SQL = f"UPDATE {VMAF_TABLE} SET status = %s WHERE id = %s"
 UPDATE_SCORE_VMAF_SQL = f"UPDATE {VMAF_TABLE} SET score = %s WHERE id = %s"
+UPDATE_FRAMES_VMAF_SQL = f"UPDATE {VMAF_TABLE} SET frames_location = %s WHERE id = %s"
+
+# Scores by the content of the compared videos, see videolib/vmafcache.py.
+VMAF_CACHE_TABLE = "vmaf_cache"
+
+VMAF_CACHE_TABLE_SQL = f'''CREATE TABLE IF NOT EXISTS {VMAF_CACHE_TABLE} (
+    cache_key                         CHAR(64),
+    score                             FLOAT,
+    PRIMARY KEY(cache_key)
+)'''
+
+GET_VMAF_CACHE_SQL = f"SELECT score FROM {VMAF_CACHE_TABLE} WHERE cache_key = %s"
+
+INSERT_VMAF_CACHE_SQL = f"""INSERT INTO {VMAF_CACHE_TABLE} VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE score = VALUES(score)"""
 
 
 # Creates the table where all VMAF scores are stored. Should be called on every start
 # of the server.
 def create_vmaf_db():
     db_cur.execute(VMAF_TABLE_SQL)
+    try:
+        db_cur.execute(ADD_FRAMES_VMAF_SQL)
+    except mysql.connector.Error as e:
+        if e.errno != DUPLICATE_COLUMN_ERRNO:
+            raise
+    db_cur.execute(VMAF_CACHE_TABLE_SQL)
+    db_cur.execute(FAIL_COMPUTING_VMAF_SQL)
     db.commit()
 
 
-# Inserts a new VMAF metric to the database.
+# Inserts a new VMAF metric to the database, or sets an existing one to computing.
 def insert_vmaf_db(job_id):
     db_cur.execute(CREATE_VMAF_SQL, (job_id,))
     db.commit()
@@ -81,3 +115,22 @@ def update_vmaf_status_db(job_id, status_type):
 def update_vmaf_score_db(job_id, score):
     db_cur.execute(UPDATE_SCORE_VMAF_SQL, (score, job_id))
     db.commit()
+
+
+# Stores where the per frame scores of a job are, see videolib/vmaflog.py.
+def update_vmaf_frames_db(job_id, frames_location):
+    db_cur.execute(UPDATE_FRAMES_VMAF_SQL, (frames_location, job_id))
+    db.commit()
+
+
+# Retrieves a cached score, None if the key is not cached.
+def get_vmaf_cache_db(cache_key):
+    db_cur.execute(GET_VMAF_CACHE_SQL, (cache_key,))
+    result = db_cur.fetchone()
+    return None if result is None else result["score"]
+
+
+# Stores the score of a key in the cache.
+def insert_vmaf_cache_db(cache_key, score):
+    db_cur.execute(INSERT_VMAF_CACHE_SQL, (cache_key, score))
+    db.commit()
@@ -7,6 +7,8 @@ ResponseMessages = {
     "job_sch_fail": "Failed to scheduled job",
     "vmaf_not_computed": "VMAF not computed",
     "vmaf_computing": "Computing VMAF",
+    "callback_received": "Progress received",
+    "callback_invalid": "Not a valid progress event",
 }
 
 
@@ -12,3 +12,5 @@ class ScheduleJobSchema(Schema):
         required=True, validate=Range(min=0.0, max=1000.0))
     video_location = fields.String(required=True)
     output_location = fields.String(required=True)
+    # Cut and transcode shots while shot detection is running.
+    streaming = fields.Boolean(load_default=False)
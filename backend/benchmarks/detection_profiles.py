@@ -0,0 +1,157 @@
+"""! Compares the shot detection profiles in videoprocess.DETECTION_PROFILES
+
+Synthetic clips with known cuts are generated with ffmpeg. Every profile is
+run on every clip and its cut list is compared against the full resolution
+detector and against the known cuts.
+
+Run from the backend directory:
+    python -m benchmarks.detection_profiles --output /tmp/detection_bench/
+"""
+import argparse
+import json
+import time
+
+import videolib.videoprocess as vp
+
+# Sources used for the shots of the synthetic clips. Neighbouring shots use
+# different sources so every boundary is a real cut.
+SOURCES = [
+    "testsrc2=size={size}:rate={rate}",
+    "mandelbrot=size={size}:rate={rate}",
+    "smptehdbars=size={size}:rate={rate}",
+    "cellauto=size={size}:rate={rate}:rule=110",
+    "life=size={size}:rate={rate}:mold=10:ratio=0.1",
+    "rgbtestsrc=size={size}:rate={rate}",
+]
+
+CLIPS = {
+    "uhd": {"size": "3840x2160", "rate": 25, "shots": [2.0, 3.5, 1.0, 4.0, 2.5, 3.0]},
+    "hd": {"size": "1920x1080", "rate": 50, "shots": [1.5, 0.5, 3.0, 2.0, 4.0, 1.0]},
+}
+
+
+def create_clip(output_location, size, rate, shots):
+    """! Creates a clip of concatenated synthetic shots encoded with B-frames
+
+    @param output_location  The filepath of the clip
+    @param size             The resolution of the clip, ex 1920x1080
+    @param rate             The frame rate of the clip
+    @param shots            The durations of the shots in seconds
+
+    @return The timestamps of the cuts in the clip
+    """
+    inputs = ""
+    for count, duration in enumerate(shots):
+        source = SOURCES[count % len(SOURCES)].format(size=size, rate=rate)
+        inputs += f' -f lavfi -t {duration} -i "{source}"'
+
+    streams = "".join(f"[{count}:v]" for count in range(len(shots)))
+
+    command = f'ffmpeg -y -hide_banner -v error {inputs} \
+                -filter_complex "{streams}concat=n={len(shots)}:v=1:a=0,format=yuv420p" \
+                -c:v libx264 -preset veryfast -bf 3 -g 50 {output_location}'
+
+    result = vp.call_subprocess(command)
+    vp.subprocess_error(result, "Create clip")
+
+    cuts = []
+    timestamp = 0.0
+    for duration in shots[:-1]:
+        timestamp += duration
+        cuts.append(timestamp)
+
+    return cuts
+
+
+def match_cuts(detected, reference, tolerance):
+    """! Matches detected cuts against reference cuts
+
+    @param detected     The detected timestamps
+    @param reference    The timestamps that are considered correct
+    @param tolerance    Max distance in seconds for two cuts to match
+
+    @return Dictionary with precision, recall and mean offset of the matched cuts
+    """
+    unmatched = list(reference)
+    offsets = []
+
+    for cut in detected:
+        closest = min(unmatched, key=lambda ref: abs(ref - cut), default=None)
+        if closest is not None and abs(closest - cut) <= tolerance:
+            unmatched.remove(closest)
+            offsets.append(abs(closest - cut))
+
+    matched = len(offsets)
+
+    return {
+        "precision": matched / len(detected) if len(detected) > 0 else 1.0,
+        "recall": matched / len(reference) if len(reference) > 0 else 1.0,
+        "mean_offset": sum(offsets) / matched if matched > 0 else 0.0,
+    }
+
+
+def detect(clip, shot_parameter, profile):
+    """! Runs shot detection with a profile and returns the cuts and the time it took"""
+    start_time = time.time()
+    detection = vp.format_shot_detection(
+        clip, shot_parameter, profile=profile)
+    duration = time.time() - start_time
+
+    # Remove start and end of the video, only the cuts are compared
+    cuts = [float(timestamp) for timestamp in detection[1:-1]]
+
+    return cuts, duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="/tmp/detection_bench/",
+                        help="directory for the synthetic clips")
+    parser.add_argument("--shot-parameter", type=float, default=0.3)
+    parser.add_argument("--result", help="write the results as json to this file")
+    args = parser.parse_args()
+
+    if not vp.make_dir(args.output):
+        return False
+
+    results = {}
+
+    for name, clip in CLIPS.items():
+        location = f"{args.output}{name}.mp4"
+        truth = create_clip(location, clip["size"], clip["rate"], clip["shots"])
+        # Profiles that skip frames may report a cut on the next decoded frame
+        tolerance = 1.5 / clip["rate"]
+
+        full_cuts, full_time = detect(location, args.shot_parameter, "full")
+        results[name] = {}
+
+        for profile in vp.DETECTION_PROFILES:
+            if profile == "full":
+                cuts, duration = full_cuts, full_time
+            else:
+                cuts, duration = detect(location, args.shot_parameter, profile)
+
+            results[name][profile] = {
+                "time": duration,
+                "speedup": full_time / duration if duration > 0 else 0.0,
+                "cuts": cuts,
+                "vs_full": match_cuts(cuts, full_cuts, tolerance),
+                "vs_truth": match_cuts(cuts, truth, tolerance),
+            }
+
+    print(f"{'clip':6} {'profile':8} {'time':>8} {'speedup':>8} "
+          f"{'prec/full':>10} {'rec/full':>9} {'prec/truth':>11} {'rec/truth':>10}")
+    for name, profiles in results.items():
+        for profile, result in profiles.items():
+            print(f"{name:6} {profile:8} {result['time']:8.2f} {result['speedup']:8.2f} "
+                  f"{result['vs_full']['precision']:10.2f} {result['vs_full']['recall']:9.2f} "
+                  f"{result['vs_truth']['precision']:11.2f} {result['vs_truth']['recall']:10.2f}")
+
+    if args.result:
+        with open(args.result, "w") as json_file:
+            json.dump(results, json_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
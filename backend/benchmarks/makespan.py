@@ -0,0 +1,171 @@
+"""! Simulates how long Encore takes to transcode all shots of a video with
+the submission orders in encore_wrap.ORDER_POLICIES
+
+Encore is modelled as a number of workers that take the next submitted shot
+when they are free. The makespan is the time until the last shot is done.
+The cut list is read from a file with one timestamp per line, or computed
+from a video with its scene index.
+
+How long every shot takes is read with --jobs from the Encore job responses
+of a transcode of the same cut list, one response per shot in timeline
+order as returned by GET /encoreJobs/{id}, and measured from startedDate to
+completedDate. The policies still order the shots by duration and predicted
+cost, so the result shows how the orders do on real encode times. Without
+--jobs every shot takes encore_wrap.predicted_cost seconds, then the "cost"
+policy is simulated with its own model and the numbers are no measurement.
+
+Run from the backend directory:
+    python -m benchmarks.makespan --cuts cuts.txt --jobs jobs.json --workers 8
+    python -m benchmarks.makespan --video video.mp4 --threshold 0.3 --shot-length 1
+"""
+import argparse
+import heapq
+import json
+
+from videolib.encore_wrap import (
+    ORDER_POLICIES, JOB_OVERHEAD, PIXEL_RATE, predicted_cost, calc_time
+)
+
+
+def read_cuts(location):
+    """! Reads a cut list with one timestamp per line, the first and last
+        timestamps are the start and end of the video
+
+    @param location     The filepath of the cut list
+
+    @return The timestamps as floats
+    """
+    with open(location) as f:
+        return [float(line) for line in f if line.strip() != ""]
+
+
+def recorded_costs(location):
+    """! Reads how long Encore took for every shot from saved job responses
+
+    @param location     The filepath of a json list with the Encore job
+                        response of every shot in timeline order
+
+    @return The seconds from start to completion of every job
+    """
+    with open(location) as f:
+        responses = json.load(f)
+
+    return [calc_time(response["startedDate"], response["completedDate"])
+            for response in responses]
+
+
+def makespan(costs, order, workers):
+    """! The time until all jobs are done when they are started in 'order'
+        on the first free worker
+
+    @param costs    The time of every job
+    @param order    The indices of the jobs in submission order
+    @param workers  Number of jobs that run at the same time
+
+    @return The makespan in seconds
+    """
+    free = [0.0] * min(workers, max(len(costs), 1))
+
+    for count in order:
+        start = heapq.heappop(free)
+        heapq.heappush(free, start + costs[count])
+
+    return max(free)
+
+
+def simulate(timestamps, workers, width=1920, height=1080, frame_rate=25,
+             job_overhead=JOB_OVERHEAD, pixel_rate=PIXEL_RATE, costs=None):
+    """! Simulates every order policy on a cut list
+
+    @param timestamps   The timestamps of the shots including start and end
+    @param workers      Number of shots Encore transcodes at the same time
+    @param costs        The measured seconds of every shot, for example from
+                        recorded_costs. If None the predicted costs are used.
+
+    @return Dictionary with the makespan of every policy and a lower bound
+    """
+    durations = [end - start for start, end in zip(timestamps[:-1], timestamps[1:])]
+    predicted = [predicted_cost(duration, width, height, frame_rate, job_overhead, pixel_rate)
+                 for duration in durations]
+
+    measured = costs is not None
+    if not measured:
+        costs = predicted
+    elif len(costs) != len(durations):
+        raise ValueError(f"{len(costs)} recorded jobs for {len(durations)} shots")
+
+    # The orders only use what is known before encoding. The shots of one
+    # video share the resolution, so "longest" and "cost" give the same order here
+    orders = {
+        "timeline": list(range(0, len(costs))),
+        "longest": sorted(range(0, len(costs)), key=lambda count: -durations[count]),
+        "cost": sorted(range(0, len(costs)), key=lambda count: -predicted[count]),
+    }
+
+    result = {
+        "shots": len(costs),
+        "workers": workers,
+        "measured": measured,
+        # No order can be faster than the longest shot or a perfect split of the work
+        "lower_bound": max(max(costs, default=0.0), sum(costs) / workers),
+    }
+    for policy in ORDER_POLICIES:
+        result[policy] = makespan(costs, orders[policy], workers)
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cuts", help="file with one timestamp per line")
+    parser.add_argument("--video", help="video to compute the cut list from")
+    parser.add_argument("--jobs", help="json list of the Encore job responses of the shots")
+    parser.add_argument("--threshold", type=float, default=0.3)
+    parser.add_argument("--shot-length", type=float, default=0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--frame-rate", type=float, default=25)
+    parser.add_argument("--job-overhead", type=float, default=JOB_OVERHEAD,
+                        help="seconds Encore spends on every job besides encoding")
+    parser.add_argument("--pixel-rate", type=float, default=PIXEL_RATE,
+                        help="pixels Encore encodes per second in one job")
+    parser.add_argument("--result", help="write the results as json to this file")
+    args = parser.parse_args()
+
+    if args.cuts:
+        timestamps = read_cuts(args.cuts)
+    elif args.video:
+        # Only needed for videos, a cut list can be simulated without ffmpeg
+        from videolib.sceneindex import scene_index
+        index = scene_index(args.video, workers=None)
+        timestamps = [float(timestamp) for timestamp in
+                      index.format_shot_detection(args.threshold, args.shot_length)]
+    else:
+        parser.error("one of --cuts or --video is required")
+
+    costs = recorded_costs(args.jobs) if args.jobs else None
+    if costs is None:
+        print("No --jobs given, the shots take their predicted cost and the "
+              "results are a model, not a measurement")
+
+    results = [simulate(timestamps, workers, args.width, args.height, args.frame_rate,
+                        args.job_overhead, args.pixel_rate, costs)
+               for workers in args.workers]
+
+    print(f"{'workers':>7} {'shots':>6} {'timeline':>9} {'longest':>9} {'cost':>9} "
+          f"{'bound':>9} {'speedup':>8}")
+    for result in results:
+        speedup = result["timeline"] / result["longest"] if result["longest"] > 0 else 0.0
+        print(f"{result['workers']:7} {result['shots']:6} {result['timeline']:9.1f} "
+              f"{result['longest']:9.1f} {result['cost']:9.1f} "
+              f"{result['lower_bound']:9.1f} {speedup:8.2f}")
+
+    if args.result:
+        with open(args.result, "w") as json_file:
+            json.dump(results, json_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+# A local stand-in for Encore that transcodes with ffmpeg. It implements the
+# part of the Encore REST API that videolib.encore.Encore uses, so the whole
+# pipeline can be benchmarked on a dev box or in CI without a real Encore.
+#
+# Run it from the backend directory and point videolib.encoreUrl in
+# config.yml to it:
+#   python encore_local.py --port 8080 --workers 4 --latency 0.05
+import argparse
+import heapq
+import itertools
+import os
+import subprocess as sp
+import threading
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import requests
+from flask import Flask, request, jsonify
+
+# The outputs of every profile: name suffix, output type, container and
+# ffmpeg arguments. Names follow Encore, "{baseName}_{suffix}.{container}".
+PROFILES = {
+    "shot-change-video-only": [
+        ("x264_crf_23", "VideoFile", "mp4", "-an -c:v libx264 -preset veryfast -crf 23"),
+        ("x264_crf_23_720p", "VideoFile", "mp4",
+         "-an -vf scale=-2:720 -c:v libx264 -preset veryfast -crf 23"),
+    ],
+    "shot-change-video": [
+        ("x264_crf_23", "VideoFile", "mp4",
+         "-c:v libx264 -preset veryfast -crf 23 -c:a aac -b:a 128k"),
+        ("x264_crf_23_720p", "VideoFile", "mp4",
+         "-vf scale=-2:720 -c:v libx264 -preset veryfast -crf 23 -c:a aac -b:a 128k"),
+    ],
+    "audio-only": [
+        ("STEREO", "AudioFile", "mp4", "-vn -c:a aac -b:a 128k -ac 2"),
+    ],
+}
+
+app = Flask(__name__)
+
+settings = {
+    "latency": 0.0,
+    "job_latency": 0.0,
+}
+
+jobs = {}
+jobs_lock = threading.Lock()
+
+# Queued job ids ordered by priority (highest first) and creation order
+queue = []
+queue_order = itertools.count()
+queue_condition = threading.Condition(jobs_lock)
+
+# ffmpeg processes of running jobs, used to cancel them
+processes = {}
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def send_progress(job):
+    if job.get("progressCallbackUri", "") == "":
+        return
+
+    try:
+        requests.post(job["progressCallbackUri"], json={
+            "jobId": job["id"],
+            "externalId": job["externalId"],
+            "progress": job["progress"],
+            "status": job["status"],
+        }, timeout=5)
+    except requests.exceptions.RequestException as e:
+        print(f"Could not send progress of job {job['id']}", e)
+
+
+def transcode(job):
+    output_dir = job["outputFolder"]
+    os.makedirs(output_dir, exist_ok=True)
+
+    outputs = []
+    for suffix, output_type, container, arguments in PROFILES[job["profile"]]:
+        if job["status"] == "CANCELLED":
+            raise Exception("Cancelled")
+
+        output_file = os.path.join(output_dir, f"{job['baseName']}_{suffix}.{container}")
+        command = ["ffmpeg", "-y", "-hide_banner", "-v", "error",
+                   "-i", job["inputs"][0]["uri"]] + arguments.split() + [output_file]
+
+        process = sp.Popen(command, stdout=sp.DEVNULL, stderr=sp.PIPE, text=True)
+        with jobs_lock:
+            processes[job["id"]] = process
+        _, stderr = process.communicate()
+        with jobs_lock:
+            processes.pop(job["id"], None)
+
+        if process.returncode != 0:
+            raise Exception(stderr.strip() or f"ffmpeg failed with code {process.returncode}")
+
+        outputs.append({
+            "type": output_type,
+            "file": output_file,
+            "fileSize": os.path.getsize(output_file),
+            "format": container,
+        })
+
+    return outputs
+
+
+def worker():
+    while True:
+        with queue_condition:
+            while len(queue) == 0:
+                queue_condition.wait()
+            _, _, job_id = heapq.heappop(queue)
+            job = jobs[job_id]
+            if job["status"] != "QUEUED":
+                continue
+            job["status"] = "IN_PROGRESS"
+            job["startedDate"] = now()
+
+        send_progress(job)
+        time.sleep(settings["job_latency"])
+
+        try:
+            outputs = transcode(job)
+            status, message = "SUCCESSFUL", None
+        except Exception as e:
+            outputs, status, message = [], "FAILED", str(e)
+
+        with jobs_lock:
+            # A cancelled job keeps its status
+            if job["status"] == "IN_PROGRESS":
+                job["status"] = status
+                job["message"] = message
+                job["output"] = outputs
+                job["progress"] = 100
+            job["completedDate"] = now()
+
+        send_progress(job)
+
+
+def page_response(items, page, size):
+    total_pages = (len(items) + size - 1) // size
+    return {
+        "_embedded": {"encoreJobs": items[page * size:(page + 1) * size]},
+        "page": {
+            "size": size,
+            "totalElements": len(items),
+            "totalPages": total_pages,
+            "number": page,
+        },
+    }
+
+
+def sorted_jobs(status=None):
+    with jobs_lock:
+        items = [dict(job) for job in jobs.values()
+                 if status is None or job["status"] == status]
+
+    reverse = request.args.get("sort", "ASC").upper() == "DESC"
+    return sorted(items, key=lambda job: job["createdDate"], reverse=reverse)
+
+
+@app.before_request
+def inject_latency():
+    time.sleep(settings["latency"])
+
+
+@app.route("/encoreJobs", methods=["POST"])
+def create_job_route():
+    data = request.get_json(silent=True)
+
+    if not isinstance(data, dict) or data.get("profile") not in PROFILES \
+            or len(data.get("inputs", [])) == 0:
+        return jsonify(error="Bad request"), 400
+
+    job = {
+        "id": str(uuid4()),
+        "externalId": data.get("externalId"),
+        "profile": data["profile"],
+        "outputFolder": data.get("outputFolder", "/tmp"),
+        "baseName": data.get("baseName", "encore"),
+        "progressCallbackUri": data.get("progressCallbackUri", ""),
+        "priority": int(data.get("priority", 0)),
+        "debugOverlay": data.get("debugOverlay", "false"),
+        "logContext": data.get("logContext", {}),
+        "inputs": data["inputs"],
+        "output": [],
+        "progress": 0,
+        "status": "QUEUED",
+        "message": None,
+        "createdDate": now(),
+        "startedDate": None,
+        "completedDate": None,
+    }
+
+    with queue_condition:
+        jobs[job["id"]] = job
+        heapq.heappush(queue, (-job["priority"], next(queue_order), job["id"]))
+        queue_condition.notify()
+        response = dict(job)
+
+    return jsonify(response), 201
+
+
+@app.route("/encoreJobs", methods=["GET"])
+def get_jobs_route():
+    page = int(request.args.get("page", 0))
+    size = int(request.args.get("size", 20))
+    return jsonify(page_response(sorted_jobs(), page, size))
+
+
+@app.route("/encoreJobs/search/findByStatus", methods=["GET"])
+def find_job_by_status_route():
+    page = int(request.args.get("page", 0))
+    size = int(request.args.get("size", 20))
+    status = request.args.get("status", "QUEUED")
+    return jsonify(page_response(sorted_jobs(status), page, size))
+
+
+@app.route("/encoreJobs/<job_id>", methods=["GET"])
+def get_job_route(job_id):
+    with jobs_lock:
+        if job_id not in jobs:
+            return jsonify(error="Not found"), 404
+        return jsonify(dict(jobs[job_id]))
+
+
+@app.route("/encoreJobs/<job_id>/cancel", methods=["POST"])
+def cancel_job_route(job_id):
+    with jobs_lock:
+        if job_id not in jobs:
+            return jsonify(error="Not found"), 404
+
+        job = jobs[job_id]
+        if job["status"] not in ("NEW", "QUEUED", "IN_PROGRESS"):
+            return jsonify(error="Job is not active"), 409
+
+        job["status"] = "CANCELLED"
+        job["message"] = "Cancelled"
+        if job_id in processes:
+            processes[job_id].kill()
+
+    return "", 200
+
+
+@app.route("/queue", methods=["GET"])
+def queue_route():
+    with jobs_lock:
+        items = [{"id": job_id, "priority": -priority, "created": jobs[job_id]["createdDate"]}
+                 for priority, _, job_id in sorted(queue)
+                 if jobs[job_id]["status"] == "QUEUED"]
+    return jsonify(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Encore stand-in backed by ffmpeg")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of jobs transcoded at the same time")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every request")
+    parser.add_argument("--job-latency", type=float, default=0.0,
+                        help="seconds added before every job starts")
+    args = parser.parse_args()
+
+    settings["latency"] = args.latency
+    settings["job_latency"] = args.job_latency
+
+    for _ in range(args.workers):
+        threading.Thread(target=worker, daemon=True).start()
+
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ from flask import Flask, send_from_directory
 from flask_cors import CORS
 
 from api.routes.ScheduleAPI import schedule_api_routes
+from api.routes.CallbackAPI import callback_api_routes
 from api.scheduler.Job import create_job_table_db
 from api.scheduler.VMAFDb import create_vmaf_db
 
@@ -19,6 +20,7 @@ CORS(app)
 
 # Register any imported blueprints
 app.register_blueprint(schedule_api_routes, url_prefix="/api")
+app.register_blueprint(callback_api_routes, url_prefix="/api")
 
 
 # Catch-all route that tries to serve static file if it exists, otherwise
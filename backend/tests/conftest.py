@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+# The tests import videolib like the backend does, from the backend
+# directory, where the modules also find ../config.yml
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+
+from videolib import encore_wrap
+
+
+class FakeEncore:
+    """Encore that finishes every job at once. 'statuses' maps a shot path
+    to the statuses of its next jobs, a job is SUCCESSFUL when none is left."""
+
+    def __init__(self, statuses=None):
+        self.statuses = {path: list(values) for path, values in (statuses or {}).items()}
+        self.jobs = {}
+        self.created = []
+        self.cancelled = []
+
+    def create_job(self, data):
+        path = data["inputs"][0]["uri"]
+        statuses = self.statuses.get(path, [])
+        status = statuses.pop(0) if len(statuses) > 0 else "SUCCESSFUL"
+
+        job_id = f"job-{len(self.jobs)}"
+        self.jobs[job_id] = {
+            "id": job_id,
+            "status": status,
+            "message": f"{path} {status}",
+            "output": [{"type": "VideoFile", "file": f"{path}.out"}],
+        }
+        self.created.append(path)
+        return {"id": job_id}
+
+    def get_job(self, job_id):
+        return self.jobs[job_id]
+
+    def cancel_job(self, job_id):
+        self.cancelled.append(job_id)
+
+    def find_job_by_status(self, status, page=0, size=100):
+        jobs = [job for job in self.jobs.values() if job["status"] == status]
+        return {"_embedded": {"encoreJobs": jobs}, "page": {"totalPages": 1}}
+
+    def metrics(self):
+        return {}
+
+
+def response(path, status="SUCCESSFUL"):
+    return {"id": path, "status": status, "message": f"{path} {status}",
+            "output": [{"type": "VideoFile", "file": f"{path}.out"}]}
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(encore_wrap.time, "sleep", lambda delay: None)
+
+
+@pytest.fixture
+def base_dir(tmp_path):
+    return f"{tmp_path}/"
@@ -0,0 +1,65 @@
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from videolib.encore import Encore
+
+
+class FakeResponse:
+    status_code = 201
+
+    def json(self):
+        return {"id": "job-0"}
+
+
+class FakeSession:
+    """Session that raises the given exceptions and then responds"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        return FakeResponse()
+
+
+def refused():
+    reason = NewConnectionError(None, "Connection refused")
+    return requests.exceptions.ConnectionError(MaxRetryError(None, "/encoreJobs", reason))
+
+
+def dropped():
+    reason = ProtocolError("Connection aborted.")
+    return requests.exceptions.ConnectionError(reason)
+
+
+def encore_with(errors):
+    encore = Encore("http://encore", backoff=0)
+    encore.session = FakeSession(errors)
+    return encore
+
+
+@pytest.mark.parametrize("error", [refused, lambda: requests.exceptions.ConnectTimeout()])
+def test_create_job_is_retried_before_it_reaches_encore(error):
+    encore = encore_with([error()])
+
+    assert encore.create_job({}) == {"id": "job-0"}
+    assert encore.session.calls == 2
+
+
+@pytest.mark.parametrize("error", [dropped, lambda: requests.exceptions.ReadTimeout()])
+def test_create_job_is_not_retried_after_it_may_have_reached_encore(error):
+    encore = encore_with([error()])
+
+    assert not encore.create_job({})
+    assert encore.session.calls == 1
+
+
+def test_get_is_retried_on_any_connection_error():
+    encore = encore_with([dropped(), requests.exceptions.ReadTimeout()])
+
+    assert encore.request("GET", "/encoreJobs/job-0").status_code == 201
+    assert encore.session.calls == 3
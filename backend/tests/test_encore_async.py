@@ -0,0 +1,94 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from conftest import FakeEncore
+from videolib import encore_wrap
+from videolib.encore_async import AsyncEncore
+
+
+class AsyncFakeResponse:
+    status = 201
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def text(self):
+        return '{"id": "job-0"}'
+
+
+class AsyncFakeSession:
+    """Session that raises the given exceptions and then responds"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        return AsyncFakeResponse()
+
+
+# aiohttp before 3.10 raises ServerTimeoutError for both timeouts
+def connect_timeout():
+    error = getattr(aiohttp, "ConnectionTimeoutError", aiohttp.ServerTimeoutError)
+    return error("Connection timeout to host http://encore")
+
+
+def read_timeout():
+    error = getattr(aiohttp, "SocketTimeoutError", aiohttp.ServerTimeoutError)
+    return error("Timeout on reading data from socket")
+
+
+@pytest.mark.parametrize("error, retried", [(connect_timeout, True), (read_timeout, False),
+                                            (aiohttp.ServerDisconnectedError, False)])
+def test_async_create_job_retries_like_encore(error, retried):
+    encore = AsyncEncore("http://encore", backoff=0)
+    encore.session = AsyncFakeSession([error()])
+
+    response = asyncio.run(encore.create_job({}))
+
+    assert bool(response) == retried
+    assert encore.session.calls == (2 if retried else 1)
+
+
+class AsyncFakeEncore:
+    """Async wrapper of a FakeEncore where every job is done after 'ticks' gets"""
+
+    def __init__(self, encore, ticks=1):
+        self.encore = encore
+        self.ticks = ticks
+        self.gets = {}
+
+    async def get_job(self, job_id):
+        self.gets[job_id] = self.gets.get(job_id, 0) + 1
+        if self.gets[job_id] < self.ticks:
+            return dict(self.encore.get_job(job_id), status="IN_PROGRESS")
+        return self.encore.get_job(job_id)
+
+    async def find_job_by_status(self, status, page=0, size=100):
+        return self.encore.find_job_by_status(status, page, size)
+
+
+def test_async_poll_jobs(monkeypatch):
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr(encore_wrap.asyncio, "sleep", no_sleep)
+    encore = FakeEncore({"2.mp4": ["FAILED"]})
+    job_ids = [encore.create_job({"inputs": [{"uri": f"{count}.mp4"}]})["id"]
+               for count in range(6)]
+
+    responses = encore_wrap.asyncio.run(
+        encore_wrap.async_poll_jobs(AsyncFakeEncore(encore, ticks=2), job_ids[3:]))
+    assert [response["id"] for response in responses] == job_ids[3:]
+
+    message = encore_wrap.asyncio.run(
+        encore_wrap.async_poll_jobs(AsyncFakeEncore(encore), job_ids))
+    assert message == "2.mp4 FAILED"
@@ -0,0 +1,121 @@
+import itertools
+from datetime import datetime, timezone
+
+import pytest
+
+from conftest import FakeEncore
+from videolib import encore_wrap
+
+pytestmark = pytest.mark.usefixtures("no_sleep")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.time() that moves one second every time it is read"""
+    seconds = itertools.count()
+    monkeypatch.setattr(encore_wrap.time, "time", lambda: next(seconds))
+
+
+def test_poll_jobs_times_out(clock):
+    encore = FakeEncore({"a.mp4": ["IN_PROGRESS"]})
+    job_id = encore.create_job({"inputs": [{"uri": "a.mp4"}]})["id"]
+    encore.jobs[job_id]["startedDate"] = "2020-01-01T00:00:00.000+00:00"
+
+    responses = encore_wrap.poll_jobs(encore, [job_id], fail_fast=False, timeout=5)
+
+    assert responses[0]["status"] == encore_wrap.TIMED_OUT
+    assert encore.cancelled == [job_id]
+
+
+class QueuedEncore(FakeEncore):
+    """FakeEncore where every job waits in the queue for 'ticks' gets"""
+
+    def __init__(self, statuses=None, ticks=1):
+        super().__init__(statuses)
+        self.ticks = ticks
+        self.gets = {}
+
+    def get_job(self, job_id):
+        self.gets[job_id] = self.gets.get(job_id, 0) + 1
+        if self.gets[job_id] <= self.ticks:
+            return dict(self.jobs[job_id], status="QUEUED")
+        return self.jobs[job_id]
+
+    def get_queue(self):
+        return []
+
+
+def test_queued_job_is_not_timed_out(clock):
+    # The job waits in the queue for much longer than the timeout
+    encore = QueuedEncore(ticks=20)
+    job_id = encore.create_job({"inputs": [{"uri": "a.mp4"}]})["id"]
+
+    responses = encore_wrap.poll_jobs(encore, [job_id], fail_fast=False, timeout=5)
+
+    assert responses[0]["status"] == "SUCCESSFUL"
+    assert encore.cancelled == []
+
+
+def test_scheduler_times_out_running_jobs_only(clock):
+    # Both jobs are queued for longer than the timeout, then "b" runs for too long
+    encore = QueuedEncore({"b.mp4": ["IN_PROGRESS"]}, ticks=20)
+    datas = [{"externalId": path, "inputs": [{"uri": path}]} for path in ("a.mp4", "b.mp4")]
+    create_job = encore.create_job
+
+    def create_started_job(data):
+        response = create_job(data)
+        encore.jobs[response["id"]]["startedDate"] = "2020-01-01T00:00:00.000+00:00"
+        return response
+
+    encore.create_job = create_started_job
+    responses = encore_wrap.SubmissionScheduler(encore).run(datas, fail_fast=False, timeout=5)
+
+    assert [response["status"] for response in responses] == \
+        ["SUCCESSFUL", encore_wrap.TIMED_OUT]
+    assert encore.cancelled == ["job-1"]
+
+
+def test_running_time():
+    started = datetime.now(timezone.utc)
+
+    assert encore_wrap.running_time({"status": "QUEUED"}) is None
+    assert encore_wrap.running_time({"status": "IN_PROGRESS"}) is None
+    assert 0 <= encore_wrap.running_time(
+        {"status": "IN_PROGRESS", "startedDate": started.isoformat()}) < 60
+
+
+class PagedEncore(FakeEncore):
+    """FakeEncore with 'pages' pages of other jobs in every active status"""
+
+    def __init__(self, pages):
+        super().__init__()
+        self.pages = pages
+        self.listed = 0
+
+    def find_job_by_status(self, status, page=0, size=100):
+        self.listed += 1
+        return {"_embedded": {"encoreJobs": [{"id": f"other-{status}-{page}"}]},
+                "page": {"totalPages": self.pages}}
+
+
+def test_active_jobs_are_listed_when_cheaper():
+    encore = PagedEncore(pages=1)
+    job_ids = [encore.create_job({"inputs": [{"uri": f"{count}.mp4"}]})["id"]
+               for count in range(10)]
+
+    assert encore_wrap.active_job_ids(encore, max_requests=len(job_ids)) == \
+        {"other-NEW-0", "other-QUEUED-0", "other-IN_PROGRESS-0"}
+    assert encore.listed == 3
+
+
+def test_active_jobs_are_not_listed_when_asking_is_cheaper():
+    # 3 statuses of 4 pages cost more than asking for 10 jobs
+    encore = PagedEncore(pages=4)
+
+    assert encore_wrap.active_job_ids(encore, max_requests=10) is None
+    assert encore.listed == 1
+
+    job_ids = [encore.create_job({"inputs": [{"uri": f"{count}.mp4"}]})["id"]
+               for count in range(10)]
+    finished = encore_wrap.finished_jobs(encore, job_ids)
+    assert sorted(finished) == sorted(job_ids)
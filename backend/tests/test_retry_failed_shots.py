@@ -0,0 +1,80 @@
+import pytest
+
+from conftest import FakeEncore, response
+from videolib import encore_wrap
+
+pytestmark = pytest.mark.usefixtures("no_sleep")
+
+
+def test_success_after_retry(base_dir):
+    paths = ["a.mp4", "b.mp4", "c.mp4"]
+    responses = [response("a.mp4"), response("b.mp4", "FAILED"), response("c.mp4")]
+    encore = FakeEncore()
+
+    result = encore_wrap.retry_failed_shots("job", encore, paths, responses, base_dir,
+                                            [0, 1, 2])
+
+    assert encore.created == ["b.mp4"]
+    assert [[part["status"] for part in result[count]] for count in range(3)] == \
+        [["SUCCESSFUL"]] * 3
+    assert result[1][0]["output"][0]["file"] == "b.mp4.out"
+
+
+def test_retry_budget_exhausted(base_dir):
+    paths = [f"{count}.mp4" for count in range(10)]
+    responses = [response(path, "FAILED") for path in paths]
+    encore = FakeEncore()
+
+    with pytest.raises(Exception, match="Retry budget"):
+        encore_wrap.retry_failed_shots("job", encore, paths, responses, base_dir,
+                                       list(range(10)), retry_budget=0, min_retries=2)
+
+    assert len(encore.created) == 2
+
+
+def test_shot_retry_limit(base_dir):
+    paths = ["a.mp4"]
+    encore = FakeEncore({"a.mp4": ["FAILED", "FAILED"]})
+
+    with pytest.raises(Exception, match="Shot 0 of job 'job' failed"):
+        encore_wrap.retry_failed_shots("job", encore, paths, [response("a.mp4", "FAILED")],
+                                       base_dir, [0], retries=2, split_after=5)
+
+    assert encore.created == ["a.mp4", "a.mp4"]
+
+
+def test_timed_out_shot_is_retried(base_dir):
+    paths = ["a.mp4"]
+    encore = FakeEncore()
+
+    result = encore_wrap.retry_failed_shots(
+        "job", encore, paths, [response("a.mp4", encore_wrap.TIMED_OUT)], base_dir, [0])
+
+    assert encore.created == ["a.mp4"]
+    assert result[0][0]["status"] == "SUCCESSFUL"
+
+
+def test_split_shot_is_reassembled_in_order(base_dir, monkeypatch):
+    splits = []
+
+    def split_shot(video_path, output_dir):
+        splits.append(video_path)
+        name = video_path.split(".")[0]
+        return [f"{name}-0.mp4", f"{name}-1.mp4"]
+
+    monkeypatch.setattr(encore_wrap, "split_shot", split_shot)
+
+    paths = ["a.mp4", "b.mp4", "c.mp4"]
+    responses = [response("a.mp4"), response("b.mp4", "FAILED"), response("c.mp4")]
+    # The first half fails as well and is split again
+    encore = FakeEncore({"b.mp4": ["FAILED"], "b-0.mp4": ["FAILED"]})
+
+    result = encore_wrap.retry_failed_shots("job", encore, paths, responses, base_dir,
+                                            [2, 1, 0], retries=3, min_retries=10,
+                                            split_after=1)
+
+    assert splits == ["b.mp4", "b-0.mp4"]
+    assert encore.created == ["b.mp4", "b-0.mp4", "b-1.mp4", "b-0-0.mp4", "b-0-1.mp4"]
+    assert [part["output"][0]["file"] for part in result[1]] == \
+        ["b-0-0.mp4.out", "b-0-1.mp4.out", "b-1.mp4.out"]
+    assert len(result[0]) == 1 and len(result[2]) == 1
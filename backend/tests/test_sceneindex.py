@@ -0,0 +1,105 @@
+from array import array
+
+import pytest
+
+from videolib import sceneindex, videoprocess
+from videolib.sceneindex import SceneIndex
+
+
+def example_index(video_location="/videos/source.mp4"):
+    pts = array("d", [count * 0.5 for count in range(20)])
+    scores = array("f", [0.0] * 20)
+    for count, score in [(2, 0.9), (3, 0.5), (8, 0.35), (9, 0.8), (15, 0.6)]:
+        scores[count] = score
+
+    return SceneIndex(video_location, 1234, 5678, 10.0, pts, scores)
+
+
+def test_save_load_round_trip(tmp_path):
+    index = example_index()
+    location = str(tmp_path / "source.mp4.scenes")
+
+    index.save(location)
+    loaded = SceneIndex.load(location)
+
+    assert loaded.key() == index.key()
+    assert loaded.duration == index.duration
+    assert list(loaded.pts) == list(index.pts)
+    assert list(loaded.scores) == list(index.scores)
+
+
+def test_load_invalid_file(tmp_path):
+    location = tmp_path / "source.mp4.scenes"
+    assert SceneIndex.load(str(location)) is None
+
+    example_index().save(str(location))
+    location.write_bytes(location.read_bytes()[:-4])
+    assert SceneIndex.load(str(location)) is None
+
+
+def test_detection():
+    index = example_index()
+
+    assert index.detection(0.4) == ["0.000000", "1.000000", "1.500000", "4.500000",
+                                    "7.500000", "10.000000"]
+    assert index.shot_detection(0.7) == [1.0, 4.5]
+
+
+def test_short_shots_are_merged_like_videoprocess():
+    index = example_index()
+    detection = index.detection(0.3)
+
+    for shot_length in [0, 0.5, 1, 2, 3]:
+        assert index.format_shot_detection(0.3, shot_length) == \
+            videoprocess.merge_short_shots(detection, shot_length)
+
+    batch = index.format_shot_detection_batch(0.3, [0, 1, 3])
+    assert batch == {shot_length: index.format_shot_detection(0.3, shot_length)
+                     for shot_length in [0, 1, 3]}
+    # No shot is shorter than the minimum length
+    shots = [float(timestamp) for timestamp in batch[3]]
+    assert all(end - start >= 3 for start, end in zip(shots[:-1], shots[1:]))
+
+
+def test_cached_index_is_stored_next_to_the_video(tmp_path, monkeypatch):
+    video = tmp_path / "source.mp4"
+    video.write_bytes(b"video")
+    monkeypatch.setattr(sceneindex, "video_duration", lambda video_location: "10.0\n")
+    monkeypatch.setattr(sceneindex, "_loaded", {})
+
+    assert sceneindex.cached_scene_index(str(video)) is None
+
+    frames = [(count * 0.5, 0.9 if count == 4 else 0.0) for count in range(20)]
+    index = sceneindex.scene_index_from_frames(str(video), frames)
+    monkeypatch.setattr(sceneindex, "_loaded", {})
+
+    cached = sceneindex.cached_scene_index(str(video))
+    assert cached is not None
+    assert cached.detection(0.5) == index.detection(0.5) == \
+        ["0.000000", "2.000000", "10.000000"]
+
+    # A changed video does not use the old index
+    video.write_bytes(b"another video")
+    assert sceneindex.cached_scene_index(str(video)) is None
+
+
+def test_index_from_copy_keeps_source_timestamps(tmp_path, monkeypatch):
+    video = tmp_path / "source.ts"
+    video.write_bytes(b"video")
+    copy = tmp_path / "only_video.mp4"
+    monkeypatch.setattr(sceneindex, "video_duration", lambda video_location: "10.0\n")
+    monkeypatch.setattr(sceneindex, "video_start_time",
+                        lambda video_location: 1.4 if video_location == str(video) else 0.0)
+    monkeypatch.setattr(sceneindex, "_loaded", {})
+
+    def scene_scores(video_location):
+        # Only the copy is decoded
+        assert video_location == str(copy)
+        return [count * 0.5 for count in range(20)], [0.9 if count == 4 else 0.0
+                                                      for count in range(20)]
+
+    monkeypatch.setattr(sceneindex, "scene_scores", scene_scores)
+
+    index = sceneindex.scene_index_from_copy(str(video), str(copy))
+
+    assert index.pts[4] == pytest.approx(3.4)
@@ -0,0 +1,70 @@
+import os
+
+from videolib.shotcache import ShotCache, cache_key
+
+
+def encoded_shot(directory, name, size):
+    """! An Encore job response with one output file of size bytes"""
+    location = os.path.join(directory, name)
+    with open(location, "wb") as f:
+        f.write(b"x" * size)
+
+    return {"status": "SUCCESSFUL", "output": [{"file": location, "format": "mp4"}]}
+
+
+def test_fetch_hit_and_miss(tmp_path):
+    cache = ShotCache(tmp_path / "cache", 1000)
+    key = cache_key("hash", "program", {})
+
+    assert cache.fetch(key, tmp_path / "out") is None
+
+    cache.store(key, encoded_shot(tmp_path, "shot.mp4", 10))
+    response = cache.fetch(key, str(tmp_path / "out"))
+
+    assert response["cached"]
+    assert response["output"][0]["file"] == str(tmp_path / "out" / "shot.mp4")
+    assert os.path.getsize(response["output"][0]["file"]) == 10
+
+    metrics = cache.metrics()
+    assert (metrics["hits"], metrics["misses"], metrics["stores"]) == (1, 1, 1)
+    assert metrics["hit_rate"] == 0.5
+    assert metrics["entries"] == 1
+
+
+def test_broken_entry_is_a_miss(tmp_path):
+    cache = ShotCache(tmp_path / "cache", 1000)
+    cache.store("a", encoded_shot(tmp_path, "a.mp4", 10))
+    os.remove(tmp_path / "cache" / "a" / "a.mp4")
+
+    assert cache.fetch("a", str(tmp_path / "out")) is None
+    assert cache.metrics()["misses"] == 1
+    assert cache.metrics()["entries"] == 0
+
+
+def test_evicts_least_recently_used(tmp_path):
+    # Two entries of 100 bytes and their entry.json fit, three do not
+    cache = ShotCache(tmp_path / "cache", 400)
+    cache.store("a", encoded_shot(tmp_path, "a.mp4", 100))
+    cache.store("b", encoded_shot(tmp_path, "b.mp4", 100))
+
+    # "a" was used last, so "b" goes when "c" does not fit
+    cache.entries["b"][1] -= 10
+    assert cache.fetch("a", str(tmp_path / "out")) is not None
+    cache.store("c", encoded_shot(tmp_path, "c.mp4", 100))
+
+    assert set(cache.entries) == {"a", "c"}
+    assert not os.path.exists(tmp_path / "cache" / "b")
+    assert cache.metrics()["evictions"] == 1
+    assert cache.metrics()["bytes"] <= 400
+
+
+def test_scan_reads_entries(tmp_path):
+    cache = ShotCache(tmp_path / "cache", 1000)
+    cache.store("a", encoded_shot(tmp_path, "a.mp4", 10))
+    os.makedirs(tmp_path / "cache" / ".unfinished")
+
+    reopened = ShotCache(tmp_path / "cache", 1000)
+
+    assert set(reopened.entries) == {"a"}
+    assert reopened.size == cache.size
+    assert not os.path.exists(tmp_path / "cache" / ".unfinished")
@@ -0,0 +1,23 @@
+import pytest
+
+from conftest import FakeEncore
+from videolib import encore_wrap
+
+pytestmark = pytest.mark.usefixtures("no_sleep")
+
+
+def test_stream_transcode_retries_failed_shots(base_dir, monkeypatch):
+    encore = FakeEncore({"shot-1.mp4": ["FAILED"]})
+    monkeypatch.setattr(encore_wrap, "Encore", lambda url: encore)
+    encore.close = lambda: None
+    monkeypatch.setattr(encore_wrap, "stream_keyframe_shots",
+                        lambda *args: iter([(0.0, 2.0), (2.0, 4.0), (4.0, None)]))
+    monkeypatch.setattr(encore_wrap, "cut_shot",
+                        lambda video, start, end, path: f"shot-{int(start) // 2}.mp4")
+
+    video_locations, audio_locations = encore_wrap.stream_transcode(
+        "job", "url", "video.mp4", "audio.wav", base_dir, 0.3)
+
+    assert encore.created == ["audio.wav", "shot-0.mp4", "shot-1.mp4", "shot-2.mp4",
+                              "shot-1.mp4"]
+    assert video_locations == [["shot-0.mp4.out", "shot-1.mp4.out", "shot-2.mp4.out"]]
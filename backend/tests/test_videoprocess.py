@@ -0,0 +1,199 @@
+import random
+import shutil
+import subprocess
+
+import pytest
+
+from videolib import videoprocess
+
+
+def test_next_keyframe():
+    keyframes = [0.0, 2.0, 4.04]
+
+    assert videoprocess.next_keyframe(keyframes, 0.0) == 0.0
+    assert videoprocess.next_keyframe(keyframes, 1.2) == 2.0
+    # Timestamps printed with six decimals are on the keyframe
+    assert videoprocess.next_keyframe(keyframes, 4.0399999) == 4.04
+    assert videoprocess.next_keyframe(keyframes, 4.1) is None
+
+
+def test_stream_keyframe_shots(monkeypatch):
+    monkeypatch.setattr(videoprocess, "keyframe_times", lambda video: [0.0, 2.0, 4.0, 6.0])
+    boundaries = [("0.000000", "1.500000"), ("1.500000", "1.800000"),
+                  ("1.800000", "4.000000"), ("4.000000", "5.000000"), ("5.000000", "6.500000"),
+                  ("6.500000", "9.000000")]
+    monkeypatch.setattr(videoprocess, "stream_shot_boundaries",
+                        lambda *args: iter(boundaries))
+
+    shots = list(videoprocess.stream_keyframe_shots("video.mp4", 0.3))
+
+    # The cuts at 1.5 and 1.8 are both moved to 2.0 and the shots after the
+    # last keyframe are one shot to the end of the video
+    assert shots == [(0.0, 2.0), (2.0, 4.0), (4.0, 6.0), (6.0, None)]
+
+
+def test_hls_segment_times():
+    # Every shot starts a segment, long shots are also cut every 2 seconds
+    # but never leave less than 1 second at their end
+    times = videoprocess.hls_segment_times([1.5, 5.0, 2.9], 2)
+
+    assert times == [1.5, 3.5, 5.5, 6.5]
+
+
+def test_snap_to_keyframes():
+    keyframes = [0.0, 2.0, 4.0, 6.0]
+    detection = ["0.000000", "0.040000", "1.500000", "1.800000", "4.000000",
+                 "6.200000", "7.000000", "8.000000"]
+
+    # Cuts move to the next keyframe, cuts on the same keyframe become one
+    # and cuts after the last keyframe are removed
+    assert videoprocess.snap_to_keyframes(detection, keyframes) == \
+        ["0.000000", "2.000000", "4.000000", "8.000000"]
+
+    snapped = videoprocess.snap_to_keyframes(detection, keyframes)
+    assert videoprocess.snap_to_keyframes(snapped, keyframes) == snapped
+
+
+def reference_merge_short_shots(detection, shot_length):
+    """The loop format_shot_detection used before merge_indices"""
+    detection = list(detection)
+
+    count = 0
+    while count < len(detection)-1:
+        diff = float(detection[count+1]) - float(detection[count])
+        if diff < shot_length:
+            if count == len(detection)-2:
+                # can't delete last timestamp
+                del detection[count]
+            else:
+                del detection[count+1]
+        else:
+            count += 1
+
+    return detection
+
+
+@pytest.mark.parametrize("seed", range(0, 20))
+def test_merge_short_shots_matches_loop(seed):
+    rng = random.Random(seed)
+
+    for _ in range(0, 50):
+        # Coarse steps give many shots of exactly shot_length
+        step = rng.choice([0.04, 0.1, 0.5])
+        cuts = sorted({round(rng.randrange(1, 400) * step, 6) for _ in range(rng.randrange(0, 40))})
+        end = (cuts[-1] if len(cuts) > 0 else 0) + rng.randrange(1, 50) * step
+        detection = [f"{timestamp:.6f}" for timestamp in [0.0] + cuts + [end]]
+        shot_lengths = [rng.choice([0.04, 0.5, 1, 1.5, 3, 10]) for _ in range(0, 3)]
+
+        batch = videoprocess.merge_short_shots_batch(detection, shot_lengths)
+        for shot_length in shot_lengths:
+            expected = reference_merge_short_shots(detection, shot_length)
+            assert videoprocess.merge_short_shots(detection, shot_length) == expected
+            assert batch[shot_length] == expected
+
+
+def test_coalesce_shots():
+    detection = ["0.000000", "1.000000", "2.000000", "3.000000", "4.000000",
+                 "5.000000", "6.000000", "6.500000"]
+
+    assert videoprocess.coalesce_shots(detection[:-1], 3) == ["0.000000", "3.000000", "6.000000"]
+    # The last 0.5 seconds are merged into the chunk before them
+    assert videoprocess.coalesce_shots(detection, 3) == ["0.000000", "3.000000", "6.500000"]
+
+
+def test_coalesce_shots_keeps_shots():
+    detection = ["0.000000", "1.000000", "2.000000"]
+
+    assert videoprocess.coalesce_shots(detection, 0) == detection
+    assert videoprocess.coalesce_shots(detection[::2], 5) == detection[::2]
+    # One chunk is never merged away
+    assert videoprocess.coalesce_shots(detection, 1.5) == ["0.000000", "2.000000"]
+
+
+def test_coalesce_shots_uncoalesce():
+    detection = [f"{0.4 * count * count:.6f}" for count in range(0, 12)]
+
+    for chunk_duration in (0.5, 2, 7, 100):
+        chunks = videoprocess.coalesce_shots(detection, chunk_duration)
+
+        # Every chunk is a run of whole shots, cutting the chunks at the
+        # dropped cuts gives the shots back
+        assert chunks[0] == detection[0] and chunks[-1] == detection[-1]
+        assert all(chunk in detection for chunk in chunks)
+        assert chunks == sorted(chunks, key=float)
+        assert sorted(set(chunks) | set(detection), key=float) == detection
+
+        report = videoprocess.coalesce_report(detection, chunks, 10)
+        assert report["shots"] == len(detection) - 1
+        assert report["jobs"] == len(chunks) - 1
+
+
+def test_only_parallel_ranges_decode_single_threaded(monkeypatch):
+    commands = []
+
+    def call_subprocess(command):
+        commands.append(command)
+        return subprocess.CompletedProcess(command, 0, "", "")
+
+    monkeypatch.setattr(videoprocess, "call_subprocess", call_subprocess)
+    monkeypatch.setattr(videoprocess, "video_duration", lambda video: "10.0\n")
+
+    videoprocess.parallel_scene("video.mp4", "gt(scene,0.3)", workers=1, profile="fast")
+    assert "-threads" not in commands[0]
+
+    videoprocess.parallel_scene("video.mp4", "gt(scene,0.3)", workers=2, profile="fast")
+    assert all("-threads 1" in command for command in commands[1:])
+    assert len(commands) == 3
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None,
+                    reason="needs ffmpeg")
+def test_parallel_scene_matches_serial(tmp_path):
+    # Four seconds with a cut in the middle and a keyframe every 10 frames,
+    # so the ranges really seek into the video
+    clip = str(tmp_path / "clip.mp4")
+    command = ["ffmpeg", "-v", "error", "-y",
+               "-f", "lavfi", "-i", "testsrc=duration=2:size=160x120:rate=25",
+               "-f", "lavfi", "-i", "smptebars=duration=2:size=160x120:rate=25",
+               "-filter_complex", "[0:v][1:v]concat=n=2:v=1[v]", "-map", "[v]",
+               "-c:v", "libx264", "-g", "10", "-pix_fmt", "yuv420p", clip]
+    subprocess.run(command, check=True)
+
+    serial = videoprocess.scene_range(clip, "gte(scene,0)")
+    merged = videoprocess.parallel_scene(clip, "gte(scene,0)", workers=3)
+
+    assert len(serial) == 100
+    assert [pts for pts, _ in merged] == pytest.approx([pts for pts, _ in serial])
+    assert [score for _, score in merged] == pytest.approx(
+        [score for _, score in serial], abs=1e-6)
+    # The cut is found at the same frame
+    assert max(merged, key=lambda frame: frame[1])[0] == pytest.approx(2.0)
+
+
+def test_codec_string():
+    # Version, profile High, no constraints, level 4.0
+    init_data = b"\x00\x00\x00\x2davcC\x01\x64\x00\x28\xff"
+
+    assert videoprocess.codec_string({"codec_name": "h264"}, init_data) == "avc1.640028"
+    assert videoprocess.codec_string({"codec_name": "h264"}) is None
+    assert videoprocess.codec_string({"codec_name": "hevc", "profile": "Main 10",
+                                      "level": 123}) == "hvc1.2.4.L123.B0"
+    assert videoprocess.codec_string({"codec_name": "aac", "profile": "HE-AAC"}) == "mp4a.40.5"
+    assert videoprocess.codec_string({"codec_name": "vp9"}) is None
+
+
+def test_write_master_playlist(tmp_path):
+    variants = [("stream_0/index.m3u8", {"BANDWIDTH": 5000000, "CODECS": "avc1.640028,mp4a.40.2",
+                                         "RESOLUTION": "1920x1080"}),
+                ("stream_1/index.m3u8", {"BANDWIDTH": 800000})]
+
+    master = videoprocess.write_master_playlist(variants, f"{tmp_path}/")
+
+    with open(master) as f:
+        lines = f.read().splitlines()
+    assert lines[3:] == [
+        '#EXT-X-STREAM-INF:BANDWIDTH=5000000,CODECS="avc1.640028,mp4a.40.2",RESOLUTION=1920x1080',
+        "stream_0/index.m3u8",
+        "#EXT-X-STREAM-INF:BANDWIDTH=800000",
+        "stream_1/index.m3u8",
+    ]
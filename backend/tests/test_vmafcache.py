@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+from videolib.vmafcache import VMAFCache, json_vmaf_cache, vmaf_cache_key
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.001)
+
+
+def dict_cache():
+    scores = {}
+    return scores, VMAFCache(scores.get, scores.__setitem__)
+
+
+def test_miss_then_hit():
+    scores, cache = dict_cache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return 93.5
+
+    assert cache.score("key", compute) == 93.5
+    assert cache.score("key", compute) == 93.5
+
+    assert len(calls) == 1
+    assert scores == {"key": 93.5}
+    assert cache.metrics() == {"hits": 1, "misses": 1, "collapsed": 0, "in_flight": 0}
+
+
+def test_concurrent_requests_are_collapsed():
+    scores, cache = dict_cache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 80.0
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.score("key", compute)))
+    owner.start()
+    started.wait(5)
+
+    waiters = [threading.Thread(target=lambda: results.append(cache.score("key", compute)))
+               for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    # The waiters block on the computation of the owner
+    wait_until(lambda: cache.metrics()["collapsed"] == 3)
+    release.set()
+
+    for thread in [owner] + waiters:
+        thread.join(5)
+
+    assert results == [80.0] * 4
+    assert len(calls) == 1
+    assert cache.metrics()["collapsed"] == 3
+
+
+def test_failed_compute_is_not_cached_and_releases_waiters():
+    scores, cache = dict_cache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        return None
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.score("key", compute)))
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(target=lambda: results.append(cache.score("key", compute)))
+    waiter.start()
+    wait_until(lambda: cache.metrics()["collapsed"] == 1)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert results == [None, None]
+    assert scores == {}
+    assert cache.metrics()["in_flight"] == 0
+    # The next request computes again
+    assert cache.score("key", lambda: 70.0) == 70.0
+
+
+def test_compute_exception_reaches_the_caller():
+    scores, cache = dict_cache()
+
+    def compute():
+        raise ValueError("no log")
+
+    with pytest.raises(ValueError):
+        cache.score("key", compute)
+
+    assert scores == {}
+    assert cache.metrics()["in_flight"] == 0
+
+
+def test_json_cache_and_key(tmp_path):
+    reference = tmp_path / "reference.mp4"
+    distorted = tmp_path / "distorted.mp4"
+    model = tmp_path / "model.json"
+    reference.write_bytes(b"reference")
+    distorted.write_bytes(b"distorted")
+    model.write_bytes(b"{}")
+
+    key = vmaf_cache_key(str(reference), str(distorted), str(model))
+    assert key != vmaf_cache_key(str(distorted), str(reference), str(model))
+    assert key != vmaf_cache_key(str(reference), str(distorted), str(model), method="shots")
+
+    location = str(tmp_path / "vmaf_cache.json")
+    json_vmaf_cache(location).score(key, lambda: 91.0)
+
+    # A new cache on the same file finds the score
+    assert json_vmaf_cache(location).score(key, lambda: None) == 91.0
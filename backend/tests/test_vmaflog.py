@@ -0,0 +1,82 @@
+import json
+from array import array
+
+import numpy as np
+import pytest
+
+from videolib.vmaflog import VMAFFrames
+
+
+def write_log(location, scores, n_subsample=1):
+    frames = [{"frameNum": count * n_subsample, "metrics": {"vmaf": score}}
+              for count, score in enumerate(scores)]
+    with open(location, "w") as f:
+        json.dump({"frames": frames, "pooled_metrics": {}}, f)
+
+
+def test_save_load_round_trip(tmp_path):
+    frames = VMAFFrames(array("f", [90.5, 80.25, 0.0, 100.0]), array("I", [0, 2]))
+    location = str(tmp_path / "frames.vmaf")
+
+    frames.save(location)
+    loaded = VMAFFrames.load(location)
+
+    assert list(loaded.scores) == [90.5, 80.25, 0.0, 100.0]
+    assert list(loaded.offsets) == [0, 2]
+
+
+def test_load_invalid_file(tmp_path):
+    location = tmp_path / "frames.vmaf"
+
+    assert VMAFFrames.load(str(location)) is None
+
+    location.write_bytes(b"not a vmaf file")
+    assert VMAFFrames.load(str(location)) is None
+
+    frames = VMAFFrames(array("f", [90.0, 80.0]), array("I", [0]))
+    frames.save(str(location))
+    # A file that was cut short
+    location.write_bytes(location.read_bytes()[:-2])
+    assert VMAFFrames.load(str(location)) is None
+
+
+def test_statistics():
+    scores = [100.0, 90.0, 80.0, 70.0, 0.0, 95.0]
+    stats = VMAFFrames(array("f", scores), array("I", [0, 4])).statistics(per_shot=True)
+
+    assert stats["frames"] == 6
+    assert stats["mean"] == pytest.approx(np.mean(scores))
+    assert stats["harmonic_mean"] == pytest.approx(
+        len(scores) / sum(1 / (score + 1) for score in scores) - 1)
+    assert stats["p1"] == pytest.approx(np.percentile(scores, 1))
+    assert stats["p5"] == pytest.approx(np.percentile(scores, 5))
+    assert stats["min"] == 0.0
+
+    assert [shot["frames"] for shot in stats["shots"]] == [4, 2]
+    assert stats["shots"][0]["mean"] == pytest.approx(85.0)
+    assert stats["shots"][1]["min"] == 0.0
+    assert "shots" not in VMAFFrames(array("f", scores), array("I", [0])).statistics()
+
+
+def test_from_log_splits_shots_by_frame_number(tmp_path):
+    log = str(tmp_path / "vmaf.json")
+    # Every second frame of 10 frames at 10 fps is scored
+    write_log(log, [90.0, 91.0, 92.0, 93.0, 94.0], n_subsample=2)
+
+    frames = VMAFFrames.from_log(log, ["0.000000", "0.300000", "0.600000", "1.000000"], 10)
+
+    # The shot at frame 3 starts with scored frame 4, the shot at frame 6 with frame 6
+    assert list(frames.offsets) == [0, 2, 3]
+    assert [shot["frames"] for shot in frames.statistics(per_shot=True)["shots"]] == [2, 1, 2]
+
+
+def test_from_shot_logs(tmp_path):
+    logs = [str(tmp_path / f"vmaf_shot_{count}.json") for count in range(3)]
+    write_log(logs[0], [90.0, 91.0])
+    write_log(logs[1], [80.0])
+    write_log(logs[2], [70.0, 71.0, 72.0])
+
+    frames = VMAFFrames.from_shot_logs(logs)
+
+    assert list(frames.scores) == [90.0, 91.0, 80.0, 70.0, 71.0, 72.0]
+    assert list(frames.offsets) == [0, 2, 3]
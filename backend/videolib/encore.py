@@ -4,16 +4,191 @@ This class is used to communicate with SVT:s Encore API
 For documentation about the functions go to 
 https://svt.github.io/encore-doc/openapi.html
 
+All requests go through one pooled keep-alive session. Failed requests are
+retried with exponential backoff and jitter as long as the retry budget allows
+it, and the number of requests, retries and their latency is counted in stats.
 """
+import random
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# Statuses of Encore jobs that are not done yet, in the order a job moves
+# through them.
+ACTIVE_STATUSES = ["NEW", "QUEUED", "IN_PROGRESS"]
+TERMINAL_STATUSES = ["SUCCESSFUL", "FAILED", "CANCELLED"]
+
+# Status codes that mean the request can be sent again
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Status codes where Encore did not start handling a request, safe to retry
+# even when the request creates something
+RETRY_STATUS_UNSAFE = {429, 503}
+
+
+def connect_failed(e):
+    # True if a request failed before it reached Encore: the connection
+    # could not be opened or timed out while it was opened. Any other
+    # connection error may have happened after Encore received the request.
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+
+    if isinstance(e, requests.exceptions.ConnectionError) and len(e.args) > 0:
+        reason = getattr(e.args[0], "reason", e.args[0])
+        return isinstance(reason, NewConnectionError)
+
+    return False
+
+
+class EncoreStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def add_request(self, latency):
+        with self.lock:
+            self.requests += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
 
-class Encore:
+    def add_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def add_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "latency_mean": self.latency_total / self.requests if self.requests > 0 else 0.0,
+                "latency_max": self.latency_max,
+            }
+
+
+class EncoreBase:
 
     failed_return = False
     reqExc_msg = "Bad request"
 
-    def __init__(self, url):
+    def __init__(self, url, timeout=(3.05, 30), retries=4, backoff=0.5, max_backoff=30,
+                 retry_budget=0.2, min_retries=10):
+        """
+        url             The url to Encore
+        timeout         Seconds to wait for a connection and for a response
+        retries         Max number of retries of one request
+        backoff         Base of the exponential backoff in seconds
+        max_backoff     Max seconds to wait before a retry
+        retry_budget    Max share of all requests that may be retries, stops
+                        retry storms when Encore is down
+        min_retries     Number of retries that are always allowed by the budget
+        """
         self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_budget = retry_budget
+        self.min_retries = min_retries
+
+        self.stats = EncoreStats()
+
+
+    def metrics(self):
+        return self.stats.to_dict()
+
+
+    def can_retry(self, attempt):
+        if attempt >= self.retries:
+            return False
+
+        stats = self.stats.to_dict()
+        return stats["retries"] < self.min_retries + self.retry_budget * stats["requests"]
+
+
+    def backoff_delay(self, attempt):
+        # Full jitter, wait a random time up to the exponential backoff
+        self.stats.add_retry()
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class Encore(EncoreBase):
+
+    def __init__(self, url, pool_size=20, **kwargs):
+        """
+        url             The url to Encore
+        pool_size       Max number of kept alive connections to Encore
+
+        The other keyword arguments are the retry settings of EncoreBase.
+        """
+        super().__init__(url, **kwargs)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+
+    def close(self):
+        self.session.close()
+
+
+    def request(self, method, path, idempotent=True, **kwargs):
+        """
+        Sends a request to Encore and retries it on connection errors and
+        on status codes in RETRY_STATUS. Requests that are not idempotent are
+        only retried when Encore did not receive them, see connect_failed.
+        Raises the last exception when no retries are left.
+        """
+        attempt = 0
+
+        while True:
+            start_time = time.time()
+            try:
+                response = self.session.request(
+                    method, f"{self.url}{path}", timeout=self.timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self.stats.add_request(time.time() - start_time)
+
+                if idempotent:
+                    retry = isinstance(e, (requests.exceptions.ConnectionError,
+                                           requests.exceptions.Timeout))
+                else:
+                    # After a read timeout or a dropped connection Encore may
+                    # already have handled the request
+                    retry = connect_failed(e)
+
+                if not retry or not self.can_retry(attempt):
+                    self.stats.add_failure()
+                    raise
+
+                time.sleep(self.backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            self.stats.add_request(time.time() - start_time)
+
+            retry_status = RETRY_STATUS if idempotent else RETRY_STATUS_UNSAFE
+            if response.status_code in retry_status and self.can_retry(attempt):
+                time.sleep(self.backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code >= 400:
+                self.stats.add_failure()
+
+            return response
 
 
     def create_job(self, data):
@@ -22,7 +197,8 @@ class Encore:
         }
 
         try:
-            response = requests.post(f"{self.url}/encoreJobs", json=data, headers=headers)
+            response = self.request("POST", "/encoreJobs", idempotent=False,
+                                    json=data, headers=headers)
 
             if response.status_code != 201:
                 return self.failed_return
@@ -31,15 +207,13 @@ class Encore:
             
         except requests.exceptions.Timeout as e:
             print("Request timed out", e)
-            #maybe retry after 10 seconds
-            #self.create_job(data)
         except requests.exceptions.RequestException as e:
             print(self.reqExc_msg, e)
     
 
     def get_job(self, id):
         try:
-            response = requests.get(f"{self.url}/encoreJobs/{id}")
+            response = self.request("GET", f"/encoreJobs/{id}")
 
             if response.status_code != 200:
                 return self.failed_return
@@ -52,7 +226,7 @@ class Encore:
     
     def get_jobs(self, page=0, size=20, sort="ASC"):
         try:
-            response = requests.get(f"{self.url}/encoreJobs?page={page}&size={size}&sort={sort}")
+            response = self.request("GET", f"/encoreJobs?page={page}&size={size}&sort={sort}")
             
             if response.status_code != 200:
                 return self.failed_return
@@ -65,7 +239,7 @@ class Encore:
     
     def find_job_by_status(self, status="QUEUED", page=0, size=20, sort="ASC"):
         try:
-            response = requests.get(f"{self.url}/encoreJobs/search/findByStatus?page={page}&size={size}&sort={sort}&status={status}")
+            response = self.request("GET", f"/encoreJobs/search/findByStatus?page={page}&size={size}&sort={sort}&status={status}")
 
             if response.status_code != 200:
                 return self.failed_return
@@ -82,7 +256,7 @@ class Encore:
         }
 
         try:
-            response = requests.put(f"{self.url}/encoreJobs/{id}", json=data, headers=headers)
+            response = self.request("PUT", f"/encoreJobs/{id}", json=data, headers=headers)
 
             if response.status_code == 204:
                 return response.text
@@ -98,7 +272,7 @@ class Encore:
 
     def delete_job(self, id):
         try:
-            response = requests.delete(f"{self.url}/encoreJobs/{id}")
+            response = self.request("DELETE", f"/encoreJobs/{id}")
 
             if response.status_code != 204:
                 return self.failed_return
@@ -115,7 +289,8 @@ class Encore:
         }
 
         try:
-            response = requests.patch(f"{self.url}/encoreJobs/{id}", json=data, headers=headers)
+            response = self.request("PATCH", f"/encoreJobs/{id}", idempotent=False,
+                                    json=data, headers=headers)
 
             if response.status_code == 204:
                 return response.text
@@ -131,7 +306,7 @@ class Encore:
 
     def cancel_job(self, id):
         try:
-            response = requests.post(f"{self.url}/encoreJobs/{id}/cancel")
+            response = self.request("POST", f"/encoreJobs/{id}/cancel")
 
             if response.status_code != 200:
                 return self.failed_return
@@ -144,7 +319,7 @@ class Encore:
     
     def get_queue(self):
         try:
-            response = requests.get(f"{self.url}/queue")
+            response = self.request("GET", "/queue")
 
             if response.status_code != 200:
                 return self.failed_return
@@ -153,5 +328,3 @@ class Encore:
 
         except requests.exceptions.RequestException as e:
             print(self.reqExc_msg, e)
-
-    
@@ -0,0 +1,190 @@
+"""
+Asyncio version of the Encore class, used to send many requests to Encore
+at the same time. The methods return the same values as in Encore.
+
+For documentation about the functions go to
+https://svt.github.io/encore-doc/openapi.html
+"""
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from videolib.encore import EncoreBase, RETRY_STATUS, RETRY_STATUS_UNSAFE
+
+
+def connect_failed(e):
+    # Same rule as encore.connect_failed: True if a request failed before it
+    # reached Encore, the connection could not be opened or timed out while
+    # it was opened.
+    if isinstance(e, aiohttp.ClientConnectorError):
+        return True
+
+    connection_timeout = getattr(aiohttp, "ConnectionTimeoutError", None)
+    if connection_timeout is not None:
+        return isinstance(e, connection_timeout)
+
+    # Before aiohttp 3.10 both timeouts are ServerTimeoutError, told apart by the message
+    return isinstance(e, aiohttp.ServerTimeoutError) and str(e).startswith("Connection timeout")
+
+
+class AsyncEncore(EncoreBase):
+
+    def __init__(self, url, pool_size=20, **kwargs):
+        """
+        url             The url to Encore
+        pool_size       Max number of open connections to Encore, also limits
+                        the number of requests that are sent at the same time
+
+        The other keyword arguments are the retry settings of EncoreBase.
+        """
+        super().__init__(url, **kwargs)
+        self.pool_size = pool_size
+        self.session = None
+
+
+    async def __aenter__(self):
+        self.open()
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+    def open(self):
+        connect, read = self.timeout
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read))
+
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+    async def request(self, method, path, idempotent=True, **kwargs):
+        """
+        Sends a request to Encore with the same retries as Encore.request.
+        Returns the status code and the body of the response as text.
+        """
+        attempt = 0
+
+        while True:
+            start_time = time.time()
+            try:
+                async with self.session.request(method, f"{self.url}{path}", **kwargs) as response:
+                    status = response.status
+                    text = await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.stats.add_request(time.time() - start_time)
+
+                if idempotent:
+                    retry = True
+                else:
+                    # After a read timeout Encore may already have handled the request
+                    retry = connect_failed(e)
+
+                if not retry or not self.can_retry(attempt):
+                    self.stats.add_failure()
+                    raise
+
+                await asyncio.sleep(self.backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            self.stats.add_request(time.time() - start_time)
+
+            retry_status = RETRY_STATUS if idempotent else RETRY_STATUS_UNSAFE
+            if status in retry_status and self.can_retry(attempt):
+                await asyncio.sleep(self.backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            if status >= 400:
+                self.stats.add_failure()
+
+            return status, text
+
+
+    async def create_job(self, data):
+        try:
+            status, text = await self.request("POST", "/encoreJobs", idempotent=False, json=data)
+
+            if status != 201:
+                return self.failed_return
+
+            return json.loads(text)
+
+        except asyncio.TimeoutError as e:
+            print("Request timed out", e)
+        except aiohttp.ClientError as e:
+            print(self.reqExc_msg, e)
+
+
+    async def get_job(self, id):
+        try:
+            status, text = await self.request("GET", f"/encoreJobs/{id}")
+
+            if status != 200:
+                return self.failed_return
+
+            return json.loads(text)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(self.reqExc_msg, e)
+
+
+    async def get_jobs(self, page=0, size=20, sort="ASC"):
+        try:
+            status, text = await self.request("GET", f"/encoreJobs?page={page}&size={size}&sort={sort}")
+
+            if status != 200:
+                return self.failed_return
+
+            return json.loads(text)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(self.reqExc_msg, e)
+
+
+    async def find_job_by_status(self, status="QUEUED", page=0, size=20, sort="ASC"):
+        try:
+            response_status, text = await self.request("GET", f"/encoreJobs/search/findByStatus?page={page}&size={size}&sort={sort}&status={status}")
+
+            if response_status != 200:
+                return self.failed_return
+
+            return json.loads(text)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(self.reqExc_msg, e)
+
+
+    async def cancel_job(self, id):
+        try:
+            status, text = await self.request("POST", f"/encoreJobs/{id}/cancel")
+
+            if status != 200:
+                return self.failed_return
+
+            return text
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(self.reqExc_msg, e)
+
+
+    async def get_queue(self):
+        try:
+            status, text = await self.request("GET", "/queue")
+
+            if status != 200:
+                return self.failed_return
+
+            return json.loads(text)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(self.reqExc_msg, e)
@@ -0,0 +1,69 @@
+"""
+Registry of progress events that Encore posts to the progressCallbackUri of a
+job. The callback route in the API adds events and the pipeline waits on the
+registry instead of sleeping between polls.
+"""
+import threading
+from collections import OrderedDict
+
+from videolib.encore import TERMINAL_STATUSES
+
+
+class EncoreEvents:
+
+    def __init__(self, max_jobs=10000):
+        """
+        max_jobs    Max number of jobs that events are kept for, events for
+                    jobs that nobody waits for are removed oldest first
+        """
+        self.condition = threading.Condition()
+        self.max_jobs = max_jobs
+        self.progress = OrderedDict()
+        self.terminal = {}
+
+
+    def notify(self, event):
+        # Encore sends the job id as "jobId", "id" is accepted for the local stand-in
+        job_id = event.get("jobId", event.get("id"))
+        if job_id is None:
+            return False
+
+        with self.condition:
+            self.progress[job_id] = event
+            self.progress.move_to_end(job_id)
+
+            if event.get("status") in TERMINAL_STATUSES:
+                self.terminal[job_id] = event
+
+            while len(self.progress) > self.max_jobs:
+                old_id, _ = self.progress.popitem(last=False)
+                self.terminal.pop(old_id, None)
+
+            self.condition.notify_all()
+
+        return True
+
+
+    def get(self, job_id):
+        with self.condition:
+            return self.progress.get(job_id)
+
+
+    def wait(self, job_ids, timeout):
+        # Blocks until at least one of the jobs is reported as done or the
+        # timeout runs out. Returns the ids of the jobs that are done.
+        with self.condition:
+            self.condition.wait_for(
+                lambda: any(job_id in self.terminal for job_id in job_ids), timeout)
+            return [job_id for job_id in job_ids if job_id in self.terminal]
+
+
+    def forget(self, job_ids):
+        with self.condition:
+            for job_id in job_ids:
+                self.progress.pop(job_id, None)
+                self.terminal.pop(job_id, None)
+
+
+# The registry shared by the callback route and the pipeline
+encore_events = EncoreEvents()
@@ -1,81 +1,524 @@
 from asyncore import poll
+import asyncio
+import threading
 import time
 import yaml
-from videolib.videoprocess import make_dir, stitch_video, mux_audio_video
-from videolib.encore import Encore
+from concurrent.futures import ThreadPoolExecutor
+from videolib.videoprocess import (
+    make_dir, stitch_video, stitch_mux_video, mux_audio_video, stream_keyframe_shots,
+    cut_shot, encode_range, package_hls, write_master_playlist
+)
+from videolib.videoinfo import video_information
+from videolib.encore import Encore, ACTIVE_STATUSES, TERMINAL_STATUSES
+from videolib.encore_events import encore_events
+from videolib.encore_async import AsyncEncore
+from videolib.shotcache import file_hash, cache_key
 from datetime import datetime
 
 config = yaml.safe_load(open("../config.yml"))["videolib"]
 
 
+# The shots are submitted in the order of the shot indices in 'order', or in
+# timeline order if it is None. The ids are always returned in timeline order.
 def create_video_jobs(external_id, encore, video_paths, base_dir, base_name="encore",
                       profile="shot-change-video-only", progress_callback_uri="", priority="0",
-                      debug_overlay="false", log_context={}, paramtype="Video", params={}):
+                      debug_overlay="false", log_context={}, paramtype="Video", params={},
+                      order=None):
 
     if not make_dir(base_dir):
         return False
 
-    job_ids = []
+    if order is None:
+        order = range(0, len(video_paths))
 
-    for count in range(0, len(video_paths)):
+    job_ids = [None] * len(video_paths)
 
-        id = f"v-{count}"
-
-        output_dir = f"{base_dir}{id}"
-        if not make_dir(output_dir):
+    for count in order:
+        job_id = create_video_job(external_id, encore, count, video_paths[count], base_dir,
+                                  base_name, profile, progress_callback_uri, priority,
+                                  debug_overlay, log_context, paramtype, params)
+        if not job_id:
             return False
 
-        data = {
-            "externalId": id,
-            "profile": profile,
-            "outputFolder": output_dir,
-            "baseName": base_name,
-            "priority": priority,
-            "debugOverlay": debug_overlay,
-            "logContext": log_context,
-            "inputs": [{
-                "type": paramtype,
-                "uri": video_paths[count],
-                "params": params
-            }]
-        }
+        job_ids[count] = job_id
+
+    return job_ids
+
+
+def create_video_job(external_id, encore, count, video_path, base_dir, base_name="encore",
+                     profile="shot-change-video-only", progress_callback_uri="", priority="0",
+                     debug_overlay="false", log_context={}, paramtype="Video", params={}):
+
+    data = video_job_data(count, video_path, base_dir, base_name, profile,
+                          progress_callback_uri, priority, debug_overlay,
+                          log_context, paramtype, params)
+    if not data:
+        return False
+
+    # The Encore client already retries with backoff, a failure here is final
+    response = encore.create_job(data)
+
+    if not response:
+        raise Exception(f"Could not create Encore job {data['externalId']}", encore.metrics())
+
+    return response["id"]
 
-        response = encore.create_job(data)
+
+def video_job_data(count, video_path, base_dir, base_name="encore",
+                   profile="shot-change-video-only", progress_callback_uri="", priority="0",
+                   debug_overlay="false", log_context={}, paramtype="Video", params={}):
+
+    id = f"v-{count}"
+
+    output_dir = f"{base_dir}{id}"
+    if not make_dir(output_dir):
+        return False
+
+    return {
+        "externalId": id,
+        "profile": profile,
+        "outputFolder": output_dir,
+        "baseName": base_name,
+        "progressCallbackUri": progress_callback_uri,
+        "priority": priority,
+        "debugOverlay": debug_overlay,
+        "logContext": log_context,
+        "inputs": [{
+            "type": paramtype,
+            "uri": video_path,
+            "params": params
+        }]
+    }
+
+
+# Submits all shots at the same time with at most 'concurrency' requests in
+# flight. The ids are returned in shot order. If any shot could not be
+# submitted an exception with a dictionary from shot index to error is raised.
+async def async_create_video_jobs(external_id, encore, video_paths, base_dir, concurrency=16,
+                                  order=None, **job_options):
+
+    if not make_dir(base_dir):
+        return False
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def submit(count):
+        data = video_job_data(count, video_paths[count], base_dir, **job_options)
+        if not data:
+            raise Exception(f"Could not create output folder for shot {count}")
+
+        async with semaphore:
+            response = await encore.create_job(data)
 
         if not response:
-            # TODO add some callback function that reports back number of jobs that was created
-            # wait 3 seconds before trying again
-            count -= 1
-            time.sleep(3)
+            raise Exception(f"Could not create Encore job {data['externalId']}")
+
+        return response["id"]
+
+    if order is None:
+        order = range(0, len(video_paths))
+
+    # The semaphore lets waiting submissions through in the order they started
+    submitted = await asyncio.gather(*[submit(count) for count in order],
+                                     return_exceptions=True)
+
+    results = [None] * len(video_paths)
+    for count, result in zip(order, submitted):
+        results[count] = result
+
+    failures = {count: result for count, result in enumerate(results)
+                if isinstance(result, Exception)}
+    if len(failures) > 0:
+        raise Exception(f"Could not create Encore jobs for {len(failures)} shots", failures)
+
+    return results
+
+
+# Same as create_video_jobs but the shots are submitted concurrently with an
+# AsyncEncore client.
+def create_video_jobs_concurrently(external_id, url, video_paths, base_dir, concurrency=16,
+                                   order=None, **job_options):
+
+    async def run():
+        async with AsyncEncore(url, pool_size=concurrency) as encore:
+            job_ids = await async_create_video_jobs(external_id, encore, video_paths, base_dir,
+                                                    concurrency, order, **job_options)
+            print(f"Encore submissions for job '{external_id}': {encore.metrics()}")
+            return job_ids
+
+    return asyncio.run(run())
+
+
+# The requests left to list the active jobs when 'page' pages of status number
+# 'count' are fetched. The statuses left are guessed to have as many pages as
+# the largest status so far.
+def list_requests_left(count, page, total_pages, most_pages):
+    return max(0, total_pages - page) + (len(ACTIVE_STATUSES) - count - 1) * most_pages
+
+
+def active_job_ids(encore, page_size=100, max_requests=None):
+    # Returns the ids of every job in Encore that is not done, fetched page by
+    # page from findByStatus. Encore can not filter the list by our jobs, on a
+    # shared Encore it holds the jobs of everyone. Returns None if any page
+    # could not be fetched, or if listing would take more than max_requests
+    # requests, then asking for the jobs one by one is cheaper.
+    # The statuses are listed in the order a job moves through them so a job
+    # that changes status meanwhile is seen in at least one of them most of the time.
+    active = set()
+    requests = 0
+    most_pages = 1
+
+    for count, status in enumerate(ACTIVE_STATUSES):
+        page = 0
+        while True:
+            response = encore.find_job_by_status(status, page, page_size)
+            requests += 1
+            if not response:
+                return None
+
+            for job in response.get("_embedded", {}).get("encoreJobs", []):
+                active.add(job["id"])
+
+            page += 1
+            total_pages = response.get("page", {}).get("totalPages", 0)
+            most_pages = max(most_pages, total_pages)
+            if max_requests is not None and \
+                    requests + list_requests_left(count, page, total_pages, most_pages) > max_requests:
+                return None
+
+            if page >= total_pages:
+                break
+
+    return active
+
+
+# Waits one tick and returns the jobs in pending that are done, as a
+# dictionary from job id to response. Instead of asking for every job, the
+# active jobs in Encore are listed in bulk when that takes fewer requests and
+# only jobs that are no longer active are fetched.
+# With callbacks=True the jobs were created with a progressCallbackUri and
+# the tick ends as soon as Encore reports a job as done. Polling is then
+# only a fallback every fallback_delay seconds in case a callback is lost.
+def finished_jobs(encore, pending, delay=3, bulk_threshold=4, callbacks=False,
+                  fallback_delay=60):
+
+    notified = []
+    if callbacks:
+        notified = encore_events.wait(pending, fallback_delay)
+    else:
+        time.sleep(delay)
+
+    candidates = pending
+    if len(notified) > 0:
+        candidates = notified
+    # Listing the active jobs costs at least one request per status and page,
+    # it is only done while that is fewer requests than asking for every job
+    elif len(pending) > bulk_threshold:
+        active = active_job_ids(encore, max_requests=len(pending))
+        if active is not None:
+            candidates = [job_id for job_id in pending if job_id not in active]
+
+    finished = {}
+    for job_id in candidates:
+        response = encore.get_job(job_id)
+        if not response:
             continue
-        else:
-            job_ids.append(response["id"])
 
-    return job_ids
+        if response["status"] in TERMINAL_STATUSES:
+            finished[job_id] = response
+
+    # A callback that could not be confirmed is dropped so the wait does
+    # not return at once again, the fallback poll picks the job up later
+    encore_events.forget([job_id for job_id in notified if job_id not in finished])
 
+    return finished
 
-def poll_jobs(encore, encore_ids, delay=3):
+
+# The delay between ticks is halved when jobs finish and grows up to
+# max_delay while nothing happens.
+def next_delay(delay, min_delay, max_delay, progress):
+    if progress:
+        return max(min_delay, delay / 2)
+
+    return min(max_delay, delay * 1.5)
+
+
+# Status of a job that was cancelled because it ran for too long. Encore
+# reports it as CANCELLED, the own status tells it apart from jobs that were
+# cancelled by someone else.
+TIMED_OUT = "TIMED_OUT"
+
+# Statuses of jobs that did not produce any output
+FAILED_STATUSES = ("FAILED", "CANCELLED", TIMED_OUT)
+
+
+# Seconds the job in an Encore response has been running, measured from the
+# startedDate Encore sets when the job leaves its queue. None for jobs that
+# are not running, time spent NEW or QUEUED never counts.
+def running_time(response):
+    if response.get("status") != "IN_PROGRESS" or not response.get("startedDate"):
+        return None
+
+    started = datetime.fromisoformat(response["startedDate"])
+    return (datetime.now(started.tzinfo) - started).total_seconds()
+
+
+# The jobs in job_ids that have been running for more than 'timeout' seconds
+def overdue_jobs(encore, job_ids, timeout):
+    overdue = []
+    for job_id in job_ids:
+        response = encore.get_job(job_id)
+        if not response:
+            continue
+
+        seconds = running_time(response)
+        if seconds is not None and seconds > timeout:
+            overdue.append(job_id)
+
+    return overdue
+
+
+# A response for a job that was cancelled because it ran for too long
+def timed_out_response(encore, job_id, timeout):
+    encore.cancel_job(job_id)
+
+    return {
+        "id": job_id,
+        "status": TIMED_OUT,
+        "message": f"Timed out after {timeout} seconds",
+        "output": [],
+    }
+
+
+# Waits until all jobs are done, see finished_jobs for how Encore is asked.
+# With fail_fast the message of the first failed job is returned, otherwise
+# the failed responses are returned together with the others. Jobs that have
+# been running for more than 'timeout' seconds are cancelled and count as
+# failed, jobs that wait in Encore's queue are never cancelled.
+def poll_jobs(encore, encore_ids, delay=3, max_delay=30, bulk_threshold=4,
+              callbacks=False, fallback_delay=60, fail_fast=True, timeout=None):
+
+    # Nothing to wait for, for example when every shot came from the cache
+    if len(encore_ids) == 0:
+        return []
+
+    min_delay = delay
+    start_time = time.time()
+    done = {}
 
     while True:
-        # poll every 3 second
-        time.sleep(delay)
-        responses = []
+        pending = [job_id for job_id in encore_ids if job_id not in done]
+
+        finished = finished_jobs(encore, pending, delay, bulk_threshold,
+                                 callbacks, fallback_delay)
+
+        # No job can have run for longer than the polling, only then are
+        # the unfinished jobs asked for when they started
+        if timeout is not None and time.time() - start_time > timeout:
+            unfinished = [job_id for job_id in pending if job_id not in finished]
+            for job_id in overdue_jobs(encore, unfinished, timeout):
+                finished[job_id] = timed_out_response(encore, job_id, timeout)
+
+        for response in finished.values():
+            if fail_fast and response["status"] in FAILED_STATUSES:
+                encore_events.forget(encore_ids)
+                return response["message"]
 
-        for job_id in encore_ids:
-            response = encore.get_job(job_id)
-            # if response was bad we want to start from the beginning
+        done.update(finished)
+
+        # if all jobs are done terminate the loop
+        if len(done) == len(encore_ids):
+            encore_events.forget(encore_ids)
+            return [done[job_id] for job_id in encore_ids]
+
+        delay = next_delay(delay, min_delay, max_delay, len(finished) > 0)
+
+
+# Feeds jobs to Encore while keeping the load on Encore bounded. At most
+# max_in_flight jobs of this pipeline and global_in_flight jobs of all
+# pipelines in the process are submitted and not done at the same time, and
+# no job is submitted while Encore's shared queue holds max_queue jobs or more.
+# New jobs are submitted as soon as earlier jobs finish.
+class SubmissionScheduler:
+
+    global_lock = threading.Lock()
+    global_count = 0
+
+    def __init__(self, encore, max_in_flight=32, global_in_flight=128, max_queue=64,
+                 delay=3, max_delay=30, callbacks=False):
+        self.encore = encore
+        self.max_in_flight = max_in_flight
+        self.global_in_flight = global_in_flight
+        self.max_queue = max_queue
+        self.delay = delay
+        self.max_delay = max_delay
+        self.callbacks = callbacks
+
+        self.queue_depths = []
+        self.wait_times = []
+
+    def acquire_global(self):
+        with SubmissionScheduler.global_lock:
+            if SubmissionScheduler.global_count >= self.global_in_flight:
+                return False
+            SubmissionScheduler.global_count += 1
+            return True
+
+    def release_global(self, count=1):
+        with SubmissionScheduler.global_lock:
+            SubmissionScheduler.global_count -= count
+
+    def queue_depth(self):
+        queue = self.encore.get_queue()
+        # An unknown queue does not block submissions, the in-flight limits still do
+        if not isinstance(queue, list):
+            return 0
+
+        self.queue_depths.append(len(queue))
+        return len(queue)
+
+    # Submits the jobs in datas with the indices in 'order', or every job if it
+    # is None, and waits for them. Returns the responses in the same order as
+    # datas with None for jobs that were not submitted. With fail_fast the
+    # message of the first job that failed is returned instead. Jobs that have
+    # been running for more than 'timeout' seconds are cancelled, the time a
+    # job waits in Encore's queue does not count.
+    def run(self, datas, order=None, fail_fast=True, timeout=None):
+        ready_time = time.time()
+        waiting = list(order) if order is not None else list(range(len(datas)))
+        total = len(waiting)
+        in_flight = {}
+        submitted = {}
+        done = {}
+        delay = self.delay
+
+        try:
+            while len(done) < total:
+                if len(waiting) > 0 and len(in_flight) < self.max_in_flight:
+                    depth = self.queue_depth()
+
+                    while len(waiting) > 0 and len(in_flight) < self.max_in_flight \
+                            and depth < self.max_queue and self.acquire_global():
+                        index = waiting.pop(0)
+                        response = self.encore.create_job(datas[index])
+                        if not response:
+                            self.release_global()
+                            raise Exception(f"Could not create Encore job {datas[index]['externalId']}",
+                                            self.encore.metrics())
+
+                        in_flight[response["id"]] = index
+                        submitted[response["id"]] = time.time()
+                        self.wait_times.append(time.time() - ready_time)
+                        depth += 1
+
+                # Encore does not call back when its queue gets shorter, while
+                # jobs are waiting for a slot the queue is checked every tick
+                fallback_delay = delay if len(waiting) > 0 else 60
+                finished = finished_jobs(self.encore, list(in_flight), delay,
+                                         callbacks=self.callbacks,
+                                         fallback_delay=fallback_delay)
+
+                if timeout is not None:
+                    # Only jobs submitted more than 'timeout' seconds ago can
+                    # have run that long, they are asked for when they started
+                    unfinished = [job_id for job_id in in_flight if job_id not in finished
+                                  and time.time() - submitted[job_id] > timeout]
+                    for job_id in overdue_jobs(self.encore, unfinished, timeout):
+                        finished[job_id] = timed_out_response(self.encore, job_id, timeout)
+
+                for job_id, response in finished.items():
+                    done[in_flight.pop(job_id)] = response
+                    self.release_global()
+
+                    if fail_fast and response["status"] in FAILED_STATUSES:
+                        return response["message"]
+
+                delay = next_delay(delay, self.delay, self.max_delay, len(finished) > 0)
+        finally:
+            self.release_global(len(in_flight))
+            encore_events.forget(list(in_flight))
+
+        encore_events.forget([response["id"] for response in done.values()])
+
+        return [done.get(index) for index in range(len(datas))]
+
+    def report(self):
+        depths = self.queue_depths
+        waits = self.wait_times
+        return {
+            "submitted": len(waits),
+            "queue_depth_max": max(depths, default=0),
+            "queue_depth_mean": sum(depths) / len(depths) if len(depths) > 0 else 0.0,
+            "wait_time_max": max(waits, default=0.0),
+            "wait_time_mean": sum(waits) / len(waits) if len(waits) > 0 else 0.0,
+        }
+
+
+# Asyncio version of active_job_ids
+async def async_active_job_ids(encore, page_size=100, max_requests=None):
+    active = set()
+    requests = 0
+    most_pages = 1
+
+    for count, status in enumerate(ACTIVE_STATUSES):
+        page = 0
+        while True:
+            response = await encore.find_job_by_status(status, page, page_size)
+            requests += 1
             if not response:
+                return None
+
+            for job in response.get("_embedded", {}).get("encoreJobs", []):
+                active.add(job["id"])
+
+            page += 1
+            total_pages = response.get("page", {}).get("totalPages", 0)
+            most_pages = max(most_pages, total_pages)
+            if max_requests is not None and \
+                    requests + list_requests_left(count, page, total_pages, most_pages) > max_requests:
+                return None
+
+            if page >= total_pages:
                 break
 
-            if response["status"] == "SUCCESSFUL":
-                responses.append(response)
+    return active
+
+
+# Asyncio version of poll_jobs with fail_fast. The jobs that may be done are
+# found like in finished_jobs and asked for concurrently, and the delay
+# between ticks follows next_delay.
+async def async_poll_jobs(encore, encore_ids, delay=3, max_delay=30, bulk_threshold=4):
+
+    min_delay = delay
+    done = {}
+
+    while len(done) < len(encore_ids):
+        await asyncio.sleep(delay)
+
+        pending = [job_id for job_id in encore_ids if job_id not in done]
+        candidates = pending
+        if len(pending) > bulk_threshold:
+            active = await async_active_job_ids(encore, max_requests=len(pending))
+            if active is not None:
+                candidates = [job_id for job_id in pending if job_id not in active]
+
+        responses = await asyncio.gather(*[encore.get_job(job_id) for job_id in candidates])
 
-            if response["status"] == "FAILED":
+        finished = 0
+        for response in responses:
+            # if a response was bad the job is asked for again on the next tick
+            if not response or response["status"] not in TERMINAL_STATUSES:
+                continue
+
+            if response["status"] in FAILED_STATUSES:
                 return response["message"]
 
-        # if all responses was successful terminate the loop
-        if len(encore_ids) == len(responses):
-            return responses
+            done[response["id"]] = response
+            finished += 1
+
+        delay = next_delay(delay, min_delay, max_delay, finished > 0)
+
+    return [done[job_id] for job_id in encore_ids]
 
 
 def get_outputs_locations(responses):
@@ -102,7 +545,9 @@ def get_output_locations(response, type):
     return output_locations
 
 
-def concat_shots(video_locations, base_dir):
+# The renditions are stitched at the same time by at most 'workers' ffmpeg
+# processes. They are stream copies, so the time is spent on disk I/O.
+def concat_shots(video_locations, base_dir, workers=4):
 
     concat_txt_dir = f"{base_dir}concat/"
     remuxed_dir = f"{base_dir}remuxed/"
@@ -114,6 +559,7 @@ def concat_shots(video_locations, base_dir):
         return False
 
     remuxed_locations = []
+    stitches = []
 
     for locations in video_locations:
         # only need to get the name of the video once
@@ -125,14 +571,21 @@ def concat_shots(video_locations, base_dir):
 
         concat = f"{concat_txt_dir}concat_{name}.txt"
         output_dir = f"{remuxed_dir}remuxed_{video}"
-        stitch_video(locations, concat, output_dir)
+        stitches.append((locations, concat, output_dir))
         remuxed_locations.append(output_dir)
 
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() raises the first error of the stitches
+        list(executor.map(lambda stitch: stitch_video(*stitch), stitches))
+
     return remuxed_locations
 
 
-def remux_videos(video_locations, audio_locations, output_location):
+# Every audio and video pair is muxed at the same time by at most 'workers'
+# ffmpeg processes.
+def remux_videos(video_locations, audio_locations, output_location, workers=4):
     outputs = {}
+    muxes = []
     for audio in audio_locations:
         audio_name = audio.split("/")
         audio_name = audio_name[len(audio_name)-1]
@@ -150,11 +603,102 @@ def remux_videos(video_locations, audio_locations, output_location):
             video_name = video_name[len(video_name)-1]
 
             output_remuxed = f"{output_location}{audio_name}_{video_name}"
-            mux_audio_video(video, audio, output_remuxed)
+            muxes.append((video, audio, output_remuxed))
             same_audio.append(output_remuxed)
 
         outputs[audio_name] = same_audio
 
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda mux: mux_audio_video(*mux), muxes))
+
+    return outputs
+
+
+# Same outputs as concat_shots followed by remux_videos, but every output is
+# stitched and muxed with its audio by one ffmpeg process so the stitched
+# video is never written on its own. 'video_locations' are the outputs of
+# every rendition as returned by get_outputs_locations.
+def assemble_videos(video_locations, audio_locations, base_dir, output_location, workers=4):
+
+    concat_txt_dir = f"{base_dir}concat/"
+
+    if not make_dir(concat_txt_dir):
+        return False
+
+    outputs = {}
+    muxes = []
+    for audio in audio_locations:
+        audio_name = audio.split("/")
+        audio_name = audio_name[len(audio_name)-1]
+        # remove container and base_name from encore
+        audio_name = audio_name.split(".")[0]
+        audio_name = audio_name.split("_")[1]
+        same_audio = []
+
+        for locations in video_locations:
+            video = locations[0].split("/")
+            video = video[len(video)-1]
+            name = video.split(".")[0]
+
+            concat = f"{concat_txt_dir}concat_{audio_name}_{name}.txt"
+            output_muxed = f"{output_location}{audio_name}_remuxed_{video}"
+            muxes.append((locations, concat, audio, output_muxed))
+            same_audio.append(output_muxed)
+
+        outputs[audio_name] = same_audio
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda mux: stitch_mux_video(*mux), muxes))
+
+    return outputs
+
+
+# Packages the encoded shots of every rendition and the audio as fragmented
+# MP4 HLS without writing a stitched file first. Every audio gets its own
+# ladder in output_location/{audio name}/ with a stream_{n}/ directory per
+# rendition. The renditions are packaged by at most 'workers' ffmpeg
+# processes. Returns a list with the master playlist of every audio.
+def package_videos(video_locations, audio_locations, base_dir, output_location,
+                   segment_duration=2, workers=4):
+
+    concat_txt_dir = f"{base_dir}concat/"
+
+    if not make_dir(concat_txt_dir):
+        return False
+
+    ladders = {}
+    packages = []
+    for audio in audio_locations:
+        audio_name = audio.split("/")
+        audio_name = audio_name[len(audio_name)-1]
+        # remove container and base_name from encore
+        audio_name = audio_name.split(".")[0]
+        audio_name = audio_name.split("_")[1]
+
+        hls_dir = f"{output_location}{audio_name}/"
+        if not make_dir(hls_dir):
+            return False
+
+        ladders[audio_name] = hls_dir
+        for count, locations in enumerate(video_locations):
+            stream_dir = f"{hls_dir}stream_{count}/"
+            if not make_dir(stream_dir):
+                return False
+
+            name = locations[0].split("/")
+            name = name[len(name)-1].split(".")[0]
+            concat_file = f"{concat_txt_dir}concat_hls_{audio_name}_{name}.txt"
+            packages.append((locations, concat_file, audio, stream_dir, segment_duration))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        renditions = iter(list(executor.map(lambda package: package_hls(*package), packages)))
+
+    outputs = {}
+    for audio_name, hls_dir in ladders.items():
+        variants = [(f"stream_{count}/index.m3u8", next(renditions))
+                    for count in range(0, len(video_locations))]
+        outputs[audio_name] = [write_master_playlist(variants, hls_dir)]
+
     return outputs
 
 
@@ -165,69 +709,92 @@ def create_normal(encore, source, base_dir):
     if not make_dir(normal_dir):
         return False
 
-    while True:
-        data = {
-            "externalId": "normal",
-            "profile": "shot-change-video",
-            "outputFolder": normal_dir,
-            "baseName": "normal",
-            "progressCallbackUri": "",
-            "priority": "0",
-            "debugOverlay": "false",
-            "logContext": {},
-            "inputs": [{
-                "type": "AudioVideo",
-                "uri": source,
-                "params": {}
-            }]
-        }
+    data = {
+        "externalId": "normal",
+        "profile": "shot-change-video",
+        "outputFolder": normal_dir,
+        "baseName": "normal",
+        "progressCallbackUri": "",
+        "priority": "0",
+        "debugOverlay": "false",
+        "logContext": {},
+        "inputs": [{
+            "type": "AudioVideo",
+            "uri": source,
+            "params": {}
+        }]
+    }
+
+    # The Encore client already retries with backoff, a failure here is final
+    response = encore.create_job(data)
+
+    if not response:
+        raise Exception("Could not create Encore job normal", encore.metrics())
+
+    print("normal", response["id"])
+    response = poll_jobs(encore, [response["id"]])[0]
+    outputs = get_output_locations(response, "VideoFile")
+    encore_time = calc_time(
+        response["startedDate"], response["completedDate"])
+    return outputs, encore_time
+
+
+def create_audio_job(job_id, encore, audio_location, output_dir, progress_callback_uri=""):
 
-        response = encore.create_job(data)
+    if not make_dir(output_dir):
+        return False
 
-        if not response:
-            # TODO add some callback function that reports back number of jobs that was created
-            # wait 3 seconds before trying again
-            time.sleep(3)
-            continue
-        else:
-            print("normal", response["id"])
-            response = poll_jobs(encore, [response["id"]])[0]
-            outputs = get_output_locations(response, "VideoFile")
-            encore_time = calc_time(
-                response["startedDate"], response["completedDate"])
-            return outputs, encore_time
+    data = audio_job_data(job_id, audio_location,
+                          output_dir, progress_callback_uri)
 
+    # The Encore client already retries with backoff, a failure here is final
+    response = encore.create_job(data)
 
-def create_audio_job(job_id, encore, audio_location, output_dir):
+    if not response:
+        raise Exception(f"Could not create Encore job {job_id}-a", encore.metrics())
 
-    if not make_dir(output_dir):
-        return False
+    return response["id"]
 
-    while True:
-        data = {
-            "externalId": f"{job_id}-a",
-            "profile": "audio-only",
-            "outputFolder": output_dir,
-            "baseName": "audio",
-            "priority": "0",
-            "debugOverlay": "false",
-            "logContext": {},
-            "inputs": [{
-                "type": "Audio",
-                "uri": audio_location,
-                "params": {}
-            }]
-        }
 
-        response = encore.create_job(data)
+# Creates the audio job of a transcode on its own, so it can start as soon as
+# the audio is demuxed. The id is passed to encore_transcode as audio_id.
+def start_audio_job(job_id, url, audio_location, output_dir, progress_callback_uri=""):
+    encore = Encore(url)
 
-        if not response:
-            # TODO add some callback function that reports back number of jobs that was created
-            # wait 3 seconds before trying again
-            time.sleep(3)
-            continue
-        else:
-            return response["id"]
+    audio_id = create_audio_job(job_id, encore, audio_location,
+                                f"{output_dir}encoded_audio", progress_callback_uri)
+    encore.close()
+
+    return audio_id
+
+
+# Waits for the audio job and returns the locations of its outputs. Raises an
+# exception if the audio job failed.
+def audio_outputs(encore, audio_id, callbacks=False):
+    audio_response = poll_jobs(encore, [audio_id], callbacks=callbacks, fail_fast=False)[0]
+
+    if audio_response["status"] != "SUCCESSFUL":
+        raise Exception(f"Audio job {audio_id} failed", audio_response.get("message"))
+
+    return get_output_locations(audio_response, "AudioFile")
+
+
+def audio_job_data(job_id, audio_location, output_dir, progress_callback_uri=""):
+    return {
+        "externalId": f"{job_id}-a",
+        "profile": "audio-only",
+        "outputFolder": output_dir,
+        "baseName": "audio",
+        "progressCallbackUri": progress_callback_uri,
+        "priority": "0",
+        "debugOverlay": "false",
+        "logContext": {},
+        "inputs": [{
+            "type": "Audio",
+            "uri": audio_location,
+            "params": {}
+        }]
+    }
 
 
 def calc_time(start_date, completed_date):
@@ -236,24 +803,358 @@ def calc_time(start_date, completed_date):
     return (completed_date-start_date).total_seconds()
 
 
-def encore_transcode(job_id, url, video_paths, audio_path, output_dir):
+# Policies for the order shots are submitted to Encore in. "longest" submits
+# the longest shots first so a long shot does not start last and become the
+# tail of the job. "cost" orders by the predicted encode time from duration
+# and resolution, for shots that differ in resolution or frame rate.
+# Outputs are always returned in timeline order.
+ORDER_POLICIES = ["timeline", "longest", "cost"]
+
+# Model of the encode time of a shot: a fixed overhead per Encore job plus the
+# number of pixels in the shot divided by how many pixels Encore encodes per
+# second. Used by the "cost" policy and by benchmarks/makespan.py.
+JOB_OVERHEAD = 5.0
+PIXEL_RATE = 1920 * 1080 * 50
+
+
+def predicted_cost(duration, width=1920, height=1080, frame_rate=25,
+                   job_overhead=JOB_OVERHEAD, pixel_rate=PIXEL_RATE):
+    return job_overhead + duration * frame_rate * width * height / pixel_rate
+
+
+def submission_order(video_paths, policy="timeline", shot_durations=None):
+    # Returns the shot indices in the order they should be submitted in.
+    # The shot durations are probed with ffprobe if they are not given, or if
+    # some shots were merged when the video was cut so they no longer match.
+    if policy == "timeline":
+        return list(range(0, len(video_paths)))
+
+    if policy not in ORDER_POLICIES:
+        raise Exception(f"Unknown order policy {policy}")
+
+    if policy == "longest" and shot_durations is not None \
+            and len(shot_durations) == len(video_paths):
+        costs = shot_durations
+    else:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            information = list(executor.map(video_information, video_paths))
+
+        if policy == "longest":
+            costs = [info["duration"] for info in information]
+        else:
+            costs = [predicted_cost(info["duration"], info["width"], info["height"],
+                                    info["frame_rate"]) for info in information]
+
+    # sorted is stable so shots with the same cost keep timeline order
+    return sorted(range(0, len(video_paths)), key=lambda count: -costs[count])
+
+
+# Looks up every shot in a ShotCache. Returns the cache key of every shot and
+# the response of the shots found in the cache, None for the others. The
+# outputs of the found shots are linked into the output folder of the shot.
+def cached_shots(cache, video_paths, base_dir, profile, params):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        hashes = list(executor.map(file_hash, video_paths))
+
+    keys = [cache_key(content_hash, profile, params) for content_hash in hashes]
+    cached = [cache.fetch(keys[count], f"{base_dir}v-{count}")
+              for count in range(0, len(video_paths))]
+
+    return keys, cached
+
+
+# Splits a shot in two at its middle. The halves are re-encoded so they cut
+# exactly at the middle, a stream copy could only cut at keyframes and may
+# give one half all of the shot. Returns the paths of the halves. Raises an
+# exception when the shot has less than two frames.
+def split_shot(video_path, output_dir):
+    if not make_dir(output_dir):
+        raise Exception(f"Could not create the directory {output_dir}")
+
+    name = video_path.split("/")
+    name = name[len(name)-1]
+    name, container = name.split(".")[0:2]
+
+    information = video_information(video_path)
+    if information["duration"] * information["frame_rate"] < 2:
+        raise Exception(f"Shot {video_path} is too short to be split")
+
+    middle = information["duration"] / 2
+
+    return [encode_range(video_path, 0, middle, f"{output_dir}{name}-0.{container}"),
+            encode_range(video_path, middle, None, f"{output_dir}{name}-1.{container}")]
+
+
+# Sends the shots that failed or timed out to Encore again, on their own,
+# until they succeed. 'video_responses' holds the response of every shot in
+# 'order'. A shot is retried at most 'retries' times and all shots together
+# at most min_retries + retry_budget * number of shots times. After
+# 'split_after' attempts, a failing shot is split in two and the parts are
+# encoded as their own jobs. Returns the responses of the parts of every shot in
+# order, one response for shots that were not split. Raises an exception
+# when a shot can not be encoded within the limits.
+def retry_failed_shots(job_id, encore, video_paths, video_responses, base_dir, order,
+                       retries=2, retry_budget=0.1, min_retries=4, split_after=1,
+                       timeout=None, callbacks=False, **job_options):
+
+    # shot -> list of [path, response] of its parts
+    parts = {count: [[video_paths[count], video_responses[count]]] for count in order}
+    attempts = {count: 0 for count in order}
+    budget = min_retries + retry_budget * len(order)
+    used = 0
+
+    while True:
+        failed = [(count, part) for count in order for part in parts[count]
+                  if part[1]["status"] != "SUCCESSFUL"]
+        if len(failed) == 0:
+            break
+
+        submitted = {}
+        for count in dict.fromkeys(count for count, _ in failed):
+            attempts[count] += 1
+            attempt = attempts[count]
+            failed_parts = [part for shot, part in failed if shot == count]
+            message = failed_parts[0][1].get("message")
+
+            if attempt > retries:
+                raise Exception(f"Shot {count} of job '{job_id}' failed", message)
+
+            if attempt > split_after:
+                new_parts = []
+                for part in parts[count]:
+                    if any(part is failed_part for failed_part in failed_parts):
+                        paths = split_shot(part[0], f"{base_dir}split/v-{count}-{attempt}/")
+                        new_parts += [[path, None] for path in paths]
+                    else:
+                        new_parts.append(part)
+                parts[count] = new_parts
+                failed_parts = [part for part in new_parts if part[1] is None]
+
+            if used + len(failed_parts) > budget:
+                raise Exception(f"Retry budget of job '{job_id}' is used up, shot {count} failed",
+                                message)
+
+            print(f"Retrying shot {count} of job '{job_id}' in {len(failed_parts)} jobs, "
+                  f"attempt {attempt}: {message}")
+
+            for part_count, part in enumerate(failed_parts):
+                data = video_job_data(f"{count}-r{attempt}-{part_count}", part[0], base_dir,
+                                      **job_options)
+                response = encore.create_job(data)
+                if not response:
+                    raise Exception(f"Could not create Encore job {data['externalId']}",
+                                    encore.metrics())
+                submitted[response["id"]] = part
+                used += 1
+
+        encore_ids = list(submitted)
+        responses = poll_jobs(encore, encore_ids, callbacks=callbacks, fail_fast=False,
+                              timeout=timeout)
+        for encore_id, response in zip(encore_ids, responses):
+            submitted[encore_id][1] = response
+
+    if used > 0:
+        print(f"Retried {used} shot jobs of job '{job_id}'")
+
+    return {count: [part[1] for part in parts[count]] for count in order}
+
+
+# Transcodes the audio and every shot with Encore. With max_in_flight set the
+# shots are fed to Encore by a SubmissionScheduler instead of all at once.
+# Shots are submitted in the order given by order_policy, see ORDER_POLICIES.
+# With a ShotCache, shots that were encoded before are taken from the cache
+# and only the other shots are sent to Encore. Shots that fail or have been
+# running in Encore for more than shot_timeout seconds are retried on their
+# own, see retry_failed_shots.
+# If the audio job was already started with start_audio_job its id is passed
+# as audio_id. The audio job is waited for at the same time as the shots.
+# Shots are submitted one by one unless the caller opts in to 'concurrency'
+# concurrent submissions, see create_video_jobs_concurrently.
+def encore_transcode(job_id, url, video_paths, audio_path, output_dir, concurrency=1,
+                     progress_callback_uri="", max_in_flight=None, max_queue=64,
+                     order_policy="timeline", shot_durations=None, cache=None,
+                     profile="shot-change-video-only", params={}, retries=2,
+                     shot_timeout=None, audio_id=None):
 
     encore = Encore(url)
 
     audio_dir = f"{output_dir}encoded_audio"
     shots_dir = f"{output_dir}encoded_shots/"
+    # Encore posts progress to the callback uri, see api/routes/CallbackAPI.py
+    callbacks = progress_callback_uri != ""
 
     # TODO fixa error handling genom hela skiten
-    audio_id = create_audio_job(job_id, encore, audio_path, audio_dir)
-    video_ids = create_video_jobs(job_id, encore, video_paths, shots_dir)
+    if audio_id is None:
+        audio_id = create_audio_job(job_id, encore, audio_path, audio_dir, progress_callback_uri)
+
+    # The audio job is polled by its own client in the background
+    audio_encore = Encore(url)
+    audio_executor = ThreadPoolExecutor(max_workers=1)
+    audio_future = audio_executor.submit(audio_outputs, audio_encore, audio_id, callbacks)
+
+    # The audio poll is ended on every way out, if the shots fail nothing
+    # waits for the audio so its job is cancelled, which also ends the poll
+    success = False
+    try:
+        if cache is not None:
+            keys, cached = cached_shots(cache, video_paths, shots_dir, profile, params)
+        else:
+            keys, cached = None, [None] * len(video_paths)
+
+        order = [count for count in submission_order(video_paths, order_policy, shot_durations)
+                 if cached[count] is None]
+
+        if max_in_flight is not None:
+            if not make_dir(shots_dir):
+                return False
+
+            datas = [video_job_data(count, video_paths[count], shots_dir, profile=profile,
+                                    progress_callback_uri=progress_callback_uri, params=params)
+                     for count in range(0, len(video_paths))]
+            scheduler = SubmissionScheduler(encore, max_in_flight, max_queue=max_queue,
+                                            callbacks=callbacks)
+            video_responses = scheduler.run(datas, order, fail_fast=False, timeout=shot_timeout)
+            print(f"Encore queue for job '{job_id}': {scheduler.report()}")
+        elif concurrency > 1:
+            video_ids = create_video_jobs_concurrently(
+                job_id, url, video_paths, shots_dir, concurrency, order, profile=profile,
+                progress_callback_uri=progress_callback_uri, params=params)
+        else:
+            video_ids = create_video_jobs(job_id, encore, video_paths, shots_dir, profile=profile,
+                                          progress_callback_uri=progress_callback_uri,
+                                          params=params, order=order)
+
+        if max_in_flight is None:
+            responses = poll_jobs(encore, [video_ids[count] for count in order],
+                                  callbacks=callbacks, fail_fast=False, timeout=shot_timeout)
+            video_responses = [None] * len(video_paths)
+            for count, response in zip(order, responses):
+                video_responses[count] = response
+
+        shot_responses = retry_failed_shots(job_id, encore, video_paths, video_responses,
+                                            shots_dir, order, retries, timeout=shot_timeout,
+                                            callbacks=callbacks, profile=profile,
+                                            progress_callback_uri=progress_callback_uri,
+                                            params=params)
+
+        if cache is not None:
+            # Split shots have several outputs per profile and are not cached
+            for count in order:
+                if len(shot_responses[count]) == 1:
+                    cache.store(keys[count], shot_responses[count][0])
+            print(f"Shot cache for job '{job_id}': {cache.metrics()}")
+
+        # The parts of a split shot follow each other and are concatenated as shots
+        video_responses = []
+        for count in range(0, len(video_paths)):
+            if cached[count] is not None:
+                video_responses.append(cached[count])
+            else:
+                video_responses += shot_responses[count]
+
+        video_locations = get_outputs_locations(video_responses)
+
+        # encore_time = calc_time(audio_response["startedDate"],
+        #                        max([response["completedDate"] for response in video_responses]))
+
+        audio_locations = audio_future.result()
+        success = True
+    finally:
+        if not success:
+            encore.cancel_job(audio_id)
+        audio_executor.shutdown()
+        audio_encore.close()
+
+        print(f"Encore requests for job '{job_id}': {encore.metrics()}")
+        encore.close()
+
+    return video_locations, audio_locations
+
+
+# Asyncio version of encore_transcode. Shots are submitted concurrently with
+# at most 'concurrency' requests in flight and outputs are kept in shot order.
+async def async_encore_transcode(job_id, url, video_paths, audio_path, output_dir, concurrency=16):
+
+    audio_dir = f"{output_dir}encoded_audio"
+    shots_dir = f"{output_dir}encoded_shots/"
+
+    if not make_dir(audio_dir):
+        return False
 
-    audio_response = poll_jobs(encore, [audio_id])[0]
-    audio_locations = get_output_locations(audio_response, "AudioFile")
+    async with AsyncEncore(url, pool_size=concurrency) as encore:
+        audio_response = await encore.create_job(
+            audio_job_data(job_id, audio_path, audio_dir))
+        if not audio_response:
+            raise Exception(f"Could not create Encore job {job_id}-a", encore.metrics())
 
-    video_responses = poll_jobs(encore, video_ids)
-    video_locations = get_outputs_locations(video_responses)
+        video_ids = await async_create_video_jobs(job_id, encore, video_paths, shots_dir,
+                                                  concurrency)
 
-    # encore_time = calc_time(audio_response["startedDate"],
-    #                        max([response["completedDate"] for response in video_responses]))
+        # The audio job is waited for at the same time as the shots
+        audio_responses, video_responses = await asyncio.gather(
+            async_poll_jobs(encore, [audio_response["id"]]),
+            async_poll_jobs(encore, video_ids))
+
+        if isinstance(audio_responses, str):
+            raise Exception(f"Audio job of job '{job_id}' failed", audio_responses)
+        if isinstance(video_responses, str):
+            raise Exception(f"Shots of job '{job_id}' failed", video_responses)
+
+        audio_locations = get_output_locations(audio_responses[0], "AudioFile")
+        video_locations = get_outputs_locations(video_responses)
+
+        print(f"Encore requests for job '{job_id}': {encore.metrics()}")
+
+    return video_locations, audio_locations
+
+
+# Streaming version of video_shot_split followed by encore_transcode. Shot
+# detection runs in the background and every shot is cut and submitted to
+# Encore as soon as its end is known, so encoding overlaps with detection.
+# Shots that fail are retried like in encore_transcode, see retry_failed_shots.
+def stream_transcode(job_id, url, video_location, audio_path, output_dir, shot_parameter,
+                     shot_length=0, profile="full", retries=2, shot_timeout=None):
+
+    audio_dir = f"{output_dir}encoded_audio"
+    cut_dir = f"{output_dir}shots/"
+    shots_dir = f"{output_dir}encoded_shots/"
+
+    if not make_dir(cut_dir) or not make_dir(shots_dir):
+        raise Exception(f"Could not create the shot directories of job '{job_id}' in {output_dir}")
+
+    encore = Encore(url)
+    try:
+        audio_id = create_audio_job(job_id, encore, audio_path, audio_dir)
+
+        name = video_location.split("/")
+        name = name[len(name)-1]
+        name, container = name.split(".")[0:2]
+
+        shot_paths = []
+        video_ids = []
+        boundaries = stream_keyframe_shots(
+            video_location, shot_parameter, shot_length, profile)
+
+        for count, (start, end) in enumerate(boundaries):
+            shot_paths.append(cut_shot(video_location, start, end,
+                                       f"{cut_dir}{name}-{count}.{container}"))
+            video_ids.append(create_video_job(
+                job_id, encore, count, shot_paths[count], shots_dir))
+
+        # The audio and the shots are waited for together
+        responses = poll_jobs(encore, [audio_id] + video_ids, fail_fast=False,
+                              timeout=shot_timeout)
+        if responses[0]["status"] != "SUCCESSFUL":
+            raise Exception(f"Audio job {audio_id} failed", responses[0].get("message"))
+        audio_locations = get_output_locations(responses[0], "AudioFile")
+
+        order = list(range(0, len(shot_paths)))
+        shot_responses = retry_failed_shots(job_id, encore, shot_paths, responses[1:],
+                                            shots_dir, order, retries, timeout=shot_timeout)
+        video_locations = get_outputs_locations(
+            [response for count in order for response in shot_responses[count]])
+    finally:
+        print(f"Encore requests for job '{job_id}': {encore.metrics()}")
+        encore.close()
 
     return video_locations, audio_locations
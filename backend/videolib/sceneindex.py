@@ -0,0 +1,314 @@
+"""! This module keeps an index of the scene score of every frame in a video
+
+Shot detection with the scene filter decodes the whole video for every
+threshold. The index decodes the video once, stores the scene score and
+timestamp of every frame in a binary file next to the video and answers
+format_shot_detection queries for any threshold from memory.
+"""
+import os
+import sys
+import time
+import struct
+from array import array
+
+import numpy as np
+
+from videolib.videoprocess import (
+    call_subprocess, subprocess_error, video_duration, video_start_time,
+    merge_short_shots, merge_short_shots_batch, parallel_scene
+)
+
+# Magic, source size, source mtime (ns), duration, frame count, path length
+HEADER = struct.Struct("<8sQqdIH")
+MAGIC = b"SCNIDX01"
+EXTENSION = ".scenes"
+
+# Indexes that have already been loaded in this process, keyed by
+# (path, size, mtime)
+_loaded = {}
+
+
+def scene_scores(video_location):
+    """! The timestamp and scene score of every frame in the video
+
+    @param video_location   The filepath to the video
+
+    @return Two arrays, the timestamps (float64) and scene scores (float32)
+    """
+    command = f'ffprobe \
+                -hide_banner \
+                -v panic \
+                -show_entries frame=pts_time:frame_tags=lavfi.scene_score \
+                -of csv=p=0 \
+                -f lavfi "movie={video_location}, select=\'gte(scene,0)\'"'
+
+    start_time = time.time()
+
+    result = call_subprocess(command)
+
+    duration = time.time() - start_time
+
+    subprocess_error(result, "Scene scores")
+
+    print(f"Scene scores done in: {duration} seconds")
+
+    return parse_scene_scores(result.stdout)
+
+
+def parse_scene_scores(output):
+    """! Parses the csv output of scene_scores
+
+    @param output   Lines on the format pts_time,scene_score
+
+    @return Two arrays, the timestamps (float64) and scene scores (float32)
+    """
+    pts = array("d")
+    scores = array("f")
+
+    for line in output.splitlines():
+        values = line.strip().split(",")
+        if len(values) < 2 or values[0] in ("", "N/A"):
+            continue
+
+        pts.append(float(values[0]))
+        scores.append(float(values[1]) if values[1] else 0.0)
+
+    return pts, scores
+
+
+def index_location(video_location):
+    """! The filepath of the index file that belongs to the video"""
+    return f"{video_location}{EXTENSION}"
+
+
+class SceneIndex:
+
+    def __init__(self, video_location, size, mtime, duration, pts, scores):
+        self.video_location = video_location
+        self.size = size
+        self.mtime = mtime
+        self.duration = duration
+        self.pts = pts
+        self.scores = scores
+
+    def key(self):
+        return (self.video_location, self.size, self.mtime)
+
+    def shot_detection(self, shot_parameter):
+        """! The timestamps where the scene score is greater than shot_parameter
+
+        @param shot_parameter   Value between 0-1 where 1 is the least amount of change
+
+        @return The timestamps of shots as floats
+        """
+        pts = np.frombuffer(self.pts, dtype=np.float64)
+        scores = np.frombuffer(self.scores, dtype=np.float32)
+
+        return pts[scores > shot_parameter].tolist()
+
+    def format_shot_detection(self, shot_parameter, shot_length=0):
+        """! Same result as videoprocess.format_shot_detection without decoding the video
+
+        @param shot_parameter   Value between 0-1 where 1 is the least amount of change
+        @param shot_length      The minimum length of a shot (number)
+
+        @return The formatted timestamps of the shots
+        """
+        return merge_short_shots(self.detection(shot_parameter), shot_length)
+
+    def format_shot_detection_batch(self, shot_parameter, shot_lengths):
+        """! format_shot_detection for several minimum shot lengths at once
+
+        @param shot_parameter   Value between 0-1 where 1 is the least amount of change
+        @param shot_lengths     The minimum lengths of a shot (numbers)
+
+        @return Dictionary from every shot length to its formatted timestamps
+        """
+        return merge_short_shots_batch(self.detection(shot_parameter), shot_lengths)
+
+    def detection(self, shot_parameter):
+        """! The timestamps of the shots including start and end of the video"""
+        detection = [0.0] + self.shot_detection(shot_parameter) + [self.duration]
+
+        return [f"{timestamp:.6f}" for timestamp in detection]
+
+    def save(self, location):
+        """! Writes the index to a binary file
+
+        @param location     The filepath of the index file
+        """
+        path = self.video_location.encode("utf-8")
+        pts = array("d", self.pts)
+        scores = array("f", self.scores)
+
+        # The file is always stored as little endian
+        if sys.byteorder == "big":
+            pts.byteswap()
+            scores.byteswap()
+
+        with open(location, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.size, self.mtime,
+                    self.duration, len(pts), len(path)))
+            f.write(path)
+            f.write(pts.tobytes())
+            f.write(scores.tobytes())
+
+    @staticmethod
+    def load(location):
+        """! Reads an index from a binary file
+
+        @param location     The filepath of the index file
+
+        @return The SceneIndex or None if the file is not a valid index
+        """
+        try:
+            with open(location, "rb") as f:
+                header = f.read(HEADER.size)
+                if len(header) != HEADER.size:
+                    return None
+
+                magic, size, mtime, duration, count, path_length = HEADER.unpack(header)
+                if magic != MAGIC:
+                    return None
+
+                video_location = f.read(path_length).decode("utf-8")
+                pts = array("d")
+                pts.frombytes(f.read(count * pts.itemsize))
+                scores = array("f")
+                scores.frombytes(f.read(count * scores.itemsize))
+        except (OSError, ValueError, UnicodeDecodeError):
+            return None
+
+        if len(pts) != count or len(scores) != count:
+            return None
+
+        if sys.byteorder == "big":
+            pts.byteswap()
+            scores.byteswap()
+
+        return SceneIndex(video_location, size, mtime, duration, pts, scores)
+
+    @staticmethod
+    def build(video_location, workers=1):
+        """! Decodes the video once and creates its index
+
+        @param video_location   The filepath to the video
+        @param workers          Number of processes decoding time ranges of the video, 
+                                None uses all cores
+
+        @return The SceneIndex of the video
+        """
+        stat = os.stat(video_location)
+
+        if workers == 1:
+            pts, scores = scene_scores(video_location)
+        else:
+            frames = parallel_scene(video_location, "gte(scene,0)", workers)
+            pts = array("d", [frame[0] for frame in frames])
+            scores = array("f", [frame[1] for frame in frames])
+
+        duration = float(video_duration(video_location))
+
+        return SceneIndex(video_location, stat.st_size, stat.st_mtime_ns, duration, pts, scores)
+
+
+def cached_scene_index(video_location):
+    """! Returns the index of the video if it is already loaded or stored 
+        next to the video and matches its size and modification time
+
+    @param video_location   The filepath to the video
+
+    @return The SceneIndex of the video or None
+    """
+    video_location = os.path.abspath(video_location)
+    stat = os.stat(video_location)
+    key = (video_location, stat.st_size, stat.st_mtime_ns)
+
+    if key in _loaded:
+        return _loaded[key]
+
+    index = SceneIndex.load(index_location(video_location))
+
+    if index is None or index.key() != key:
+        return None
+
+    _loaded[key] = index
+
+    return index
+
+
+def store_scene_index(index):
+    """! Stores the index next to its video and keeps it in memory
+
+    @param index    The SceneIndex to store
+
+    @return The stored SceneIndex
+    """
+    location = index_location(index.video_location)
+
+    try:
+        index.save(location)
+    except OSError as e:
+        # The index still works from memory if the directory is read only
+        print(f"Could not save scene index: {location}", e)
+
+    _loaded[index.key()] = index
+
+    return index
+
+
+def scene_index_from_frames(video_location, frames):
+    """! Creates and stores the index from scene scores that were computed 
+        elsewhere, for example by videoprocess.demux
+
+    @param video_location   The filepath to the video
+    @param frames           List of (timestamp, scene score) for every frame
+
+    @return The SceneIndex of the video
+    """
+    video_location = os.path.abspath(video_location)
+    stat = os.stat(video_location)
+    pts = array("d", [frame[0] for frame in frames])
+    scores = array("f", [frame[1] for frame in frames])
+    duration = float(video_duration(video_location))
+
+    return store_scene_index(SceneIndex(video_location, stat.st_size, stat.st_mtime_ns,
+                                        duration, pts, scores))
+
+
+def scene_index_from_copy(video_location, copy_location):
+    """! Creates and stores the index of a video from a local copy of its
+        video stream, for example from videoprocess.demux, so the source is
+        not read again
+
+    @param video_location   The filepath to the video
+    @param copy_location    The filepath to the copy
+
+    @return The SceneIndex of the video
+    """
+    pts, scores = scene_scores(copy_location)
+    # The copy starts at 0, the index keeps the timestamps of the source
+    offset = video_start_time(video_location) - video_start_time(copy_location)
+
+    frames = [(frame_pts + offset, score) for frame_pts, score in zip(pts, scores)]
+
+    return scene_index_from_frames(video_location, frames)
+
+
+def scene_index(video_location, workers=1):
+    """! Returns the index of the video. The index is read from memory or
+        disk when it matches the size and modification time of the video,
+        otherwise it is built and stored next to the video.
+
+    @param video_location   The filepath to the video
+    @param workers          Number of processes used if the index is built
+
+    @return The SceneIndex of the video
+    """
+    index = cached_scene_index(video_location)
+
+    if index is None:
+        index = store_scene_index(SceneIndex.build(
+            os.path.abspath(video_location), workers))
+
+    return index
@@ -0,0 +1,232 @@
+"""! This module keeps a cache of the Encore outputs of shots on disk
+
+Sweeps over thresholds and shot lengths, and jobs on the same source, cut
+many byte-identical shots and encode them with the same profile again. The
+cache is keyed by the hash of the shot file, the Encore profile and the input
+params, so a shot is only sent to Encore the first time it is seen.
+
+Every entry is a directory named by its key with the output files and an
+entry.json that lists them in the order Encore returned them. When the cache
+grows above its size limit the least recently used entries are removed.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from uuid import uuid4
+
+ENTRY_FILE = "entry.json"
+
+# Caches that have been opened in this process, keyed by directory
+_opened = {}
+_opened_lock = threading.Lock()
+
+
+def file_hash(location, block_size=1 << 20):
+    """! The sha256 of the content of a file
+
+    @param location     The filepath of the file
+
+    @return The hash as a hex string
+    """
+    sha = hashlib.sha256()
+
+    with open(location, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def cache_key(content_hash, profile, params):
+    """! The key of a shot encoded with an Encore profile and input params"""
+    description = json.dumps([content_hash, profile, params], sort_keys=True)
+
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+def link_file(source, destination):
+    """! Hard links source to destination, or copies it if they are on
+        different file systems"""
+    if os.path.exists(destination):
+        os.remove(destination)
+
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+class ShotCache:
+
+    def __init__(self, directory, max_bytes):
+        """
+        directory   The directory of the cache, created if it does not exist
+        max_bytes   Max total size of the cached files
+        """
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        # key -> [size in bytes, last use]
+        self.entries = {}
+        self.size = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        """! Reads the entries that are already on disk"""
+        for key in os.listdir(self.directory):
+            entry_dir = os.path.join(self.directory, key)
+            entry_file = os.path.join(entry_dir, ENTRY_FILE)
+
+            if not os.path.isfile(entry_file):
+                # Left behind by a store that did not finish
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+
+            size = sum(os.path.getsize(os.path.join(entry_dir, name))
+                       for name in os.listdir(entry_dir))
+            self.entries[key] = [size, os.path.getmtime(entry_file)]
+            self.size += size
+
+    def fetch(self, key, output_dir):
+        """! Links the cached outputs of a shot into output_dir
+
+        @param key          The key from cache_key
+        @param output_dir   The directory the outputs are linked to
+
+        @return An Encore job response with the linked outputs, or None on a miss
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            # Marked as used first so it is the last entry to be evicted
+            # while it is linked
+            self.entries[key][1] = time.time()
+
+        # The files are linked or copied without the lock so other jobs are
+        # not blocked by a slow copy
+        entry_dir = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry_dir, ENTRY_FILE)) as f:
+                outputs = json.load(f)
+
+            os.makedirs(output_dir, exist_ok=True)
+            for output in outputs:
+                destination = os.path.join(output_dir, output["file"])
+                link_file(os.path.join(entry_dir, output["file"]), destination)
+                output["file"] = destination
+
+            os.utime(os.path.join(entry_dir, ENTRY_FILE))
+            last_use = os.path.getmtime(os.path.join(entry_dir, ENTRY_FILE))
+        except (OSError, ValueError) as e:
+            print(f"Could not read shot cache entry: {entry_dir}", e)
+            with self.lock:
+                # The entry may have been evicted while it was read
+                if key in self.entries:
+                    self.remove(key)
+                self.misses += 1
+            return None
+
+        with self.lock:
+            if key in self.entries:
+                self.entries[key][1] = last_use
+            self.hits += 1
+
+        return {"status": "SUCCESSFUL", "output": outputs, "cached": True}
+
+    def store(self, key, response):
+        """! Adds the outputs of a finished Encore job to the cache
+
+        @param key          The key from cache_key
+        @param response     The Encore job response of the shot
+        """
+        with self.lock:
+            if key in self.entries:
+                return
+
+        # The entry is written to a temporary directory and renamed when it
+        # is complete, so a crash never leaves a half written entry
+        temp_dir = os.path.join(self.directory, f".{uuid4()}")
+        entry_dir = os.path.join(self.directory, key)
+
+        try:
+            os.makedirs(temp_dir)
+            outputs = []
+            for output in response["output"]:
+                name = os.path.basename(output["file"])
+                link_file(output["file"], os.path.join(temp_dir, name))
+                outputs.append(dict(output, file=name))
+
+            with open(os.path.join(temp_dir, ENTRY_FILE), "w") as f:
+                json.dump(outputs, f)
+
+            size = sum(os.path.getsize(os.path.join(temp_dir, name))
+                       for name in os.listdir(temp_dir))
+            os.rename(temp_dir, entry_dir)
+        except OSError as e:
+            # Another job stored the same shot first, or the disk is full
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            if not os.path.isdir(entry_dir):
+                print(f"Could not store shot cache entry: {entry_dir}", e)
+            return
+
+        with self.lock:
+            self.entries[key] = [size, os.path.getmtime(os.path.join(entry_dir, ENTRY_FILE))]
+            self.size += size
+            self.stores += 1
+            self.evict()
+
+    def remove(self, key):
+        size, _ = self.entries.pop(key)
+        self.size -= size
+        shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+    def evict(self):
+        """! Removes the least recently used entries until the cache fits max_bytes"""
+        while self.size > self.max_bytes and len(self.entries) > 0:
+            key = min(self.entries, key=lambda key: self.entries[key][1])
+            self.remove(key)
+            self.evictions += 1
+
+    def metrics(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
+
+
+def shot_cache(directory, max_bytes=50 * 1024**3):
+    """! Returns the ShotCache of a directory, every directory is only opened
+        once per process so all jobs share its metrics and lock
+
+    @param directory    The directory of the cache
+    @param max_bytes    Max total size of the cached files, 50 GiB by default
+
+    @return The ShotCache
+    """
+    directory = os.path.abspath(directory)
+
+    with _opened_lock:
+        if directory not in _opened:
+            _opened[directory] = ShotCache(directory, max_bytes)
+
+        return _opened[directory]
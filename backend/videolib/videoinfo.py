@@ -1,7 +1,12 @@
 
+import os
 import sys
-import re
-from videolib.videoprocess import call_subprocess, subprocess_error
+import json
+import shutil
+import tempfile
+from videolib.videoprocess import (
+    call_subprocess, subprocess_error, vmaf_score_shots, vmaf_log_score
+)
 
 # In this file are functions related to gathering/computing information about
 # video files that should be/have been processed by videoprocess.py
@@ -25,25 +30,80 @@ def ffprobe_information_json(video_location):
 # Computes the VMAF score between two files. 'input_video' is the reference
 # video and 'processed_video' is the distorted video. 'n_subsample' is to
 # compute VMAF score for every n:th frame. If set to 1, every frame will be
-# computed. Returns empty string on error or the VMAF score as a string on the
-# format: # xx.dddddd
+# computed. The json log of libvmaf is written to 'log_path', with the score
+# of every frame, or to a temporary file if it is None. Returns empty string
+# on error or the VMAF score as a string on the format: # xx.dddddd
 def compute_vmaf_score(input_video, processed_video, n_threads=2, n_subsample=1,
-                       model_path='videolib/vmaf_models/vmaf_v0.6.1.json'):
+                       model_path='videolib/vmaf_models/vmaf_v0.6.1.json', log_path=None):
 
-    command = f"ffmpeg \
-        -i {processed_video} \
-        -i {input_video} \
-        -lavfi libvmaf=model_path='{model_path}:n_threads={n_threads}:n_subsample={n_subsample}' \
-        -f null -"
+    temp_dir = None
+    if log_path is None:
+        temp_dir = tempfile.mkdtemp()
+        log_path = os.path.join(temp_dir, "vmaf.json")
+
+    command = ["ffmpeg", "-hide_banner", "-nostats",
+               "-i", processed_video,
+               "-i", input_video,
+               "-lavfi", f"libvmaf=model_path='{model_path}':n_threads={n_threads}"
+                         f":n_subsample={n_subsample}:log_fmt=json:log_path='{log_path}'",
+               "-f", "null", "-"]
 
     result = call_subprocess(command)
 
     try:
-        vmaf_search = re.search('VMAF score: \d+\.\d+', result.stderr)
-        vmaf_score_str = vmaf_search.group(0)[-9:]
-    except:
+        if result.returncode != 0:
+            print("Could not compute VMAF score", result.stderr)
+            return ''
+
+        return f"{vmaf_log_score(log_path):.6f}"
+    except (OSError, ValueError, KeyError) as e:
+        print("Could not read VMAF log", e)
         return ''
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
-    # TODO: Error handling
 
-    return vmaf_score_str
+# Same as compute_vmaf_score but every shot in 'detection' (formatted timestamps
+# including start and end) is scored by its own ffmpeg process, 'workers' at
+# the same time. Returns the frame weighted score of the whole video on the
+# same format as compute_vmaf_score, and the result of vmaf_score_shots with
+# the score of every shot. Returns empty string and None on error.
+def compute_vmaf_score_shots(input_video, processed_video, detection, log_location,
+                             workers=None, n_subsample=1,
+                             model_path='videolib/vmaf_models/vmaf_v0.6.1.json'):
+    try:
+        result = vmaf_score_shots(processed_video, input_video, model_path, log_location,
+                                  detection, workers=workers, n_subsample=n_subsample)
+    except Exception as e:
+        print("Could not compute VMAF per shot", e)
+        return '', None
+
+    if not result or result["frames"] == 0:
+        return '', None
+
+    return f"{result['score']:.6f}", result
+
+
+# Returns the duration, width, height and frame rate of the first video stream
+# of a file as a dictionary. Used to order shots by their encode cost.
+def video_information(video_location):
+    command = ["ffprobe", "-v", "error",
+               "-select_streams", "v:0",
+               "-show_entries", "stream=width,height,r_frame_rate:format=duration",
+               "-of", "json",
+               video_location]
+
+    result = call_subprocess(command)
+    subprocess_error(result, "Video information")
+
+    information = json.loads(result.stdout)
+    stream = information["streams"][0]
+    numerator, denominator = stream["r_frame_rate"].split("/")
+
+    return {
+        "duration": float(information["format"]["duration"]),
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "frame_rate": float(numerator) / float(denominator) if float(denominator) > 0 else 0.0,
+    }
@@ -1,7 +1,12 @@
 """! This module is used for shot-based processing of a video"""
 import os
+import json
 import time
+import bisect
+import tempfile
 import subprocess as sp
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 
 ###General functions#########################################################################
@@ -19,12 +24,13 @@ def make_dir(name):
 def call_subprocess(command):
     """! Calls the terminal with the specified command
 
-    @param command  The command to be called in the terminal
+    @param command  The command to be called in the terminal, a string is run 
+                    through the shell and a list is run without it
 
     @return The output from the terminal in text 
     """
     result = sp.run(command,
-                    shell=True,
+                    shell=isinstance(command, str),
                     capture_output=True,
                     text=True)
     return result
@@ -42,6 +48,17 @@ def subprocess_error(result, where):
 
 
 ###Used to find shots###############################################################################
+# Profiles for shot detection. "scale" is the width frames are scaled down to
+# before the scene score is computed and "skip_frame" is passed to the decoder,
+# where "nonref" skips decoding of frames no other frame depends on.
+# benchmarks/detection_profiles.py compares the profiles against "full".
+DETECTION_PROFILES = {
+    "full": {"scale": None, "skip_frame": None},
+    "fast": {"scale": 320, "skip_frame": None},
+    "fastest": {"scale": 320, "skip_frame": "nonref"},
+}
+
+
 def video_duration(video_location) -> str:
     """! The duration of the video
 
@@ -60,6 +77,27 @@ def video_duration(video_location) -> str:
     return result.stdout
 
 
+def video_start_time(video_location):
+    """! The timestamp of the start of the video, not 0 for example for
+        MPEG-TS. ffmpeg subtracts it from the timestamps unless -copyts is given.
+
+    @param video_location   The filepath to the video
+
+    @return The start time in seconds
+    """
+    command = ["ffprobe", "-v", "error",
+               "-show_entries", "format=start_time",
+               "-of", "default=noprint_wrappers=1:nokey=1",
+               video_location]
+    result = call_subprocess(command)
+
+    subprocess_error(result, "Video start time")
+
+    start_time = result.stdout.strip()
+
+    return float(start_time) if start_time not in ("", "N/A") else 0.0
+
+
 def shot_detection(video_location, shot_parameter) -> str:
     """! The timestamps of the shots in the video
 
@@ -89,16 +127,143 @@ def shot_detection(video_location, shot_parameter) -> str:
     return result.stdout
 
 
-def format_shot_detection(video_location, shot_parameter, shot_length=0) -> str:
+def scene_range(video_location, select, start=0.0, end=None, overlap=0.0, profile="full",
+                single_thread=False):
+    """! The timestamps and scene scores of the frames in a time range of the video
+
+    @param video_location       The filepath to the video
+    @param select               The expression given to the select filter, ex gt(scene,0.3)
+    @param start                Frames before start (seconds) are not returned
+    @param end                  Frames from end (seconds) are not returned, None reads to the end
+    @param overlap              Seconds decoded before start so that the first frame
+                                in the range has a previous frame to be compared with
+    @param profile              The name of a profile in DETECTION_PROFILES
+    @param single_thread        Decode with one thread, for ranges that run in
+                                parallel with other ranges
+
+    @return List of (timestamp, scene score) for the frames that passed select
+    """
+    seek = max(0.0, start - overlap)
+    settings = DETECTION_PROFILES[profile]
+
+    filters = f"select=\'{select}\', metadata=print:file=-"
+    if settings["scale"] is not None:
+        filters = f"scale={settings['scale']}:-2, {filters}"
+
+    command = 'ffmpeg -hide_banner -v error -nostats -copyts'
+    if single_thread:
+        command += ' -threads 1'
+    if settings["skip_frame"] is not None:
+        command += f' -skip_frame {settings["skip_frame"]}'
+    if seek > 0:
+        command += f' -ss {seek}'
+    if end is not None:
+        command += f' -to {end}'
+    command += f' -i {video_location} \
+                -an -sn -dn \
+                -vf "{filters}" \
+                -f null -'
+
+    result = call_subprocess(command)
+
+    subprocess_error(result, "Scene range")
+
+    frames = parse_scene_metadata(result.stdout)
+
+    return [(pts, score) for pts, score in frames
+            if pts >= start and (end is None or pts < end)]
+
+
+def parse_scene_metadata(output):
+    """! Parses the output of the metadata=print filter
+
+    @param output   The text written by metadata=print:file=-
+
+    @return List of (timestamp, scene score) for every printed frame
+    """
+    frames = []
+    for line in output.splitlines():
+        if line.startswith("frame:"):
+            pts = float(line.split("pts_time:")[1].split()[0])
+            frames.append([pts, 0.0])
+        elif line.startswith("lavfi.scene_score=") and len(frames) > 0:
+            frames[-1][1] = float(line.split("=")[1])
+
+    return [(pts, score) for pts, score in frames]
+
+
+def parallel_scene(video_location, select, workers=None, overlap=1.0, profile="full"):
+    """! Runs scene_range on overlapping time ranges of the video in parallel.
+        Every range keeps only the frames inside [start, end) so frames in
+        the overlap are neither duplicated nor missed.
+
+    @param video_location       The filepath to the video
+    @param select               The expression given to the select filter, ex gt(scene,0.3)
+    @param workers              Number of ffmpeg processes, defaults to the number of cores
+    @param overlap              Seconds each range decodes before its start
+    @param profile              The name of a profile in DETECTION_PROFILES
+
+    @return List of (timestamp, scene score) for the frames that passed select
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    duration = float(video_duration(video_location))
+    bounds = [duration * count / workers for count in range(workers)]
+    # The last range reads to the end of the file instead of to the duration
+    ranges = list(zip(bounds, bounds[1:] + [None]))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda r: scene_range(video_location, select, r[0], r[1], overlap, profile,
+                                  single_thread=workers > 1), ranges)
+        frames = [frame for result in results for frame in result]
+
+    return sorted(frames)
+
+
+def parallel_shot_detection(video_location, shot_parameter, workers=None, profile="full") -> str:
+    """! Same result as shot_detection but the video is split into time
+        ranges that are detected in parallel, one ffmpeg process per range
+
+    @param video_location       The filepath to the video
+    @param shot_parameter       The amount of change the algortihm considers. 
+                                Value between 0-1 where 1 is the least amount of change. 
+    @param workers              Number of ffmpeg processes, defaults to the number of cores
+    @param profile              The name of a profile in DETECTION_PROFILES
+
+    @return The timestamps of shots
+    """
+    start_time = time.time()
+
+    frames = parallel_scene(
+        video_location, f"gt(scene,{shot_parameter})", workers, profile=profile)
+
+    duration = time.time() - start_time
+
+    print(f"Parallel shot detection done in: {duration} seconds")
+
+    return "".join(f"{pts:.6f}\n" for pts, _ in frames)
+
+
+def format_shot_detection(video_location, shot_parameter, shot_length=0, workers=1, profile="full") -> str:
     """! Formating the result from shot_detection  
     @param video_location       The filepath to the video
     @param shot_parameter       The amount of change the algortihm considers. 
                                 Value between 0-1 where 1 is the least amount of change. 
     @param shot_length          The minimum length of a shot (number)
+    @param workers              Number of processes used for shot detection, 
+                                None uses all cores
+    @param profile              The name of a profile in DETECTION_PROFILES, 
+                                ex "fast" to detect on downscaled frames
 
     @return The formatted version from shot_detection
     """
-    detection = shot_detection(video_location, shot_parameter)
+    if workers == 1 and profile == "full":
+        detection = shot_detection(video_location, shot_parameter)
+    else:
+        detection = parallel_shot_detection(
+            video_location, shot_parameter, workers, profile)
 
     # Need to add start of video
     start = "0.000000"
@@ -108,54 +273,403 @@ def format_shot_detection(video_location, shot_parameter, shot_length=0) -> str:
     detection = f"{start}\n{detection}{duration}"
     detection = detection.split()
 
+    return merge_short_shots(detection, shot_length)
+
+
+def format_shot_detection_batch(video_location, shot_parameter, shot_lengths, workers=1, profile="full"):
+    """! format_shot_detection for several minimum shot lengths from one shot detection
+
+    @param video_location       The filepath to the video
+    @param shot_parameter       The amount of change the algortihm considers. 
+                                Value between 0-1 where 1 is the least amount of change. 
+    @param shot_lengths         The minimum lengths of a shot (numbers)
+    @param workers              Number of processes used for shot detection
+    @param profile              The name of a profile in DETECTION_PROFILES
+
+    @return Dictionary from every shot length to its formatted timestamps
+    """
+    detection = format_shot_detection(
+        video_location, shot_parameter, 0, workers, profile)
+
+    return merge_short_shots_batch(detection, shot_lengths)
+
+
+def stream_scene(video_location, select, profile="full"):
+    """! Runs the scene filter on the video and yields every frame that 
+        passes select as soon as ffmpeg has processed it
+
+    @param video_location       The filepath to the video
+    @param select               The expression given to the select filter, ex gt(scene,0.3)
+    @param profile              The name of a profile in DETECTION_PROFILES
+
+    @return Generator of timestamps of the frames that passed select
+    """
+    settings = DETECTION_PROFILES[profile]
+
+    # direct=1 makes the metadata filter write every frame without buffering
+    filters = f"select=\'{select}\', metadata=print:file=-:direct=1"
+    if settings["scale"] is not None:
+        filters = f"scale={settings['scale']}:-2, {filters}"
+
+    # -copyts keeps the source timestamps like scene_range and keyframe_times
+    command = 'ffmpeg -hide_banner -v error -nostats -copyts'
+    if settings["skip_frame"] is not None:
+        command += f' -skip_frame {settings["skip_frame"]}'
+    command += f' -i {video_location} \
+                -an -sn -dn \
+                -vf "{filters}" \
+                -f null -'
+
+    # The errors go to a file, a pipe that is not read could fill up and block ffmpeg
+    with tempfile.TemporaryFile(mode="w+") as stderr:
+        process = sp.Popen(command, shell=True, stdout=sp.PIPE,
+                           stderr=stderr, text=True, bufsize=1)
+
+        try:
+            for line in process.stdout:
+                if line.startswith("frame:"):
+                    yield float(line.split("pts_time:")[1].split()[0])
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+
+        if returncode != 0:
+            stderr.seek(0)
+            raise Exception(f"Stream scene failed with error code {returncode}", stderr.read())
+
+
+def stream_shot_boundaries(video_location, shot_parameter, shot_length=0, profile="full"):
+    """! Yields the start and end of every shot while shot detection is running.
+        The shots are the same as from format_shot_detection except that a 
+        video shorter than shot_length becomes one shot.
+
+    @param video_location       The filepath to the video
+    @param shot_parameter       The amount of change the algortihm considers. 
+                                Value between 0-1 where 1 is the least amount of change. 
+    @param shot_length          The minimum length of a shot (number)
+    @param profile              The name of a profile in DETECTION_PROFILES
+
+    @return Generator of (start, end) formatted timestamps of the shots
+    """
+    duration = float(video_duration(video_location))
+
+    start = 0.0
+    # A kept cut is not yielded until the next one is known, only the 
+    # last cut can be removed when the last shot is too short
+    end = None
+
+    for cut in stream_scene(video_location, f"gt(scene,{shot_parameter})", profile):
+        if end is None:
+            if cut - start < shot_length:
+                continue
+            end = cut
+        elif cut - end >= shot_length:
+            yield (f"{start:.6f}", f"{end:.6f}")
+            start, end = end, cut
+
+    if end is not None and duration - end >= shot_length:
+        yield (f"{start:.6f}", f"{end:.6f}")
+        start = end
+
+    yield (f"{start:.6f}", f"{duration:.6f}")
+
+
+def stream_keyframe_shots(video_location, shot_parameter, shot_length=0, profile="full"):
+    """! stream_shot_boundaries with every cut moved to the first keyframe at
+        or after it, the same cuts the segment muxer in trim_video makes.
+        Shots that end up on the same keyframe are merged, so the shots can
+        be stream copied with cut_shot without overlapping.
+
+    @param video_location       The filepath to the video
+    @param shot_parameter       The amount of change the algortihm considers. 
+                                Value between 0-1 where 1 is the least amount of change. 
+    @param shot_length          The minimum length of a shot (number)
+    @param profile              The name of a profile in DETECTION_PROFILES
+
+    @return Generator of (start, end) keyframe timestamps of the shots,
+            end is None for the last shot
+    """
+    keyframes = keyframe_times(video_location)
+
+    start = keyframes[0] if len(keyframes) > 0 else 0.0
+    for _, end in stream_shot_boundaries(video_location, shot_parameter, shot_length, profile):
+        end = next_keyframe(keyframes, float(end))
+        if end is None:
+            break
+        if end > start:
+            yield (start, end)
+            start = end
+
+    yield (start, None)
+
+
+def merge_indices(timestamps, shot_length):
+    """! The indices of the timestamps that are kept when no shot may be
+        shorter than shot_length. Gives the same result as removing the 
+        timestamps one by one from the start of the video but jumps directly 
+        to the next kept timestamp with a binary search.
+
+    @param timestamps   Sorted NumPy array with the timestamps, including start and end
+    @param shot_length  The minimum length of a shot (number)
+
+    @return List with the indices of the kept timestamps
+    """
+    last = len(timestamps) - 1
+
+    if last < 1:
+        return list(range(len(timestamps)))
+
+    # The end of the video is handled on its own since it can't be removed
+    cuts = timestamps[:last]
+    indices = [0]
+    current = 0
+
+    while True:
+        start = timestamps[current]
+        following = int(np.searchsorted(cuts, start + shot_length, side="left"))
+
+        # start + shot_length is rounded, the shot length is compared by
+        # subtraction so the result is exactly the same as before
+        while following < last and cuts[following] - start < shot_length:
+            following += 1
+        while following - 1 > current and cuts[following - 1] - start >= shot_length:
+            following -= 1
+
+        if following <= current:
+            following = current + 1
+        if following >= last:
+            break
+
+        indices.append(following)
+        current = following
+
+    # The last shot is too short, remove the cut before it instead of the end
+    if timestamps[last] - timestamps[current] < shot_length:
+        indices.pop()
+
+    indices.append(last)
+
+    return indices
+
+
+def merge_short_shots(detection, shot_length=0):
+    """! Removes timestamps so that no shot is shorter than shot_length
+
+    @param detection    The formatted timestamps of the shots, including start and end
+    @param shot_length  The minimum length of a shot (number)
+
+    @return The timestamps that are left after merging short shots
+    """
     if shot_length == 0:
         return detection
 
-    count = 0
-    while count < len(detection)-1:
-        diff = float(detection[count+1]) - float(detection[count])
-        if diff < shot_length:
-            if count == len(detection)-2:
-                # can't delete last timestamp
-                del detection[count]
-            else:
-                del detection[count+1]
+    timestamps = np.asarray(detection, dtype=np.float64)
+
+    return [detection[index] for index in merge_indices(timestamps, shot_length)]
+
+
+def merge_short_shots_batch(detection, shot_lengths):
+    """! merge_short_shots for several minimum shot lengths at once
+
+    @param detection        The formatted timestamps of the shots, including start and end
+    @param shot_lengths     The minimum lengths of a shot (numbers)
+
+    @return Dictionary from every shot length to its timestamps
+    """
+    timestamps = np.asarray(detection, dtype=np.float64)
+    result = {}
+
+    for shot_length in shot_lengths:
+        if shot_length == 0:
+            result[shot_length] = list(detection)
         else:
-            count += 1
+            result[shot_length] = [detection[index]
+                                   for index in merge_indices(timestamps, shot_length)]
 
-    return detection
+    return result
 
 
-def trim_video(video_location, detection, output_location, video_location_name, container):
-    """! The function called for trimming the video
-    @param video_location           The filepath to the video
-    @param detection                The formatted version of timestamps of the shots 
-    @param output_location          The absolute path to the output directory
-    @param video_location_name      The name of the video_location file
-    @param container                The container format of the video      
+def coalesce_shots(detection, chunk_duration=0):
+    """! Merges neighbouring shots into chunks close to chunk_duration. Chunks
+        only start and end on cuts, so no shot is split and every chunk is
+        encoded as one Encore job.
 
-    @return The absolute path to the output videos
+    @param detection        The formatted timestamps of the shots, including start and end
+    @param chunk_duration   The target duration of a chunk in seconds, 0 keeps every shot
+
+    @return The timestamps of the chunks, a subset of detection
     """
+    if chunk_duration <= 0 or len(detection) <= 2:
+        return list(detection)
+
+    chunks = [detection[0]]
+    start = float(detection[0])
+
+    for count in range(1, len(detection) - 1):
+        cut = float(detection[count])
+        next_cut = float(detection[count + 1])
+
+        # End the chunk here if the next shot takes it further from the target
+        if abs(next_cut - start - chunk_duration) > abs(cut - start - chunk_duration):
+            chunks.append(detection[count])
+            start = cut
 
-    video_paths = []
+    # A last chunk shorter than half the target is merged into the one before
+    if len(chunks) > 1 and float(detection[-1]) - start < chunk_duration / 2:
+        chunks.pop()
 
-    command = 'ffmpeg -y -hide_banner -stats -v panic'
+    chunks.append(detection[-1])
 
-    for count in range(0, len(detection)-1):
-        output_name = f'{video_location_name}-{count}.{container}'
-        output_path = f'{output_location}{output_name}'
+    return chunks
 
-        command += f' -i {video_location}'
-        command += f' -ss {detection[count]}'
-        command += f' -to {detection[count+1]}'
-        command += f' -c copy {output_path}'
 
-        video_paths.append(output_path)
+def coalesce_report(detection, chunks, job_overhead):
+    """! How much coalesce_shots saves
+
+    @param detection        The timestamps of the shots
+    @param chunks           The timestamps of the chunks from coalesce_shots
+    @param job_overhead     Seconds every Encore job costs besides encoding,
+                            setup, polling and concat
+
+    @return Dictionary with the number of jobs, jobs saved and overhead saved in seconds
+    """
+    shots = len(detection) - 1
+    jobs = len(chunks) - 1
+    duration = float(detection[-1]) - float(detection[0])
+
+    return {
+        "shots": shots,
+        "jobs": jobs,
+        "jobs_saved": shots - jobs,
+        "overhead_saved": (shots - jobs) * job_overhead,
+        "mean_shot": duration / shots if shots > 0 else 0.0,
+        "mean_chunk": duration / jobs if jobs > 0 else 0.0,
+    }
+
+
+def keyframe_times(video_location):
+    """! The timestamps of the keyframes of the video. Only the packets are
+        read, nothing is decoded.
+
+    @param video_location   The filepath to the video
+
+    @return Sorted list of the keyframe timestamps in seconds
+    """
+    command = ["ffprobe", "-v", "error",
+               "-select_streams", "v:0",
+               "-show_entries", "packet=pts_time,flags",
+               "-of", "csv=print_section=0",
+               video_location]
+
+    result = call_subprocess(command)
+    subprocess_error(result, "Keyframe times")
+
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" in flags and pts != "N/A":
+            keyframes.append(float(pts))
+
+    return sorted(keyframes)
+
+
+# Timestamps closer to a keyframe than this are on it, they are printed
+# with six decimals and may be rounded differently
+KEYFRAME_MARGIN = 0.0005
+
+
+def next_keyframe(keyframes, timestamp):
+    """! The first keyframe at or after timestamp
+
+    @param keyframes    Sorted list of keyframe timestamps from keyframe_times
+    @param timestamp    The timestamp in seconds
+
+    @return The timestamp of the keyframe or None if there is no keyframe after it
+    """
+    index = bisect.bisect_left(keyframes, timestamp - KEYFRAME_MARGIN)
+    if index == len(keyframes):
+        return None
+
+    return keyframes[index]
+
+
+def snap_to_keyframes(detection, keyframes):
+    """! Moves every cut of the detection to the first keyframe at or after
+        it, where a stream copy cuts. Cuts that end up on the same keyframe,
+        or after the last keyframe, are removed.
+
+    @param detection    The formatted timestamps of the shots, including start and end
+    @param keyframes    Sorted list of keyframe timestamps from keyframe_times
+
+    @return The formatted timestamps of the shots a stream copy gives
+    """
+    snapped = [detection[0]]
+    previous = float(detection[0])
+
+    for timestamp in detection[1:-1]:
+        keyframe = next_keyframe(keyframes, float(timestamp))
+        if keyframe is None:
+            break
+        if keyframe > previous + KEYFRAME_MARGIN:
+            snapped.append(f"{keyframe:.6f}")
+            previous = keyframe
+
+    snapped.append(detection[-1])
+
+    return snapped
+
+
+def trim_video(video_location, detection, output_location, video_location_name, container,
+               keyframes=None):
+    """! The function called for trimming the video. The video is read once 
+        and every shot is written by the segment muxer in the same pass.
+    @param video_location           The filepath to the video
+    @param detection                The formatted version of timestamps of the shots,
+                                    snap_to_keyframes is applied so shot N is
+                                    entry N of the detection snapped to keyframes
+    @param output_location          The absolute path to the output directory
+    @param video_location_name      The name of the video_location file
+    @param container                The container format of the video      
+    @param keyframes                The keyframes of the video, read with keyframe_times if None
+
+    @return The absolute path to the output videos
+    """
+    if keyframes is None:
+        keyframes = keyframe_times(video_location)
+    detection = snap_to_keyframes(detection, keyframes)
+
+    video_paths = [f'{output_location}{video_location_name}-{count}.{container}'
+                   for count in range(0, len(detection)-1)]
+
+    # The first and last timestamps are the start and end of the video,
+    # the segment muxer only needs the cuts in between. The cuts are moved a
+    # bit before their keyframe so rounding never moves one to the next keyframe.
+    # Trailing zeros are removed to keep the argument short for long videos.
+    segment_times = ",".join(
+        f"{float(timestamp) - KEYFRAME_MARGIN:.6f}".rstrip("0").rstrip(".")
+        for timestamp in detection[1:-1])
+
+    # Passed as a list so the command does not go through the shell, which
+    # limits the length of the whole command line.
+    command = ['ffmpeg', '-y', '-hide_banner', '-stats', '-v', 'panic',
+               '-i', video_location,
+               '-c', 'copy',
+               '-f', 'segment',
+               '-reset_timestamps', '1']
+    if segment_times != "":
+        command += ['-segment_times', segment_times]
+    command += [f'{output_location}{video_location_name}-%d.{container}']
 
     result = call_subprocess(command)
 
     subprocess_error(result, "Trim video")
 
+    # Every cut is on a keyframe, so every shot of the detection has its file
+    missing = [path for path in video_paths if not os.path.isfile(path)]
+    if len(missing) > 0:
+        raise Exception(f"Trim video did not write {len(missing)} of {len(video_paths)} shots",
+                        missing)
+
     # Used for debugging purpose
     errcheck = f'ffmpeg \
                 -y \
@@ -170,7 +684,60 @@ def trim_video(video_location, detection, output_location, video_location_name,
     return video_paths
 
 
-def video_shot_split(video_location, output_location, shot_parameter, shot_length=0):
+def cut_shot(video_location, start, end, output_path):
+    """! Copies one shot of the video to its own file. A stream copy can only
+        start at a keyframe, start and end must therefore be keyframes, for
+        example from stream_keyframe_shots, or the shots overlap.
+
+    @param video_location   The filepath to the video
+    @param start            The keyframe the shot starts at
+    @param end              The keyframe the next shot starts at, None for the end of the video
+    @param output_path      The filepath of the shot
+
+    @return The filepath of the shot
+    """
+    # Seeking goes to the last keyframe before the seek point, which is
+    # start, and the keyframe at end belongs to the next shot
+    command = ["ffmpeg", "-y", "-hide_banner", "-v", "error",
+               "-ss", f"{start + KEYFRAME_MARGIN:.6f}"]
+    if end is not None:
+        command += ["-to", f"{end - KEYFRAME_MARGIN:.6f}"]
+    command += ["-i", video_location, "-c", "copy", output_path]
+
+    result = call_subprocess(command)
+
+    subprocess_error(result, "Cut shot")
+
+    return output_path
+
+
+def encode_range(video_location, start, end, output_path):
+    """! Encodes a range of the video to its own file. Unlike a stream copy
+        the range starts and ends exactly at start and end, whatever the
+        keyframes are. The encoding is lossless so it only feeds Encore.
+
+    @param video_location   The filepath to the video
+    @param start            The start of the range in seconds
+    @param end              The end of the range in seconds, None for the end of the video
+    @param output_path      The filepath of the encoded range
+
+    @return The filepath of the encoded range
+    """
+    command = ["ffmpeg", "-y", "-hide_banner", "-v", "error", "-ss", f"{start}"]
+    if end is not None:
+        command += ["-to", f"{end}"]
+    command += ["-i", video_location, "-an", "-c:v", "libx264", "-preset", "veryfast",
+                "-qp", "0", output_path]
+
+    result = call_subprocess(command)
+
+    subprocess_error(result, "Encode range")
+
+    return output_path
+
+
+def video_shot_split(video_location, output_location, shot_parameter, shot_length=0, detection=None, workers=1,
+                     profile="full", keyframes=None):
     """! Splits video based on shots where 
         shot_parameter determines how much change must 
         be in between frames for a shot change to occur
@@ -180,12 +747,19 @@ def video_shot_split(video_location, output_location, shot_parameter, shot_lengt
     @param shot_parameter    The amount of change the algortihm considers. 
                              Value between 0-1 where 1 is the least amount of change. 
     @param shot_length       The minimum length of a shot
+    @param detection         Already formatted timestamps of the shots, for example 
+                             from a SceneIndex. If None, shot detection is run on the video.
+    @param workers           Number of processes used for shot detection, None uses all cores
+    @param profile           The name of a profile in DETECTION_PROFILES
+    @param keyframes         The keyframes of the video, read with keyframe_times if None.
+                             The shots are the detection after snap_to_keyframes.
 
     @return The absolute path to the output videos
     """
 
-    detection = format_shot_detection(
-        video_location, shot_parameter, shot_length)
+    if detection is None:
+        detection = format_shot_detection(
+            video_location, shot_parameter, shot_length, workers, profile)
 
     output_location = f"{output_location}shots/"
 
@@ -199,7 +773,7 @@ def video_shot_split(video_location, output_location, shot_parameter, shot_lengt
     container = format[1]
 
     video_paths = trim_video(video_location, detection,
-                             output_location, video_location_name, container)
+                             output_location, video_location_name, container, keyframes)
 
     return video_paths
 
@@ -241,9 +815,280 @@ def stitch_video(video_paths, concat_file, output_name):
 
     subprocess_error(result, "Stitch video")
 
+
+def stitch_mux_video(video_paths, concat_file, audio_location, output_name):
+    """! Stitches videos together and muxes them with an audio file in one pass,
+        the stitched video is only written once
+
+    @param video_paths      The absolute paths to all the splitted videos 
+    @param concat_file      The type of file to be used to concat videos 
+    @param audio_location   The filepath to the audio
+    @param output_name      The output name of the muxed video
+    """
+
+    create_concat_file(video_paths, concat_file)
+
+    command = ['ffmpeg', '-y', '-hide_banner',
+               '-f', 'concat', '-safe', '0', '-i', concat_file,
+               '-i', audio_location,
+               '-map', '0:v', '-map', '1:a',
+               '-c', 'copy', output_name]
+
+    result = call_subprocess(command)
+
+    subprocess_error(result, "Stitch and mux video")
+
+
+def hls_segment_times(durations, segment_duration):
+    """! The times the segments of a rendition are cut at. Every shot starts a
+        segment, shots longer than segment_duration are also cut every
+        segment_duration seconds.
+
+    @param durations            The duration of every shot in seconds
+    @param segment_duration     Longest segment within a shot, in seconds
+
+    @return List of the cut times in seconds, without the start of the video
+    """
+    times = []
+    start = 0.0
+    for duration in durations:
+        if start > 0:
+            times.append(start)
+
+        # No segment shorter than half the target at the end of a shot
+        count = 1
+        while count * segment_duration <= duration - segment_duration / 2:
+            times.append(start + count * segment_duration)
+            count += 1
+
+        start += duration
+
+    return times
+
+
+def package_hls(video_paths, concat_file, audio_location, output_location, segment_duration=2):
+    """! Packages the shots of one rendition with an audio file as fragmented
+        MP4 HLS. The segment muxer cuts at the start of every shot, so every
+        shot starts a segment and the segments of all renditions line up. The
+        hls muxer can only cut every hls_time seconds, not at given times.
+
+    @param video_paths          List with the absolute paths to the shots of the rendition
+    @param concat_file          The concat file of the rendition
+    @param audio_location       The filepath to the audio
+    @param output_location      The directory of the playlist and segments
+    @param segment_duration     Longest segment within a shot in seconds, the
+                                cuts inside a shot move to its next keyframe
+
+    @return Dictionary with the BANDWIDTH, CODECS and RESOLUTION of the
+            rendition for the master playlist
+    """
+    create_concat_file(video_paths, concat_file)
+
+    # The concat demuxer starts every shot at the total duration of the shots
+    # before it. Every shot starts with a keyframe, the cut times are moved a
+    # bit before it so rounding never moves a cut to the next keyframe.
+    durations = [float(video_duration(path)) for path in video_paths]
+    segment_times = ",".join(f"{max(0.0, time - KEYFRAME_MARGIN):.6f}"
+                             for time in hls_segment_times(durations, segment_duration))
+
+    # The header is written once to init.mp4 and every segment only holds
+    # fragments, the layout HLS expects from fragmented MP4
+    segment_list = f"{output_location}segments.csv"
+    command = ['ffmpeg', '-y', '-hide_banner', '-v', 'error',
+               '-f', 'concat', '-safe', '0', '-i', concat_file,
+               '-i', audio_location,
+               '-map', '0:v', '-map', '1:a',
+               '-c', 'copy',
+               '-f', 'segment',
+               '-segment_format', 'mp4',
+               '-segment_format_options',
+               'movflags=+frag_keyframe+empty_moov+default_base_moof+skip_trailer',
+               '-individual_header_trailer', '0',
+               '-header_filename', f'{output_location}init.mp4',
+               '-segment_list', segment_list,
+               '-segment_list_type', 'csv']
+    if segment_times != "":
+        command += ['-segment_times', segment_times]
+    command += [f'{output_location}segment_%05d.m4s']
+
+    result = call_subprocess(command)
+
+    subprocess_error(result, "Package HLS")
+
+    # Every line of the segment list is: file name,start,end
+    segments = []
+    with open(segment_list) as f:
+        for line in f:
+            if line.strip() != "":
+                name, start, end = line.strip().rsplit(",", 2)
+                segments.append((name.strip('"'), float(end) - float(start)))
+
+    target_duration = max((int(np.ceil(duration)) for _, duration in segments), default=0)
+
+    with open(f"{output_location}index.m3u8", "w") as f:
+        f.write("#EXTM3U\n")
+        f.write("#EXT-X-VERSION:7\n")
+        f.write(f"#EXT-X-TARGETDURATION:{target_duration}\n")
+        f.write("#EXT-X-PLAYLIST-TYPE:VOD\n")
+        f.write("#EXT-X-INDEPENDENT-SEGMENTS\n")
+        f.write('#EXT-X-MAP:URI="init.mp4"\n')
+        for name, duration in segments:
+            f.write(f"#EXTINF:{duration:.6f},\n{name}\n")
+        f.write("#EXT-X-ENDLIST\n")
+
+    bandwidth = max((os.path.getsize(f"{output_location}{name}") * 8 / duration
+                     for name, duration in segments if duration > 0), default=0)
+
+    attributes = {"BANDWIDTH": int(np.ceil(bandwidth))}
+    attributes.update(rendition_codecs(f"{output_location}init.mp4"))
+
+    return attributes
+
+
+# RFC 6381 names of the AAC profiles ffprobe reports
+AAC_CODECS = {"LC": "mp4a.40.2", "HE-AAC": "mp4a.40.5", "HE-AACv2": "mp4a.40.29"}
+
+
+def codec_string(stream, init_data=b""):
+    """! The RFC 6381 name of a stream, as HLS expects it in CODECS
+
+    @param stream       A stream from ffprobe -show_streams
+    @param init_data    The bytes of the init segment, the profile and level of
+                        H.264 are read from its avcC box
+
+    @return The name, ex avc1.640028, or None for codecs that are not known
+    """
+    name = stream.get("codec_name")
+
+    if name == "h264":
+        # The avcC box starts with its version, profile, constraints and level
+        box = init_data.find(b"avcC")
+        if box < 0 or len(init_data) < box + 8:
+            return None
+        return f"avc1.{init_data[box + 5:box + 8].hex()}"
+    if name == "hevc":
+        if stream.get("profile") == "Main 10":
+            return f"hvc1.2.4.L{stream.get('level')}.B0"
+        return f"hvc1.1.6.L{stream.get('level')}.B0"
+    if name == "aac":
+        return AAC_CODECS.get(stream.get("profile"), "mp4a.40.2")
+    if name == "ac3":
+        return "ac-3"
+    if name == "eac3":
+        return "ec-3"
+
+    return None
+
+
+def rendition_codecs(init_location):
+    """! The CODECS and RESOLUTION attributes of a rendition, read from its
+        init segment
+
+    @param init_location    The filepath to init.mp4 of the rendition
+
+    @return Dictionary with CODECS and RESOLUTION, an attribute that can not
+            be found is left out
+    """
+    command = ['ffprobe', '-v', 'error', '-show_streams', '-of', 'json', init_location]
+    result = call_subprocess(command)
+
+    subprocess_error(result, "Rendition codecs")
+
+    streams = json.loads(result.stdout).get("streams", [])
+    with open(init_location, "rb") as f:
+        init_data = f.read()
+
+    attributes = {}
+    codecs = [codec_string(stream, init_data) for stream in streams]
+    if len(codecs) > 0 and None not in codecs:
+        attributes["CODECS"] = ",".join(codecs)
+
+    for stream in streams:
+        if stream.get("codec_type") == "video" and stream.get("width"):
+            attributes["RESOLUTION"] = f"{stream['width']}x{stream['height']}"
+            break
+
+    return attributes
+
+
+def write_master_playlist(variants, output_location):
+    """! Writes the master playlist of an HLS ladder
+
+    @param variants         List of (playlist path relative to output_location,
+                            attributes from package_hls) of every rendition
+    @param output_location  The directory of the master playlist
+
+    @return The filepath of the master playlist
+    """
+    master = f"{output_location}master.m3u8"
+
+    with open(master, "w") as f:
+        f.write("#EXTM3U\n")
+        f.write("#EXT-X-VERSION:7\n")
+        f.write("#EXT-X-INDEPENDENT-SEGMENTS\n")
+        for playlist, attributes in variants:
+            stream_inf = f"BANDWIDTH={attributes['BANDWIDTH']}"
+            if "CODECS" in attributes:
+                stream_inf += f",CODECS=\"{attributes['CODECS']}\""
+            if "RESOLUTION" in attributes:
+                stream_inf += f",RESOLUTION={attributes['RESOLUTION']}"
+            f.write(f"#EXT-X-STREAM-INF:{stream_inf}\n{playlist}\n")
+
+    return master
+
 #####################################################################################################
 
 
+def demux(video_location, audio_location, video_output_location, scene_scores=False):
+    """! Writes the audio-only and video-only copies of the video from one 
+        read of the source, replaces copy_audio followed by copy_video
+
+    @param video_location           The filepath to the video
+    @param audio_location           The output path of the audio, None to only write the video
+    @param video_output_location    The output path of the video without audio
+    @param scene_scores             If True the video is also decoded in the same 
+                                    read and the scene score of every frame is returned
+
+    @return List of (timestamp, scene score) if scene_scores is True, otherwise None.
+            The timestamps are source timestamps like in sceneindex.scene_scores.
+    """
+    command = f"ffmpeg \
+                -y -hide_banner -v error -nostats \
+                -i {video_location}"
+
+    if audio_location is not None:
+        command += f" \
+                -map 0:a \
+                -c copy {audio_location}"
+
+    command += f" \
+                -c:v copy -an {video_output_location}"
+
+    if scene_scores:
+        command += f" \
+                -map 0:v:0 -an -sn -dn \
+                -vf \"select='gte(scene,0)', metadata=print:file=-\" \
+                -f null -"
+
+    start_time = time.time()
+
+    result = call_subprocess(command)
+
+    duration = time.time() - start_time
+
+    subprocess_error(result, "Demux")
+
+    print(f"Demux done in: {duration} seconds")
+
+    if scene_scores:
+        # -copyts would also keep the source timestamps in the copied outputs,
+        # instead the start time ffmpeg subtracted is added back
+        start = video_start_time(video_location)
+        return [(pts + start, score) for pts, score in parse_scene_metadata(result.stdout)]
+
+    return None
+
+
 def copy_audio(video_location, output_location):
     command = f"ffmpeg \
                 -y -hide_banner \
@@ -296,16 +1141,198 @@ def bitrate_video(video_input):
     return result
 
 
-def vmaf_score(encoded_video, original_video, json_path):
-    command = f"ffmpeg \
-                -hide_banner \
-                -i {encoded_video} \
-                -i {original_video} \
-                -lavfi libvmaf=model_path='{json_path}':n_threads=4 \
-                -f null -"
+def vmaf_score(encoded_video, original_video, json_path, log_path=None):
+    """! The VMAF score of an encoded video, read from the json log of libvmaf
+
+    @param encoded_video    The filepath of the encoded video
+    @param original_video   The filepath of the reference video
+    @param json_path        The filepath of the VMAF model
+    @param log_path         The filepath of the json log, by default a temporary
+                            file that is removed when the score is read
+
+    @return The VMAF score
+    """
+    if log_path is None:
+        with tempfile.TemporaryDirectory() as log_location:
+            return vmaf_score(encoded_video, original_video, json_path,
+                              os.path.join(log_location, "vmaf.json"))
+
+    command = ['ffmpeg', '-hide_banner', '-nostats',
+               '-i', encoded_video,
+               '-i', original_video,
+               '-lavfi', f"libvmaf=model_path='{json_path}':n_threads=4"
+                         f":log_fmt=json:log_path='{log_path}'",
+               '-f', 'null', '-']
 
     result = call_subprocess(command)
     subprocess_error(result, "vmaf yolo")
-    result = result.stderr.split(":")
-    result = float(result[len(result)-1].strip())
-    return result
+
+    return vmaf_log_score(log_path)
+
+
+def vmaf_log_score(log_location):
+    """! The pooled VMAF score in a libvmaf json log
+
+    @param log_location     The filepath of the log
+
+    @return The mean VMAF score of all frames, the same score libvmaf prints
+    """
+    with open(log_location) as f:
+        log = json.load(f)
+
+    # libvmaf 2 logs the pooled metrics, older versions only the score
+    if "pooled_metrics" in log:
+        return float(log["pooled_metrics"]["vmaf"]["mean"])
+
+    return float(log["VMAF score"])
+
+
+def vmaf_log_frames(log_location):
+    """! The VMAF score of every frame in a libvmaf json log
+
+    @param log_location     The filepath of the log
+
+    @return List with the score of every scored frame
+    """
+    with open(log_location) as f:
+        log = json.load(f)
+
+    return [float(frame["metrics"]["vmaf"]) for frame in log["frames"]]
+
+
+def vmaf_score_range(encoded_video, original_video, json_path, log_path, start=0.0, end=None,
+                     n_threads=1, n_subsample=1):
+    """! The VMAF score of a time range of an encoded video
+
+    @param encoded_video    The filepath of the encoded video
+    @param original_video   The filepath of the reference video
+    @param json_path        The filepath of the VMAF model
+    @param log_path         The filepath the json log is written to
+    @param start            The start of the range in seconds
+    @param end              The end of the range in seconds, None scores to the end
+    @param n_threads        Number of threads of the libvmaf filter
+    @param n_subsample      Only every n:th frame is scored
+
+    @return The per frame scores of the range
+    """
+    # Both inputs are seeked the same way so their frames stay aligned
+    seek = []
+    if start > 0:
+        seek += ['-ss', str(start)]
+    if end is not None:
+        seek += ['-to', str(end)]
+
+    command = ['ffmpeg', '-hide_banner', '-nostats']
+    command += seek + ['-i', encoded_video]
+    command += seek + ['-i', original_video]
+    command += ['-lavfi', f"libvmaf=model_path='{json_path}':n_threads={n_threads}"
+                          f":n_subsample={n_subsample}:log_fmt=json:log_path='{log_path}'",
+                '-f', 'null', '-']
+
+    result = call_subprocess(command)
+    subprocess_error(result, "VMAF range")
+
+    return vmaf_log_frames(log_path)
+
+
+def vmaf_score_shots(encoded_video, original_video, json_path, log_location, detection=None,
+                     chunk_duration=10, workers=None, n_subsample=1):
+    """! The VMAF score of an encoded video computed shot by shot in parallel.
+        Every shot is scored by its own ffmpeg process with one libvmaf thread.
+
+    @param encoded_video    The filepath of the encoded video
+    @param original_video   The filepath of the reference video
+    @param json_path        The filepath of the VMAF model
+    @param log_location     The directory the json log of every shot is written to
+    @param detection        The formatted timestamps of the shots, including start and end.
+                            If None the video is scored in chunks of chunk_duration seconds.
+    @param chunk_duration   The length of the chunks if detection is None
+    @param workers          Number of ffmpeg processes, defaults to the number of cores
+    @param n_subsample      Only every n:th frame is scored
+
+    @return Dictionary with the frame weighted score of the whole video, the number
+            of scored frames and the start, end, score and frames of every shot
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if not make_dir(log_location):
+        return False
+
+    if detection is None:
+        duration = float(video_duration(original_video))
+        detection = [f"{float(start):.6f}" for start in np.arange(0, duration, chunk_duration)]
+        detection.append(f"{duration:.6f}")
+
+    # The last range is scored to the end of the file instead of to the duration
+    ranges = [(float(start), float(end)) for start, end in zip(detection[:-1], detection[1:])]
+    ranges[-1] = (ranges[-1][0], None)
+
+    def score(count):
+        start, end = ranges[count]
+        return vmaf_score_range(encoded_video, original_video, json_path,
+                                f"{log_location}vmaf_shot_{count}.json", start, end,
+                                n_subsample=n_subsample)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        shot_frames = list(executor.map(score, range(len(ranges))))
+
+    shots = []
+    total = 0.0
+    frames = 0
+    for count, scores in enumerate(shot_frames):
+        shots.append({
+            "start": float(detection[count]),
+            "end": float(detection[count + 1]),
+            "score": sum(scores) / len(scores) if len(scores) > 0 else 0.0,
+            "frames": len(scores),
+        })
+        total += sum(scores)
+        frames += len(scores)
+
+    return {
+        # Weighted by the number of frames, the same as the mean of all frames
+        "score": total / frames if frames > 0 else 0.0,
+        "frames": frames,
+        "shots": shots,
+    }
+
+
+def vmaf_score_batch(encoded_videos, original_video, json_path, log_location, n_threads=4):
+    """! The VMAF score of several encodes of the same video. The original is 
+        decoded once and split to one libvmaf filter per encode in the same filter graph.
+
+    @param encoded_videos   The filepaths of the encoded videos
+    @param original_video   The filepath of the reference video
+    @param json_path        The filepath of the VMAF model
+    @param log_location     The directory the json log of every encode is written to
+    @param n_threads        Number of threads of every libvmaf filter
+
+    @return The VMAF score of every encoded video in the same order
+    """
+    if len(encoded_videos) == 0:
+        return []
+
+    if not make_dir(log_location):
+        return False
+
+    reference_input = len(encoded_videos)
+    log_paths = [f"{log_location}vmaf_{count}.json" for count in range(len(encoded_videos))]
+
+    references = "".join(f"[ref{count}]" for count in range(len(encoded_videos)))
+    filters = [f"[{reference_input}:v]split={len(encoded_videos)}{references}"]
+    for count, log_path in enumerate(log_paths):
+        filters.append(f"[{count}:v][ref{count}]libvmaf=model_path='{json_path}'"
+                       f":n_threads={n_threads}:log_fmt=json:log_path='{log_path}'")
+
+    command = ['ffmpeg', '-hide_banner']
+    for video in encoded_videos:
+        command += ['-i', video]
+    command += ['-i', original_video,
+                '-filter_complex', ";".join(filters),
+                '-f', 'null', '-']
+
+    result = call_subprocess(command)
+    subprocess_error(result, "VMAF batch")
+
+    return [vmaf_log_score(log_path) for log_path in log_paths]
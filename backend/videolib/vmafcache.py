@@ -0,0 +1,152 @@
+"""! This module caches VMAF scores by the content of the compared videos
+
+A VMAF score only depends on the reference, the distorted video, the model
+and the subsampling. The key of a score is made from fingerprints of the
+files, so a score is found again even if the files are moved or copied.
+Where the scores are stored is up to the caller, the API keeps them in the
+database and main.py in a json file.
+
+Requests for a score that is already being computed in this process wait for
+that computation instead of starting another one.
+"""
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import Future
+
+# Bytes read from the start, middle and end of a file for its fingerprint
+SAMPLE_SIZE = 1 << 20
+
+
+def file_fingerprint(location):
+    """! A fingerprint of the content of a file from its size and three
+        samples of it, much faster than hashing a whole video
+
+    @param location     The filepath of the file
+
+    @return The fingerprint as a hex string
+    """
+    size = os.path.getsize(location)
+    sha = hashlib.sha256(str(size).encode("utf-8"))
+
+    with open(location, "rb") as f:
+        for offset in (0, max(0, size // 2 - SAMPLE_SIZE // 2), max(0, size - SAMPLE_SIZE)):
+            f.seek(offset)
+            sha.update(f.read(SAMPLE_SIZE))
+
+    return sha.hexdigest()
+
+
+def vmaf_cache_key(reference, distorted, model_path, n_subsample=1, method="full"):
+    """! The key of a VMAF score
+
+    @param reference    The filepath of the reference video
+    @param distorted    The filepath of the distorted video
+    @param model_path   The filepath of the VMAF model
+    @param n_subsample  Only every n:th frame is scored
+    @param method       How the score was computed, "full" or "shots", the
+                        score of a whole video and of its shots differ slightly
+
+    @return The key as a hex string
+    """
+    description = json.dumps([file_fingerprint(reference), file_fingerprint(distorted),
+                              file_fingerprint(model_path), n_subsample, method])
+
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+class VMAFCache:
+
+    def __init__(self, load, store):
+        """
+        load    Function from a key to its score, or None if it is not stored
+        store   Function that stores a key and its score
+        """
+        self.load = load
+        self.store = store
+
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+
+    def score(self, key, compute):
+        """! The score of a key from the cache, or from compute() if it is not
+            cached. Only one compute() per key runs at the same time.
+
+        @param key      The key from vmaf_cache_key
+        @param compute  Function without arguments that returns the score, or
+                        None if it could not be computed
+
+        @return The score, or None if it could not be computed
+        """
+        score = self.load(key)
+        if score is not None:
+            with self.lock:
+                self.hits += 1
+            return score
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[key] = future
+                self.misses += 1
+            else:
+                self.collapsed += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            # Another computation may have been stored since the first lookup
+            score = self.load(key)
+            if score is None:
+                score = compute()
+            if score is not None:
+                self.store(key, score)
+            future.set_result(score)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+        return score
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "collapsed": self.collapsed,
+                "in_flight": len(self.in_flight),
+            }
+
+
+def json_vmaf_cache(location):
+    """! A VMAFCache that stores the scores in a json file
+
+    @param location     The filepath of the json file, created if it does not exist
+
+    @return The VMAFCache
+    """
+    scores = {}
+    if os.path.isfile(location):
+        with open(location) as f:
+            scores = json.load(f)
+
+    lock = threading.Lock()
+
+    def store(key, score):
+        with lock:
+            scores[key] = score
+            with open(location, "w") as f:
+                json.dump(scores, f, indent=4)
+
+    return VMAFCache(scores.get, store)
@@ -0,0 +1,175 @@
+"""! This module keeps the VMAF score of every frame in a compact binary file
+
+libvmaf writes a json log with every metric of every frame, which is large
+and slow to read. The score of every frame is kept as float32 together with
+the index of the first frame of every shot, so the statistics of a job and
+of its shots are computed from a few bytes per frame.
+"""
+import sys
+import json
+import bisect
+import struct
+from array import array
+
+import numpy as np
+
+# Magic, frame count, shot count
+HEADER = struct.Struct("<8sII")
+MAGIC = b"VMAFLG01"
+EXTENSION = ".vmaf"
+
+
+def log_frames(log_location):
+    """! The VMAF score of every frame in a libvmaf json log
+
+    @param log_location     The filepath of the log
+
+    @return Array with the score of every scored frame (float32)
+    """
+    with open(log_location) as f:
+        log = json.load(f)
+
+    return array("f", [float(frame["metrics"]["vmaf"]) for frame in log["frames"]])
+
+
+class VMAFFrames:
+
+    def __init__(self, scores, offsets):
+        """
+        scores      Array with the VMAF score of every frame (float32)
+        offsets     Array with the index of the first frame of every shot (uint32)
+        """
+        self.scores = scores
+        self.offsets = offsets
+
+    @staticmethod
+    def from_log(log_location, detection=None, frame_rate=None):
+        """! Reads the json log of a whole video
+
+        @param log_location     The filepath of the log
+        @param detection        The formatted timestamps of the shots, including start
+                                and end. If None the video is one shot.
+        @param frame_rate       The frame rate of the video, needed with detection
+
+        @return The VMAFFrames of the log
+        """
+        with open(log_location) as f:
+            log = json.load(f)
+
+        scores = array("f", [float(frame["metrics"]["vmaf"]) for frame in log["frames"]])
+        offsets = array("I", [0])
+
+        if detection is not None:
+            # frameNum is the number of the frame in the video, with
+            # subsampling only every n:th frame is in the log. A shot starts
+            # at the first scored frame at or after its first frame.
+            frame_nums = [int(frame["frameNum"]) for frame in log["frames"]]
+            for timestamp in detection[1:-1]:
+                first_frame = int(round(float(timestamp) * frame_rate))
+                offsets.append(bisect.bisect_left(frame_nums, first_frame))
+
+        return VMAFFrames(scores, offsets)
+
+    @staticmethod
+    def from_shot_logs(log_locations):
+        """! Reads the json logs of the shots of a video, in shot order,
+            for example from videoprocess.vmaf_score_shots
+
+        @param log_locations    The filepaths of the logs
+
+        @return The VMAFFrames of the logs
+        """
+        scores = array("f")
+        offsets = array("I")
+
+        for log_location in log_locations:
+            offsets.append(len(scores))
+            scores.extend(log_frames(log_location))
+
+        return VMAFFrames(scores, offsets)
+
+    def statistics(self, per_shot=False):
+        """! The mean, harmonic mean, 1st and 5th percentile and min of the scores
+
+        @param per_shot     Also return the statistics of every shot
+
+        @return Dictionary with the statistics
+        """
+        scores = np.frombuffer(self.scores, dtype=np.float32).astype(np.float64)
+        result = pooled_statistics(scores)
+
+        if per_shot:
+            bounds = list(self.offsets) + [len(scores)]
+            result["shots"] = [pooled_statistics(scores[start:end])
+                               for start, end in zip(bounds[:-1], bounds[1:])]
+
+        return result
+
+    def save(self, location):
+        """! Writes the scores to a binary file
+
+        @param location     The filepath of the file
+        """
+        scores = array("f", self.scores)
+        offsets = array("I", self.offsets)
+
+        # The file is always stored as little endian
+        if sys.byteorder == "big":
+            scores.byteswap()
+            offsets.byteswap()
+
+        with open(location, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(scores), len(offsets)))
+            f.write(scores.tobytes())
+            f.write(offsets.tobytes())
+
+    @staticmethod
+    def load(location):
+        """! Reads the scores from a binary file
+
+        @param location     The filepath of the file
+
+        @return The VMAFFrames or None if the file is not valid
+        """
+        try:
+            with open(location, "rb") as f:
+                header = f.read(HEADER.size)
+                if len(header) != HEADER.size:
+                    return None
+
+                magic, count, shot_count = HEADER.unpack(header)
+                if magic != MAGIC:
+                    return None
+
+                scores = array("f")
+                scores.frombytes(f.read(count * scores.itemsize))
+                offsets = array("I")
+                offsets.frombytes(f.read(shot_count * offsets.itemsize))
+        except (OSError, ValueError):
+            return None
+
+        if len(scores) != count or len(offsets) != shot_count:
+            return None
+
+        if sys.byteorder == "big":
+            scores.byteswap()
+            offsets.byteswap()
+
+        return VMAFFrames(scores, offsets)
+
+
+def pooled_statistics(scores):
+    """! The statistics of a NumPy array of frame scores"""
+    if len(scores) == 0:
+        return {"frames": 0, "mean": 0.0, "harmonic_mean": 0.0,
+                "p1": 0.0, "p5": 0.0, "min": 0.0}
+
+    return {
+        "frames": int(len(scores)),
+        "mean": float(scores.mean()),
+        # Same pooling as libvmaf, shifted by one so scores of 0 are allowed
+        "harmonic_mean": float(len(scores) / np.sum(1.0 / (scores + 1.0)) - 1.0),
+        "p1": float(np.percentile(scores, 1)),
+        "p5": float(np.percentile(scores, 5)),
+        "min": float(scores.min()),
+    }
@@ -1,23 +1,62 @@
 from backend.videolib.encore import Encore
-from backend.videolib.encore_wrap import encore_transcode, concat_shots, create_normal, remux_videos
+from backend.videolib.encore_wrap import encore_transcode, assemble_videos, create_normal, JOB_OVERHEAD, start_audio_job
 import backend.videolib.videoprocess as vp
+from backend.videolib.sceneindex import scene_index
+from backend.videolib.shotcache import shot_cache
+from backend.videolib.vmafcache import json_vmaf_cache, vmaf_cache_key
+from backend.videolib.vmaflog import VMAFFrames, EXTENSION as VMAF_EXTENSION
 import time
 import json
 
 from uuid import uuid4
 
-def bitrate_vmaf_results(output_locations, original_source, vmaf_json):    
+def bitrate_vmaf_results(output_locations, original_source, vmaf_json, vmaf_location, vmaf_cache=None,
+                         frames_location=None):
+    if len(output_locations) == 0:
+        return {}
+
+    # the score of every frame is kept by cache key, with a sweep wide frames_location
+    # a score from the cache finds the frames that another job saved
+    if frames_location is None:
+        frames_location = vmaf_location
+
+    # outputs that were scored before, in this or an earlier sweep, are not scored again
+    keys = [vmaf_cache_key(original_source, location, vmaf_json) for location in output_locations]
+    missing = output_locations
+    if vmaf_cache is not None:
+        missing = [location for location, key in zip(output_locations, keys)
+                   if vmaf_cache.load(key) is None]
+
+    # the original is decoded once for the vmaf score of all outputs, the logs
+    # and the score of every frame are kept in vmaf_location and not next to the outputs
+    scores = vp.vmaf_score_batch(missing, original_source, vmaf_json, vmaf_location)
+    if scores is False:
+        raise Exception(f"Could not compute the VMAF scores of {len(missing)} outputs", vmaf_location)
+    vmaf_scores = dict(zip(missing, scores))
+
+    for count, location in enumerate(missing):
+        key = keys[output_locations.index(location)]
+        VMAFFrames.from_log(f"{vmaf_location}vmaf_{count}.json").save(f"{frames_location}{key}{VMAF_EXTENSION}")
+
     result = {}
-    for location in output_locations:
+    for location, key in zip(output_locations, keys):
         print(location)
         name = location.split("/")
         name = name[len(name)-1]
         name = name.split(".")
         name = name[0]
 
+        if vmaf_cache is not None:
+            vmaf = vmaf_cache.score(key, lambda: vmaf_scores[location])
+        else:
+            vmaf = vmaf_scores[location]
+
+        frames = VMAFFrames.load(f"{frames_location}{key}{VMAF_EXTENSION}")
+
         result[name] = {
             "bitrate": vp.bitrate_video(location),
-            "vmaf": vp.vmaf_score(location, original_source, vmaf_json)
+            "vmaf": vmaf,
+            "vmaf_stats": frames.statistics() if frames is not None else None
         }
         print(result)
 
@@ -44,7 +83,7 @@ def create_json_file(dict, file):
     with open(file, "w") as json_file:
         json.dump(dict, json_file, indent=4)
 
-def job(job_id, original_source, threshold, shot_length, url, vmaf_json_source, output_location, result_normal):
+def job(job_id, original_source, threshold, shot_length, url, vmaf_json_source, output_location, result_normal, detection=None, vmaf_cache=None, frames_location=None):
 
     start_time = time.time()
     output_location = f"{output_location}{job_id}/"
@@ -62,7 +101,6 @@ def job(job_id, original_source, threshold, shot_length, url, vmaf_json_source,
         return False
 
     only_audio = f"{temp_location}only_audio.wav"
-    vp.copy_audio(original_source, only_audio)
     
     container = original_source.split("/")
     container = container[len(container)-1]
@@ -70,12 +108,17 @@ def job(job_id, original_source, threshold, shot_length, url, vmaf_json_source,
     container = container[1]
 
     only_video = f"{temp_location}only_video.{container}"
-    vp.copy_video(original_source, only_video)
+    # audio and video are split in one read, the scenes come from the index of the sweep
+    vp.demux(original_source, only_audio, only_video)
+    # the audio is encoded while the shots are split and encoded
+    audio_id = start_audio_job(job_id, url, only_audio, temp_location)
     split_time = time.time() - start_time
 
-    shot_locations = vp.video_shot_split(only_video, temp_location, threshold, shot_length)
+    shot_locations = vp.video_shot_split(only_video, temp_location, threshold, shot_length, detection)
     shot_time = time.time() - start_time 
-    shot_locations, audio_locations, encore_time = encore_transcode(job_id, url, shot_locations, only_audio, temp_location)
+    # shots that an earlier job of the sweep already encoded come from the cache
+    cache = shot_cache(f"{output_location}../shot_cache/")
+    shot_locations, audio_locations, encore_time = encore_transcode(job_id, url, shot_locations, only_audio, temp_location, cache=cache, audio_id=audio_id)
 
     #gibberish
     delay = time.time() - start_time
@@ -83,11 +126,11 @@ def job(job_id, original_source, threshold, shot_length, url, vmaf_json_source,
     start_time += delay
     encore_time = time.time() - start_time
 
-    video_locations = concat_shots(shot_locations, temp_location)
-    outputs_remux = remux_videos(video_locations, audio_locations, keep_location)
+    outputs_remux = assemble_videos(shot_locations, audio_locations, temp_location, keep_location)
     remux_time = time.time() - start_time 
 
-    plain = bitrate_vmaf_results(outputs_remux["STEREO"], original_source, vmaf_json_source)
+    plain = bitrate_vmaf_results(outputs_remux["STEREO"], original_source, vmaf_json_source,
+                                 f"{temp_location}vmaf/", vmaf_cache, frames_location)
     diff = calc_diff_results(plain, result_normal)
 
     result = {
@@ -119,6 +162,9 @@ def main():
         shot_lengths = [0.5, 1, 1.5, 2, 2.5, 3, 6]
         #thresholds = [0.2]
         #shot_lengths = [1]
+        # Target duration of the Encore jobs, neighbouring shots are merged
+        # into chunks of about this length. 0 sends every shot as its own job.
+        chunk_duration = 0
     
         output_location = f"{output_location}output-{test_video}/"
         if not vp.make_dir(output_location):
@@ -126,23 +172,38 @@ def main():
     
         result = {}
     
+        # one vmaf cache for the whole sweep, the scores of all jobs go to the same file
+        # and the score of every frame to the same directory
+        vmaf_cache = json_vmaf_cache(f"{output_location}vmaf_cache.json")
+        frames_location = f"{output_location}vmaf_frames/"
+        if not vp.make_dir(frames_location):
+            return False
+
         encore = Encore(url)
         outputs_normal, normal_time = create_normal(encore, original_source, output_location)
-        result_normal = bitrate_vmaf_results(outputs_normal, original_source, vmaf_json_source)
+        result_normal = bitrate_vmaf_results(outputs_normal, original_source, vmaf_json_source,
+                                             f"{output_location}vmaf/", vmaf_cache, frames_location)
         result["normal"] = {
             "time": normal_time,
             "result":result_normal
         }
     
         result["per_shot"] = {}
+
+        index = scene_index(original_source, workers=None)
     
         for threshold in thresholds:
+            # the scene index is built from the original source once and every
+            # shot length of the threshold is merged from the same detection
+            detections = index.format_shot_detection_batch(threshold, shot_lengths)
             for shot_length in shot_lengths:
                 job_id = str(uuid4())
-                job_result = job(job_id, original_source, threshold, shot_length, url, vmaf_json_source, output_location, result_normal)
+                detection = vp.coalesce_shots(detections[shot_length], chunk_duration)
+                job_result = job(job_id, original_source, threshold, shot_length, url, vmaf_json_source, output_location, result_normal, detection, vmaf_cache, frames_location)
                 result["per_shot"][job_id] = {
                     "threshold": threshold,
                     "shot_length": shot_length,
+                    "coalesce": vp.coalesce_report(detections[shot_length], detection, JOB_OVERHEAD),
                     "result": job_result
                 }
                 create_json_file(result, f"./results/{test_video}-result.txt")